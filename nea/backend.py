@@ -0,0 +1,249 @@
+from abc import ABC, abstractmethod
+from typing import Self
+
+import numpy as np
+
+from fusion import fuse
+from gates import Gates, controlledMatrix, gateMatrix
+from kernels import combineDiagonals, combinePermutations
+from operation import Operation
+
+# The most qbits a run of diagonal or permutation gates is accumulated over before it is applied, by default
+RUN_WIDTH = 10
+COMBINE = {"diagonal": combineDiagonals, "permutation": combinePermutations}
+
+
+class Backend(ABC):
+    """
+    The parts every simulation backend shares: qbit and shot validation, the named gate shorthands and the run loop.
+    A backend sets n and must implement apply, so one without it cannot be created. It overrides the shorthands and
+    controlled where it has a faster path, and _special where it can accumulate runs of diagonal or permutation gates.
+    """
+
+    renormalise = 0  # Rescale the state to unit norm after every this many gates of a run, 0 never does
+    run_width = RUN_WIDTH  # The most qbits run accumulates diagonal or permutation gates over
+    fused = 0  # Number of gates removed by fusion in the last run
+
+    def _valid(self, *qubits: int) -> bool:
+        """
+        Checks that every qbit index is an in-range integer and that none are repeated
+        @param qubits: The qbit indices to check
+        @return: True if valid, else False
+        """
+        try:
+            assert all(type(qubit) is int and 0 <= qubit < self.n for qubit in qubits)
+            assert len(set(qubits)) == len(qubits)
+        except AssertionError:
+            print("E: Qbit indices must be distinct integers less than the size of the register")
+            return False
+        return True
+
+    @staticmethod
+    def _sized(gate: Gates | list | np.ndarray, qubits: tuple[int, ...]) -> bool:
+        """
+        Checks that a gate acts on as many qbits as were given, before a named gate is sent to its shorthand
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param qubits: The qbits the gate is applied to
+        @return: True if valid, else False
+        """
+        try:
+            assert np.shape(gateMatrix(gate)) == (1 << len(qubits), 1 << len(qubits))
+        except AssertionError:
+            print("E: The gate size does not match the number of qbits given")
+            return False
+        return True
+
+    @staticmethod
+    def _shots(shots: int) -> bool:
+        """
+        Checks the number of measurements asked of sample
+        @param shots: The number of measurements to take
+        @return: True if valid, else False
+        """
+        try:
+            assert type(shots) is int and shots > 0
+        except AssertionError:
+            print("E: 'shots' must be a positive integer")
+            return False
+        return True
+
+    @staticmethod
+    def _observable(observable: str | dict[str, float], n: int) -> tuple[list[str], np.ndarray] | bool:
+        """
+        Splits an observable into its Pauli strings and their coefficients, checking every string
+        @param observable: A Pauli string such as "XIZ" (qbit 0 first), or a dict of Pauli strings to coefficients
+        @param n: The number of qbits the strings must cover
+        @return: The strings and an array of their coefficients, else False
+        """
+        terms = {observable: 1.0} if isinstance(observable, str) else observable
+        try:
+            assert isinstance(terms, dict) and len(terms) > 0
+            assert all(isinstance(term, str) and len(term) == n and set(term) <= set("IXYZ") for term in terms)
+        except AssertionError:
+            print("E: Observables are Pauli strings of I, X, Y and Z with one letter per qbit, or a dict of them")
+            return False
+        return list(terms), np.array(list(terms.values()), dtype=np.float64)
+
+    @abstractmethod
+    def apply(self, gate: Gates | list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a gate to the given qbits, implemented by every backend
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param qubits: The qbits the gate acts on, controls first for controlled gates
+        @return: The register, else False
+        """
+
+    def controlled(self, gate: Gates | list | np.ndarray, controls: list[int], target: int | list[int],
+                   negative: list[int] | None = None) -> Self | bool:
+        """
+        Applies a gate to the targets where every control is |1> and every negative control is |0>, by default as
+        one full matrix over the controls and targets
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param controls: The control qbits
+        @param target: The target qbit, or a list of k target qbits
+        @param negative: Control qbits that must be |0> rather than |1>
+        @return: The register, else False
+        """
+        targets = [target] if isinstance(target, int) else list(target)
+        negative = list(negative or [])
+        if not self._valid(*controls, *negative, *targets):
+            return False
+        matrix = controlledMatrix(gate, (1,) * len(controls) + (0,) * len(negative))
+        return self.apply(matrix, *controls, *negative, *targets)
+
+    def cnot(self, control: int, target: int) -> Self | bool:
+        """
+        Controlled NOT, flips the target where the control is |1>
+        @param control: The control qbit
+        @param target: The target qbit
+        @return: The register, else False
+        """
+        return self.apply(Gates.CNOT, control, target)
+
+    def cz(self, control: int, target: int) -> Self | bool:
+        """
+        Controlled Z, negates the amplitudes where both qbits are |1>
+        @param control: The control qbit
+        @param target: The target qbit
+        @return: The register, else False
+        """
+        return self.apply(Gates.CZ, control, target)
+
+    def toffoli(self, first: int, second: int, target: int) -> Self | bool:
+        """
+        Doubly controlled NOT, flips the target where both controls are |1>
+        @param first: The first control qbit
+        @param second: The second control qbit
+        @param target: The target qbit
+        @return: The register, else False
+        """
+        return self.apply(Gates.TOFFOLI, first, second, target)
+
+    def swap(self, first: int, second: int) -> Self | bool:
+        """
+        Exchanges the states of two qbits
+        @param first: The first qbit
+        @param second: The second qbit
+        @return: The register, else False
+        """
+        return self.apply(Gates.SWAP, first, second)
+
+    def close(self) -> None:
+        """
+        Releases what the backend holds outside its own arrays, such as worker processes or files, nothing by default
+        @return: None
+        """
+
+    def __enter__(self) -> Self:
+        """
+        Lets a backend be used in a with block, which closes it at the end
+        @return: The register
+        """
+        return self
+
+    def __exit__(self, *exception) -> None:
+        """
+        Closes the backend on leaving the with block
+        @return: None
+        """
+        self.close()
+
+    def _special(self, operation: Operation) -> tuple[str, np.ndarray] | None:
+        """
+        Classifies an operation that run can accumulate with its neighbours, none by default
+        @param operation: Any operation
+        @return: ("diagonal", phases) or ("permutation", permutation), else None
+        """
+        return None
+
+    def _apply(self, operation: Operation) -> Self | bool:
+        """
+        Applies one operation, controlled gates through controlled so their full matrix is never built
+        @param operation: Any operation
+        @return: The register, else False
+        """
+        if operation.gate == "CONTROLLED":
+            values = operation.params
+            controls = operation.qubits[:len(values)]
+            return self.controlled(operation.unitary, [qubit for qubit, value in zip(controls, values) if value],
+                                   list(operation.qubits[len(values):]),
+                                   [qubit for qubit, value in zip(controls, values) if not value])
+        gate = operation.gate if isinstance(operation.gate, Gates) else operation.matrix()
+        return self.apply(gate, *operation.qubits)
+
+    def _combinable(self, kind: str, qubits: set[int]) -> bool:
+        """
+        Checks whether run may accumulate a gate of this kind over these qbits into one
+        @param kind: "diagonal" or "permutation"
+        @param qubits: Every qbit the combined gate would act on
+        @return: True if the combined gate may be applied in one sweep
+        """
+        return len(qubits) <= self.run_width
+
+    def _flush(self, pending: tuple[str, list[int], np.ndarray] | None) -> bool:
+        """
+        Applies an accumulated run of diagonal or permutation gates
+        @param pending: (kind, qubits, values) from run, or None if there is nothing to apply
+        @return: True, else False if the gate could not be applied
+        """
+        if pending is None:
+            return True
+        kind, qubits, values = pending
+        method = self.diagonal if kind == "diagonal" else self.permute
+        return method(values, *qubits) is not False
+
+    def run(self, operations: list[Operation], fusion: bool = False, width: int = 2) -> Self | bool:
+        """
+        Applies a list of operations in order, optionally fusing adjacent gates first.
+        On backends with diagonal and permutation kernels, consecutive diagonal gates (Z, PHASE, T, CZ, RZ, ...) are
+        multiplied into one phase vector, and consecutive permutation gates (X, CNOT, SWAP, TOFFOLI) composed into one
+        permutation, over at most run_width qbits, so each run sweeps the state once.
+        @param operations: The gates to apply
+        @param fusion: If True, runs of gates on at most 'width' qbits are multiplied together before execution
+        @param width: The largest number of qbits a fused gate may act on
+        @return: The register, else False
+        """
+        self.fused = 0
+        if fusion:
+            operations, self.fused = fuse(operations, width)
+        pending = None  # (kind, qubits, values) of the run of diagonal or permutation gates not yet applied
+        for count, operation in enumerate(operations, 1):
+            special = self._special(operation)
+            if special is not None and pending is not None and special[0] == pending[0] and \
+                    self._combinable(special[0], set(pending[1]) | set(operation.qubits)):
+                pending = (special[0], *COMBINE[special[0]](pending[1], pending[2], list(operation.qubits),
+                                                            special[1]))
+            else:
+                if not self._flush(pending):
+                    return False
+                pending = None if special is None else (special[0], list(operation.qubits), special[1])
+                if special is None and self._apply(operation) is False:
+                    return False
+            if self.renormalise and count % self.renormalise == 0:
+                if not self._flush(pending):
+                    return False
+                pending = None
+                self.normalise()
+        if not self._flush(pending):
+            return False
+        return self
@@ -0,0 +1,211 @@
+from typing import Self
+
+import numpy as np
+
+from backend import RUN_WIDTH
+from gates import Gates, gateMatrix, parameterised
+from kernels import (applyControlledBatch, applyDiagonalBatch, applyMatrixBatch, applyPermutationBatch,
+                     applySingleBatch, applySwapBatch, permutationOf, sampleCounts)
+from register import PRECISIONS, Register
+
+
+class BatchRegister(Register):
+    """
+    B independent registers of n qbits stored as one (B, 2^n) array, e.g. one row per point of a parameter sweep.
+    Every gate is applied to all B rows in one vectorised call, and parameterised gates take a vector of B angles
+    so each row can be rotated by a different amount. The gate API is the same as Register.
+    """
+
+    def __init__(self, n: int, batch: int, dirac: int = 0, dtype: type = np.complex128, renormalise: int = 0) -> None:
+        """
+        Initialises every row in the same computational basis state
+        @param n: The number of qbits in each register
+        @param batch: The number of registers B
+        @param dirac: The basis state to start in, qbit 0 being the leftmost symbol in dirac notation (e.g. |0>)
+        @param dtype: The precision of the amplitudes, np.complex64 or np.complex128
+        @param renormalise: Rescale every row to unit norm after every this many gates of a run, 0 never does
+        @return: None
+        """
+        try:
+            assert type(n) is int and type(dirac) is int and n > 0 and 0 <= dirac < (1 << n)
+            assert type(batch) is int and batch > 0
+            assert dtype in PRECISIONS and type(renormalise) is int and renormalise >= 0
+        except AssertionError:
+            print("E: 'n' and 'batch' must be positive integers, 'dirac' must fit in n bits and 'dtype' must be "
+                  "np.complex64 or np.complex128")
+            exit(1)
+        self.n = n
+        self.batch = batch
+        self.state = np.zeros((batch, 1 << n), dtype=dtype)
+        self.state[:, dirac] = 1
+        self.threads = 1
+        self.renormalise = renormalise
+        self.run_width = RUN_WIDTH
+        self.fused = 0
+
+    @classmethod
+    def fromState(cls, state: np.ndarray) -> Self:
+        """
+        Wraps an existing (B, 2^n) amplitude array as a batch without copying it, e.g. a batch of different inputs
+        @param state: Contiguous complex array of shape (B, 2^n)
+        @return: The batch register
+        """
+        register = cls.__new__(cls)
+        register.batch, size = state.shape
+        register.n = size.bit_length() - 1
+        register.state = state
+        register.threads = 1
+        register.renormalise = 0
+        register.run_width = RUN_WIDTH
+        register.fused = 0
+        return register
+
+    def _matrix(self, gate: Gates | list | np.ndarray, size: int) -> np.ndarray | bool:
+        """
+        Converts a gate to a shared matrix or a stack of one matrix per row, checking its shape
+        @param gate: A Gates member, a size x size matrix or a (B, size, size) array
+        @param size: The expected size of each matrix
+        @return: The complex matrix or matrices, else False
+        """
+        matrix = gateMatrix(gate)
+        try:
+            assert matrix.shape in ((size, size), (self.batch, size, size))
+        except AssertionError:
+            print("E: The gate size does not match the number of qbits given, or the batch size")
+            return False
+        return self._cast(matrix)
+
+    def apply(self, gate: Gates | list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a gate to the given qbits of every row
+        @param gate: A Gates member, a 2^k x 2^k matrix, or a (B, 2^k, 2^k) array with one matrix per row
+        @param qubits: The qbits the gate acts on, controls first for controlled gates
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        if isinstance(gate, Gates):
+            if not self._sized(gate, qubits):
+                return False
+            match gate:
+                case Gates.CNOT:
+                    return self.cnot(*qubits)
+                case Gates.CZ:
+                    return self.cz(*qubits)
+                case Gates.SWAP:
+                    return self.swap(*qubits)
+                case Gates.TOFFOLI:
+                    return self.toffoli(*qubits)
+        matrix = self._matrix(gate, 1 << len(qubits))
+        if matrix is False:
+            return False
+        if matrix.ndim == 2 and np.count_nonzero(matrix) == np.count_nonzero(np.diagonal(matrix)):
+            return self.diagonal(np.diagonal(matrix), *qubits)
+        permutation = permutationOf(matrix)
+        if permutation is not None:
+            return self.permute(permutation, *qubits)
+        if len(qubits) == 1:
+            applySingleBatch(self.state, matrix, qubits[0], self.n)
+        else:
+            applyMatrixBatch(self.state, matrix, list(qubits), self.n)
+        return self
+
+    def diagonal(self, phases: list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a diagonal gate shared by the batch to every row, see Register.diagonal
+        @param phases: The 2^k diagonal entries, the first qbit being the most significant
+        @param qubits: The k qbits the gate acts on
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        try:
+            assert np.shape(phases) == (1 << len(qubits),)
+        except AssertionError:
+            print("E: A diagonal gate needs 2^k phases for k qbits")
+            return False
+        applyDiagonalBatch(self.state, np.asarray(phases, dtype=self.state.dtype), list(qubits), self.n)
+        return self
+
+    def permute(self, permutation: list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a permutation gate shared by the batch to every row, see Register.permute
+        @param permutation: Entry i is the basis state of the k qbits that |i> is sent to
+        @param qubits: The k qbits the gate acts on
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        try:
+            assert np.array_equal(np.sort(permutation), np.arange(1 << len(qubits)))
+        except AssertionError:
+            print("E: A permutation gate needs each of the 2^k basis states of its k qbits exactly once")
+            return False
+        applyPermutationBatch(self.state, np.asarray(permutation), list(qubits), self.n)
+        return self
+
+    def controlled(self, gate: Gates | list | np.ndarray, controls: list[int], target: int | list[int],
+                   negative: list[int] | None = None) -> Self | bool:
+        """
+        Applies a gate to the targets of every row where every control is |1> and every negative control is |0>
+        @param gate: A Gates member, a 2^k x 2^k matrix or a (B, 2^k, 2^k) array
+        @param controls: The control qbits
+        @param target: The target qbit, or a list of k target qbits
+        @param negative: Control qbits that must be |0> rather than |1>
+        @return: The register, else False
+        """
+        targets = [target] if isinstance(target, int) else list(target)
+        negative = list(negative or [])
+        if not self._valid(*controls, *negative, *targets):
+            return False
+        matrix = self._matrix(gate, 1 << len(targets))
+        if matrix is False:
+            return False
+        fixed = {control: 1 for control in controls} | {control: 0 for control in negative}
+        applyControlledBatch(self.state, matrix, fixed, targets, self.n)
+        return self
+
+    def swap(self, first: int, second: int) -> Self | bool:
+        """
+        Exchanges the states of two qbits in every row
+        @param first: The first qbit
+        @param second: The second qbit
+        @return: The register, else False
+        """
+        if not self._valid(first, second):
+            return False
+        applySwapBatch(self.state, first, second, self.n)
+        return self
+
+    def rotate(self, name: str, qubit: int, *angles: float | np.ndarray) -> Self | bool:
+        """
+        Applies a parameterised gate, each angle being one value for the whole batch or a vector of B values
+        @param name: One of RX, RY, RZ or U3
+        @param qubit: The qbit the gate acts on
+        @param angles: The angles in radians, theta for the rotations or theta, phi, lambda for U3
+        @return: The register, else False
+        """
+        matrix = parameterised(name, *angles)
+        if matrix is False:
+            return False
+        return self.apply(matrix, qubit)
+
+    def sample(self, shots: int = 1, seed: int | None = None) -> list[dict[str, int]] | bool:
+        """
+        Measures every row many times without collapsing them
+        @param shots: The number of measurements to take of each row
+        @param seed: Optional seed for reproducible histograms
+        @return: One histogram per row keyed by bitstring (qbit 0 first), else False
+        """
+        if not self._shots(shots):
+            return False
+        rng = np.random.default_rng(seed)
+        counts = [sampleCounts(row, shots, self.n, rng.integers(1 << 32)) for row in self.state]
+        return False if False in counts else counts
+
+    def __repr__(self) -> str:
+        """
+        Returns the non-zero amplitudes of every row using dirac notation
+        @return: String representation of the batch, one row per line
+        """
+        return "\n".join(repr(Register.fromState(row)) for row in self.state)
@@ -0,0 +1,234 @@
+import sys
+from math import pi
+from timeit import timeit
+
+import numpy as np
+
+from batch import BatchRegister
+from gates import Gates, matrixMultiplication
+from kernels import applyMatrix
+from operation import Operation
+from qbit import Qbit
+from register import Register
+from sharded import ShardedRegister
+from stabilizer import StabilizerRegister
+from vector import Vector
+
+
+# Rough timings for the hot paths of the simulator, run with "python benchmarks.py"
+# Each benchmark prints its own results so they can be compared between commits
+
+def benchVectorAccess(size: int = 100000, repeats: int = 5) -> dict[str, float]:
+    """
+    Compares the per-element cost of the validated and unchecked Vector element paths
+    @param size: The number of elements in the vector
+    @param repeats: The number of times each loop is timed
+    @return: Nanoseconds per element for each path
+    """
+    vec = Vector(size)
+    indices = range(size)
+
+    def validated_set():
+        for i in indices:
+            vec.setElement(i, 0.5)
+
+    def unchecked_set():
+        for i in indices:
+            vec._set(i, 0.5)
+
+    def validated_get():
+        for i in indices:
+            vec.getElement(i)
+
+    def unchecked_get():
+        for i in indices:
+            vec._get(i)
+
+    def validated_scalar_mul():
+        # The previous scalarMul built its result one setElement call at a time
+        result = Vector(size)
+        for i, element in enumerate(vec.vector):
+            result.setElement(i, 2.0 * element)
+
+    def scalar_mul():
+        vec.scalarMul(2.0)
+
+    results = {}
+    for name, func in (("setElement", validated_set), ("_set", unchecked_set),
+                       ("getElement", validated_get), ("_get", unchecked_get),
+                       ("scalarMul (per-element setElement)", validated_scalar_mul), ("scalarMul", scalar_mul)):
+        results[name] = timeit(func, number=repeats) / (repeats * size) * 1e9
+        print(f"{name:>36}: {results[name]:8.1f} ns/element")
+    print(f"{'instance size':>36}: {sys.getsizeof(vec)} bytes, has __dict__: {hasattr(vec, '__dict__')}")
+    return results
+
+
+def benchSharded(n: int = 24, workers: tuple[int, ...] = (1, 2, 4, 8)) -> dict[int, float]:
+    """
+    Times a Hadamard on every qbit of a register with the single process Register and with the sharded register
+    @param n: The number of qbits
+    @param workers: The worker counts to try
+    @return: Seconds per gate for each worker count, 0 being the single process register
+    """
+    results = {}
+    register = Register(n)
+    results[0] = timeit(lambda: [register.apply(Gates.HADAMARD, qubit) for qubit in range(n)], number=1) / n
+    print(f"{'Register':>36}: {results[0] * 1e3:8.1f} ms/gate")
+    for count in workers:
+        sharded = ShardedRegister(n, workers=count)
+        results[count] = timeit(lambda: [sharded.apply(Gates.HADAMARD, qubit) for qubit in range(n)], number=1) / n
+        print(f"{f'ShardedRegister ({sharded.workers} workers)':>36}: {results[count] * 1e3:8.1f} ms/gate")
+        sharded.close()
+    return results
+
+
+def benchThreads(n: int = 22, threads: tuple[int, ...] = (1, 2, 4, 8), dense: int = 11) -> dict[str, float]:
+    """
+    Times a Hadamard on every qbit with the thread pool kernels, against the single threaded matrixMultiplication
+    path. matrixMultiplication needs the full 2^n x 2^n gate so it is only run on a smaller 'dense' register.
+    @param n: The number of qbits for the kernel timings
+    @param threads: The thread counts to try
+    @param dense: The number of qbits for the matrixMultiplication timing
+    @return: Seconds per gate for each configuration
+    """
+    results = {}
+    bit = Qbit(0, dense, array=True)
+    hadamard = np.asarray(Gates.HADAMARD.value)
+    operators = [np.kron(np.kron(np.eye(1 << qubit), hadamard), np.eye(1 << (dense - qubit - 1)))
+                 for qubit in range(dense)]
+    results[f"matrixMultiplication n={dense}"] = timeit(
+        lambda: [matrixMultiplication(operator, bit) for operator in operators], number=1) / dense
+    small = Register(dense)
+    results[f"Register n={dense}"] = timeit(
+        lambda: [small.apply(Gates.HADAMARD, qubit) for qubit in range(dense)], number=1) / dense
+    for count in threads:
+        register = Register(n, threads=count)
+        results[f"Register n={n} threads={count}"] = timeit(
+            lambda: [register.apply(Gates.HADAMARD, qubit) for qubit in range(n)], number=1) / n
+    for name, seconds in results.items():
+        print(f"{name:>36}: {seconds * 1e3:8.2f} ms/gate")
+    return results
+
+
+def benchBatch(n: int = 10, points: int = 1000) -> dict[str, float]:
+    """
+    Times a parameter sweep of a small circuit as a Python loop over Registers and as one BatchRegister run
+    @param n: The number of qbits
+    @param points: The number of angles in the sweep
+    @return: Seconds for the whole sweep with each approach
+    """
+    angles = np.linspace(0, np.pi, points)
+
+    def circuit(angle):
+        return ([Operation(Gates.HADAMARD, (qubit,)) for qubit in range(n)] +
+                [Operation("RY", (qubit,), params=(angle,)) for qubit in range(n)] +
+                [Operation(Gates.CNOT, (qubit, qubit + 1)) for qubit in range(n - 1)])
+
+    results = {"Register loop": timeit(lambda: [Register(n).run(circuit(angle)) for angle in angles], number=1),
+               "BatchRegister": timeit(lambda: BatchRegister(n, points).run(circuit(angles)), number=1)}
+    for name, seconds in results.items():
+        print(f"{name:>36}: {seconds * 1e3:8.1f} ms/sweep")
+    return results
+
+
+def benchStabilizer(n: int = 2000, shots: int = 1000) -> dict[str, float]:
+    """
+    Times a GHZ circuit and sampling on the stabilizer tableau, far beyond the size any statevector could hold
+    @param n: The number of qbits
+    @param shots: The number of samples drawn
+    @return: Seconds for the circuit and for the sampling
+    """
+    tableau = StabilizerRegister(n)
+
+    def ghz():
+        tableau.apply(Gates.HADAMARD, 0)
+        for qubit in range(n - 1):
+            tableau.cnot(qubit, qubit + 1)
+
+    results = {f"GHZ circuit n={n}": timeit(ghz, number=1),
+               f"sample {shots} shots": timeit(lambda: tableau.sample(shots, seed=0), number=1)}
+    for name, seconds in results.items():
+        print(f"{name:>36}: {seconds * 1e3:8.1f} ms")
+    return results
+
+
+def benchPrecision(n: int = 22, layers: int = 3) -> dict[str, float]:
+    """
+    Times the same circuit in double and single precision, where single precision moves half the bytes per gate
+    @param n: The number of qbits
+    @param layers: The number of entangling and rotation layers
+    @return: Seconds for the circuit in each precision
+    """
+    operations = [Operation(Gates.HADAMARD, (qubit,)) for qubit in range(n)]
+    for _ in range(layers):
+        operations += [Operation(Gates.CNOT, (qubit, qubit + 1)) for qubit in range(n - 1)]
+        operations += [Operation("RY", (qubit,), params=(0.1 * qubit,)) for qubit in range(n)]
+    results = {f"complex128 n={n}": timeit(lambda: Register(n).run(operations), number=1),
+               f"complex64 n={n}": timeit(lambda: Register(n, dtype=np.complex64).run(operations), number=1)}
+    for name, seconds in results.items():
+        print(f"{name:>36}: {seconds * 1e3:8.1f} ms/circuit")
+    return results
+
+
+def benchDiagonal(n: int = 20) -> dict[str, float]:
+    """
+    Times the controlled phase ladders of a QFT applied as dense 4x4 matrices and through Register.run, which
+    accumulates each ladder into one phase vector
+    @param n: The number of qbits
+    @return: Seconds for the circuit with each approach
+    """
+    operations = []
+    for target in range(n):
+        operations.append(Operation(Gates.HADAMARD, (target,)))
+        operations += [Operation("UNITARY", (control, target),
+                                 np.diag([1, 1, 1, np.exp(1j * pi / (1 << (control - target)))]))
+                       for control in range(target + 1, n)]
+
+    def dense():
+        register = Register(n)
+        for operation in operations:
+            applyMatrix(register.state, operation.matrix(), list(operation.qubits), n)
+
+    results = {f"dense ladders n={n}": timeit(dense, number=1),
+               f"phase vectors n={n}": timeit(lambda: Register(n).run(operations), number=1)}
+    for name, seconds in results.items():
+        print(f"{name:>36}: {seconds * 1e3:8.1f} ms/circuit")
+    return results
+
+
+def benchPermutation(n: int = 20, layers: int = 4) -> dict[str, float]:
+    """
+    Times reversible logic (X, CNOT, TOFFOLI and SWAP layers) applied as dense matrices and through Register.run,
+    which composes each run into one permutation and moves amplitude blocks without arithmetic
+    @param n: The number of qbits
+    @param layers: The number of layers of logic
+    @return: Seconds for the circuit with each approach
+    """
+    operations = [Operation(Gates.HADAMARD, (qubit,)) for qubit in range(n)]
+    for _ in range(layers):
+        operations += [Operation(Gates.CNOT, (qubit, qubit + 1)) for qubit in range(8)]
+        operations += [Operation(Gates.TOFFOLI, (qubit, qubit + 1, qubit + 2)) for qubit in range(7)]
+        operations += [Operation(Gates.PAULI_X, (qubit,)) for qubit in range(0, 9, 2)]
+        operations += [Operation(Gates.SWAP, (qubit, 9 - qubit)) for qubit in range(4)]
+
+    def dense():
+        register = Register(n)
+        for operation in operations:
+            applyMatrix(register.state, operation.matrix(), list(operation.qubits), n)
+
+    results = {f"dense logic n={n}": timeit(dense, number=1),
+               f"permutations n={n}": timeit(lambda: Register(n).run(operations), number=1)}
+    for name, seconds in results.items():
+        print(f"{name:>36}: {seconds * 1e3:8.1f} ms/circuit")
+    return results
+
+
+if __name__ == '__main__':
+    benchVectorAccess()
+    benchSharded()
+    benchThreads()
+    benchBatch()
+    benchStabilizer()
+    benchPrecision()
+    benchDiagonal()
+    benchPermutation()
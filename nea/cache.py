@@ -0,0 +1,198 @@
+import io
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from hashlib import sha256
+
+import numpy as np
+
+from gates import ANGLE_DECIMALS, Gates
+from operation import Operation
+
+
+def circuitKey(n: int, operations: list[Operation], kind: str, dirac: int = 0, seed: int | None = None,
+               shots: int | None = None) -> str:
+    """
+    Builds a canonical hash of everything that determines a simulation result, so equal circuits share an entry
+    however they were built. Angles and matrices are rounded like the gate cache so float noise still hits.
+    @param n: The number of qbits
+    @param operations: The gates in execution order
+    @param kind: What is being cached, e.g. "state" or "sample"
+    @param dirac: The initial basis state
+    @param seed: The sampling seed
+    @param shots: The number of samples
+    @return: Hex sha256 digest
+    """
+    digest = sha256(json.dumps([kind, n, dirac, seed, shots]).encode())
+    for operation in operations:
+        name = operation.gate.name if isinstance(operation.gate, Gates) else operation.gate
+        digest.update(f"|{name}{operation.qubits}".encode())
+        for param in operation.params:
+            digest.update(np.round(np.asarray(param, dtype=np.float64), ANGLE_DECIMALS).tobytes() + b",")
+        if operation.unitary is not None:
+            digest.update(np.round(np.asarray(operation.unitary, dtype=np.complex128), ANGLE_DECIMALS).tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Content-addressed store of simulation results: final statevectors and sample histograms keyed by circuitKey.
+    An in-memory LRU tier is checked first, then an optional sqlite file next to master.db that survives between
+    runs of the editor. Both tiers evict their least recently used entries once over their size budget.
+    """
+
+    def __init__(self, budget: int = 64 << 20, disk: bool = False, path: str = "results.db",
+                 disk_budget: int = 1 << 30, largest: int = 16 << 20) -> None:
+        """
+        Creates an empty cache
+        @param budget: The most bytes of results held in memory
+        @param largest: The most bytes of a single result held in memory, so one large unitary cannot evict every
+        other entry
+        @param disk: If True, results are also written to a sqlite file
+        @param path: The sqlite file, by default in the working directory beside master.db
+        @param disk_budget: The most bytes of results held on disk
+        @return: None
+        """
+        self.budget = budget
+        self.largest = largest
+        self.disk_budget = disk_budget
+        self.entries: OrderedDict[str, tuple[np.ndarray | dict[str, int], int]] = OrderedDict()
+        self.size = 0  # Bytes of results held in memory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.conn = None
+        if disk:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, kind TEXT, payload BLOB,
+                              size INTEGER, used REAL)''')
+            self.conn.commit()
+
+    @staticmethod
+    def _encode(value: np.ndarray | dict[str, int]) -> tuple[str, bytes]:
+        """
+        Serialises a result for the disk tier
+        @param value: A statevector or a histogram
+        @return: The kind of value and its bytes
+        """
+        if isinstance(value, np.ndarray):
+            buffer = io.BytesIO()
+            np.save(buffer, value, allow_pickle=False)
+            return "array", buffer.getvalue()
+        return "counts", json.dumps(value).encode()
+
+    @staticmethod
+    def _decode(kind: str, payload: bytes) -> np.ndarray | dict[str, int]:
+        """
+        Deserialises a result from the disk tier
+        @param kind: "array" or "counts"
+        @param payload: The stored bytes
+        @return: The statevector or histogram
+        """
+        if kind == "array":
+            return np.load(io.BytesIO(payload), allow_pickle=False)
+        return json.loads(payload)
+
+    def _remember(self, key: str, value: np.ndarray | dict[str, int], size: int) -> None:
+        """
+        Adds a result to the memory tier, evicting the least recently used results until it fits the budget
+        @param key: The circuit key
+        @param value: The result
+        @param size: The size of the result in bytes
+        @return: None
+        """
+        if size > min(self.budget, self.largest):
+            return
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False  # Shared between every caller, so it must not be changed in place
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.budget:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def get(self, key: str) -> np.ndarray | dict[str, int] | None:
+        """
+        Looks up a result, moving it to the most recently used position
+        @param key: The circuit key
+        @return: A read-only statevector or a copy of the histogram, else None
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            value = self.entries[key][0]
+            return dict(value) if isinstance(value, dict) else value
+        if self.conn is not None:
+            row = self.conn.execute("SELECT kind, payload, size FROM results WHERE key=?", (key,)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE results SET used=? WHERE key=?", (time.time(), key))
+                self.conn.commit()
+                self.disk_hits += 1
+                value = self._decode(row[0], row[1])
+                self._remember(key, value, row[2])
+                return dict(value) if isinstance(value, dict) else value
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: np.ndarray | dict[str, int]) -> None:
+        """
+        Stores a result in memory, and on disk if enabled
+        @param key: The circuit key
+        @param value: A statevector or a histogram
+        @return: None
+        """
+        if key in self.entries:
+            return
+        kind, payload = self._encode(value)
+        size = value.nbytes if isinstance(value, np.ndarray) else len(payload)
+        if isinstance(value, np.ndarray):
+            value = value.copy()  # The caller may keep changing its array
+        else:
+            value = dict(value)
+        self._remember(key, value, size)
+        if self.conn is not None and size <= self.disk_budget:
+            self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                              (key, kind, payload, size, time.time()))
+            total = self.conn.execute("SELECT SUM(size) FROM results").fetchone()[0]
+            while total > self.disk_budget:
+                oldest, size = self.conn.execute("SELECT key, size FROM results ORDER BY used LIMIT 1").fetchone()
+                self.conn.execute("DELETE FROM results WHERE key=?", (oldest,))
+                total -= size
+                self.evictions += 1
+            self.conn.commit()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the hit and miss counters and the memory in use
+        @return: Counters keyed by name
+        """
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "bytes": self.size}
+
+    def clear(self) -> None:
+        """
+        Empties both tiers and resets the counters
+        @return: None
+        """
+        self.entries.clear()
+        self.size = self.hits = self.disk_hits = self.misses = self.evictions = 0
+        if self.conn is not None:
+            self.conn.execute("DELETE FROM results")
+            self.conn.commit()
+
+    def close(self) -> None:
+        """
+        Closes the disk tier
+        @return: None
+        """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# Shared in-memory cache used by Circuit unless another one is given. It lives as long as the process, so it is kept
+# small: 64 MiB in all, no single result over 16 MiB (a 20 qbit statevector), and results.clear() empties it
+results = ResultCache()
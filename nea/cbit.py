@@ -5,12 +5,13 @@ from vector import Vector
 class Cbit(Vector):
     """Classical bit vector form implementation"""
 
-    def __init__(self, dirac: int, sub: int | None = None) -> None:
+    def __init__(self, dirac: int, sub: int | None = None, array: bool = False) -> None:
         """
            Creates either a Cbit vector or a tensor product if multiple bits are supplied.
            @param dirac: Refers to the integer that would be shown in the symbol used in dirac notation (e.g. |0>) 
            @param sub: Refers to the number of bits (elements) to be used in the vector form.
            It is the subscript of dirac notation, by default, it is the minimum number required
+           @param array: If True the state is stored as a contiguous complex128 numpy array
            @return: None
         """
         self.Cbit = None
@@ -45,30 +46,16 @@ class Cbit(Vector):
 
         ###################################################################
 
-        # If there are multiple bits, rather than make a cbit vector, calculate their tensor product
+        # If there are multiple bits, rather than make a cbit vector, store their tensor product
         if self.__sub == 1:
-            super().__init__(size=2)
-            self.Cbit = Vector(2)
-            self.Cbit.setElement(int(abs(0 - int(self.__dirac))), 1)
+            super().__init__(size=2, array=array)
+            self.Cbit = Vector(2, array)
+            self.Cbit._set(int(abs(0 - int(self.__dirac))), 1)
         else:
-            self.__dirac.split()
-            tensor_prod = None
-            for count, ele in enumerate(self.__dirac):
-                ele = int(ele)
-                if count == 0:
-                    continue
-                element = Vector(2)
-                element.setElement(int(abs(0 - ele)), 1)
-                # Makes the vector (0,1) if the element is 1 and (1,0) if the element is 0
-                if tensor_prod is None:
-                    last_element = Vector(2)
-                    last_element.setElement(int(abs(0 - int(self.__dirac[count - 1]))), 1)
-                    # Adjusts the vector in the same way as the last comment
-                else:
-                    last_element = tensor_prod
-                tensor_prod = element.tensor(last_element)
-
-            self.Cbit = tensor_prod
+            # The tensor product of basis vectors is itself a basis vector, a single 1 at index 'dirac', so it is
+            # written straight into a preallocated buffer rather than built from a chain of tensor calls
+            self.Cbit = Vector(2 ** self.__sub, array)
+            self.Cbit._set(dirac, 1)
 
     # @override
     def setElement(self, index: int, value: float) -> bool:
@@ -91,7 +78,7 @@ class Cbit(Vector):
                     "E: Value can only take 0 or 1")  # Checks to see if the element you're trying to add is valid for
                 # the format of Cbits
                 return False
-        self.Cbit.vector[index] = value
+        self.Cbit._set(index, value)
         return True
 
     def measure(self) -> int | bool:
@@ -103,7 +90,7 @@ class Cbit(Vector):
         if len(self.Cbit.vector) != 2:
             return False
         else:
-            return self.Cbit.vector[1]
+            return self.Cbit._get(1)
 
     def probcollapse(self) -> None:
         """
@@ -114,7 +101,7 @@ class Cbit(Vector):
         print("Probability of collapse: ")
         for count, element in enumerate(self.Cbit.vector):
             state = int(size - len("{0:b}".format(count))) * "0" + "{0:b}".format(count)
-            percent = element ** 2
+            percent = abs(element) ** 2
             print(f"|{state}>, {percent * 100}%")
         return None
 
@@ -123,4 +110,4 @@ class Cbit(Vector):
         Returns a friendly version of the cbit object using typical notation
         @return: String representation of vector
         """
-        return "(" + str(self.Cbit.vector)[1:-1] + ")"
+        return repr(self.Cbit)
@@ -0,0 +1,366 @@
+from inspect import signature
+from time import perf_counter
+from typing import Any, Callable, Self
+
+import numpy as np
+
+import cache
+import gates
+from batch import BatchRegister
+from cache import ResultCache, circuitKey
+from gates import Gates, PARAMETERISED
+from mps import MPSRegister
+from operation import Operation, depth
+from optimiser import optimise
+from outofcore import OutOfCoreRegister
+from register import Register
+from sharded import ShardedRegister
+from sparse import SparseRegister
+from stabilizer import StabilizerRegister, isClifford
+
+DENSE_LIMIT = 26  # The largest register "auto" simulates densely, 2^26 amplitudes take 1 GiB
+UNITARY_LIMIT = 12  # The largest circuit unitary() builds, 2^24 entries take 256 MiB
+
+# Backends a circuit can run on, each made from the number of qbits and the keyword options given to Circuit.run.
+# Every backend has a run(operations, fusion, width) method, more can be added with addBackend.
+BACKENDS: dict[str, Callable[..., Any]] = {
+    "dense": Register,
+    "sparse": SparseRegister,
+    "mps": MPSRegister,
+    "stabilizer": StabilizerRegister,
+    "outofcore": OutOfCoreRegister,
+    "sharded": ShardedRegister,
+}
+
+
+def addBackend(name: str, factory: Callable[..., Any]) -> None:
+    """
+    Makes a backend available to Circuit.run
+    @param name: The name passed as Circuit.run's backend
+    @param factory: Called with the number of qbits and any keyword options, returns an object with a run method
+    @return: None
+    """
+    BACKENDS[name] = factory
+
+
+def unitary(circuit: "Circuit", fusion: bool = True, width: int = 2,
+            results: ResultCache | None = cache.results) -> np.ndarray | bool:
+    """
+    Builds the 2^n x 2^n matrix of a whole circuit by running it on every basis state at once: the identity is
+    stored as a batch of 2^n rows and each gate is applied to all of them in place, costing 2^n times a statevector
+    run instead of a 2^n x 2^n matrix product per gate. Row j ends as U|j>, so the unitary is its transpose.
+    @param circuit: The circuit, at most UNITARY_LIMIT qbits and with no batched parameters
+    @param fusion: If True, runs of adjacent gates are fused before they are applied
+    @param width: The largest number of qbits a fused gate may act on
+    @param results: The cache to look in and store into, None to always build the matrix
+    @return: The unitary indexed [output, input], read-only when it came from the cache, else False
+    """
+    try:
+        assert circuit.n <= UNITARY_LIMIT and not circuit.batch()
+    except AssertionError:
+        print(f"E: Unitaries can only be built for unbatched circuits of at most {UNITARY_LIMIT} qbits")
+        return False
+    key = circuitKey(circuit.n, circuit.operations, "unitary")
+    matrix = None if results is None else results.get(key)
+    if matrix is None:
+        columns = BatchRegister.fromState(np.eye(1 << circuit.n, dtype=np.complex128))
+        if columns.run(circuit.operations, fusion, width) is False:
+            return False
+        matrix = np.ascontiguousarray(columns.state.T)
+        if results is not None:
+            results.put(key, matrix)
+    return matrix
+
+
+class Circuit(object):
+    """
+    An ordered list of gate operations on n qbits that is built first and executed later, so it can be inspected,
+    optimised, cached or batched as a whole. Gates are added with append, or by calling the usual gates.H, gates.CNOT,
+    etc. with qbit indices inside a "with circuit:" block, which records them instead of executing them.
+    """
+
+    def __init__(self, n: int, operations: list[Operation] | None = None) -> None:
+        """
+        Creates a circuit
+        @param n: The number of qbits
+        @param operations: Optional operations to start from
+        @return: None
+        """
+        try:
+            assert type(n) is int and n > 0
+        except AssertionError:
+            print("E: 'n' must be a positive integer")
+            exit(1)
+        self.n = n
+        self.operations: list[Operation] = list(operations or [])
+        self._previous = None  # The circuit that was recording before this one, restored on exit
+
+    def append(self, gate: Gates | str | list | np.ndarray, *qubits: int,
+               params: tuple[float | np.ndarray, ...] = ()) -> Self | bool:
+        """
+        Adds one gate to the end of the circuit
+        @param gate: A Gates member, the name of a parameterised gate (RX, RY, RZ, U3) or a 2^k x 2^k matrix
+        @param qubits: The qbits the gate acts on, controls first for controlled gates
+        @param params: The angles of a parameterised gate, arrays of B angles make the circuit batched
+        @return: The circuit, else False
+        """
+        try:
+            assert all(type(qubit) is int and 0 <= qubit < self.n for qubit in qubits)
+            assert len(set(qubits)) == len(qubits) > 0
+            assert not isinstance(gate, str) or len(params) == PARAMETERISED.get(gate)
+        except AssertionError:
+            print("E: Gates need distinct in-range qbit indices and parameterised gates their angles")
+            return False
+        if isinstance(gate, (Gates, str)):
+            self.operations.append(Operation(gate, tuple(qubits), params=tuple(params)))
+        else:
+            self.operations.append(Operation("UNITARY", tuple(qubits), gates.gateMatrix(gate)))
+        return self
+
+    def controlled(self, gate: Gates | list | np.ndarray, controls: list[int], *targets: int,
+                   negative: list[int] | tuple = ()) -> Self | bool:
+        """
+        Adds a gate applied to the targets only where every control is |1> and every negative control is |0>, e.g.
+        a multi-controlled X, or any unitary controlled on a pattern of qbits. Dense registers apply it to the
+        controlled subspace alone, other backends use the full matrix from Operation.matrix.
+        @param gate: A Gates member or a 2^k x 2^k matrix for the k targets
+        @param controls: The control qbits
+        @param targets: The target qbits, the first being the most significant in the gate
+        @param negative: Control qbits that must be |0> rather than |1>
+        @return: The circuit, else False
+        """
+        qubits = (*controls, *negative, *targets)
+        matrix = gates.gateMatrix(gate)
+        try:
+            assert all(type(qubit) is int and 0 <= qubit < self.n for qubit in qubits)
+            assert len(set(qubits)) == len(qubits) and len(targets) > 0
+            assert matrix.shape == (1 << len(targets), 1 << len(targets))
+        except AssertionError:
+            print("E: Controlled gates need distinct in-range qbit indices and a 2^k x 2^k gate for k targets")
+            return False
+        values = (1,) * len(controls) + (0,) * len(negative)
+        self.operations.append(Operation("CONTROLLED", qubits, matrix, values))
+        return self
+
+    def __enter__(self) -> Self:
+        """
+        Starts recording, so the gate functions in gates.py append to this circuit instead of executing
+        @return: The circuit
+        """
+        self._previous, gates._recorder = gates._recorder, self
+        return self
+
+    def __exit__(self, *exception) -> None:
+        """
+        Stops recording, restoring any circuit that was recording before
+        @return: None
+        """
+        gates._recorder, self._previous = self._previous, None
+
+    def __len__(self) -> int:
+        """
+        Returns the number of operations
+        @return: The gate count
+        """
+        return len(self.operations)
+
+    def __iter__(self):
+        """
+        Iterates over the operations in execution order
+        @return: Iterator of operations
+        """
+        return iter(self.operations)
+
+    def counts(self) -> dict[str, int]:
+        """
+        Counts the operations of each gate
+        @return: The number of each gate keyed by name
+        """
+        counts = {}
+        for operation in self.operations:
+            name = operation.gate.name if isinstance(operation.gate, Gates) else operation.gate
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def depth(self) -> int:
+        """
+        Returns the number of layers of gates, where gates in the same layer act on disjoint qbits
+        @return: The circuit depth
+        """
+        return depth(self.operations)
+
+    def optimise(self, window: int = 64) -> dict[str, int]:
+        """
+        Simplifies the circuit in place with the peephole optimiser, cancelling and merging gates
+        @param window: How many earlier gates each gate is compared against
+        @return: The gate count and depth before and after
+        """
+        self.operations, report = optimise(self.operations, window)
+        return report
+
+    def batch(self) -> int:
+        """
+        Returns the batch size set by any parameter given as an array of angles
+        @return: The largest array length, 0 if every parameter is a single angle
+        """
+        return max((np.size(param) for operation in self.operations for param in operation.params
+                    if np.ndim(param) > 0), default=0)
+
+    def _accepts(self, name: str, options: dict[str, Any]) -> bool:
+        """
+        Checks whether a backend takes every keyword option given, e.g. the stabilizer tableau has no 'threads'
+        @param name: The name of a backend in BACKENDS, or "batch"
+        @param options: The keyword options run would create it with
+        @return: True if the backend can be created with them
+        """
+        factory = BatchRegister if name == "batch" else BACKENDS[name]
+        try:
+            parameters = signature(factory).parameters
+        except (TypeError, ValueError):
+            return True  # Nothing to check a factory without a signature against
+        if any(parameter.kind is parameter.VAR_KEYWORD for parameter in parameters.values()):
+            return True
+        return set(options) <= set(parameters) - {"n", "batch"}
+
+    def backend(self, **options: Any) -> str:
+        """
+        Chooses a backend for the whole circuit: the stabilizer tableau for Clifford only circuits, a batched register
+        for parameter sweeps and a dense register while it fits in memory. Larger circuits run on an MPS, which is
+        approximate once its bond dimension is reached, if every gate acts on at most two qbits as the MPS requires,
+        and on the exact but slower out-of-core register otherwise. Backends that do not take every option given are
+        passed over, e.g. threads=2 runs a Clifford circuit densely.
+        @param options: The keyword options the backend will be created with
+        @return: The name of the backend
+        """
+        if self.batch():
+            return "batch"
+        fits = all(len(operation.qubits) <= 2 for operation in self.operations)
+        choices = ["stabilizer"] if isClifford(self.operations) else []
+        choices += ["dense", "mps", "outofcore"] if self.n <= DENSE_LIMIT else ["mps", "outofcore"]
+        choices = [name for name in choices if fits or name != "mps"] + ["sparse", "sharded"]
+        return next((name for name in choices if self._accepts(name, options)), choices[0])
+
+    def run(self, backend: str = "auto", fusion: bool = False, width: int = 2, **options: Any) -> Any:
+        """
+        Executes the circuit
+        @param backend: The name of a backend in BACKENDS, "batch", or "auto" to let backend() choose
+        @param fusion: If True, the backend fuses runs of adjacent gates where it supports it
+        @param width: The largest number of qbits a fused gate may act on
+        @param options: Passed to the backend when it is created, e.g. dirac, bond or threads
+        @return: The register the circuit was run on, else False. The caller owns it and should close it, or run it in
+        a with block, so sharded workers and shared memory or an out-of-core statevector file are freed straight away
+        """
+        name = self.backend(**options) if backend == "auto" else backend
+        try:
+            assert name == "batch" or name in BACKENDS
+        except AssertionError:
+            print(f"E: Unknown backend '{name}', choose from {', '.join(['auto', 'batch', *BACKENDS])}")
+            return False
+        try:
+            assert self._accepts(name, options)
+        except AssertionError:
+            print(f"E: The {name} backend does not take the options {', '.join(sorted(options))}")
+            return False
+        if name == "batch":
+            register = BatchRegister(self.n, max(self.batch(), 1), **options)
+        else:
+            register = BACKENDS[name](self.n, **options)
+        if register.run(self.operations, fusion, width) is False:
+            if hasattr(register, "close"):
+                register.close()  # Nobody else holds the worker pool or the statevector file of a failed run
+            return False
+        return register
+
+    def unitary(self, fusion: bool = True, width: int = 2,
+                results: ResultCache | None = cache.results) -> np.ndarray | bool:
+        """
+        Returns the matrix of the whole circuit, see unitary
+        @param fusion: If True, runs of adjacent gates are fused before they are applied
+        @param width: The largest number of qbits a fused gate may act on
+        @param results: The cache to look in and store into, None to always build the matrix
+        @return: The unitary indexed [output, input], else False
+        """
+        return unitary(self, fusion, width, results)
+
+    def statevector(self, dirac: int = 0, dtype: type = np.complex128,
+                    results: ResultCache | None = cache.results) -> np.ndarray | bool:
+        """
+        Returns the final statevector of a dense run, reusing the stored one when the same circuit was run before
+        @param dirac: The initial basis state
+        @param dtype: The precision to simulate in, np.complex64 or np.complex128
+        @param results: The cache to look in and store into, None to always simulate
+        @return: The final state, read-only when it came from the cache, (B, 2^n) for batched circuits, else False
+        """
+        key = circuitKey(self.n, self.operations, f"state:{np.dtype(dtype)}", dirac)
+        state = None if results is None else results.get(key)
+        if state is None:
+            register = self.run("batch" if self.batch() else "dense", dirac=dirac, dtype=dtype)
+            if register is False:
+                return False
+            state = register.state
+            if results is not None:
+                results.put(key, state)
+        return state
+
+    def sample(self, shots: int = 1, seed: int | None = None, dirac: int = 0, backend: str = "auto",
+               results: ResultCache | None = cache.results,
+               **options: Any) -> dict[str, int] | list[dict[str, int]] | bool:
+        """
+        Runs the circuit and measures it many times. Seeded histograms of unbatched circuits are cached, unseeded
+        ones are not as every call should draw fresh samples.
+        @param shots: The number of measurements to take
+        @param seed: Optional seed for a reproducible histogram
+        @param dirac: The initial basis state
+        @param backend: The backend to run on, as for run
+        @param results: The cache to look in and store into, None to always simulate
+        @param options: Passed to the backend, e.g. dtype=np.complex64 to sample a single precision state, which makes
+        "auto" choose a backend that takes a precision
+        @return: Counts of each outcome keyed by bitstring, one histogram per row for batched circuits, else False
+        """
+        name = self.backend(dirac=dirac, **options) if backend == "auto" else backend
+        cached = results is not None and seed is not None and name != "batch"
+        key = circuitKey(self.n, self.operations, f"sample:{name}:{sorted(options.items(), key=str)}", dirac, seed,
+                         shots)
+        counts = results.get(key) if cached else None
+        if counts is None:
+            register = self.run(name, dirac=dirac, **options)
+            counts = False if register is False else register.sample(shots, seed)
+            if register is not False and hasattr(register, "close"):
+                register.close()  # Frees the worker pool and shared memory, or the statevector file
+            if cached and counts is not False:
+                results.put(key, counts)
+        return counts
+
+    def accuracy(self, dirac: int = 0, renormalise: int = 0) -> dict[str, float]:
+        """
+        Runs the circuit densely in single and in double precision and compares the final states, to check whether
+        complex64 is accurate enough for it
+        @param dirac: The initial basis state
+        @param renormalise: Passed to the single precision register, rescaling it after every this many gates
+        @return: The fidelity |<double|single>|^2, the largest amplitude error, the drift of the norm from 1 and the
+        run time of each precision, taking the worst row of a batched circuit
+        """
+        name = "batch" if self.batch() else "dense"
+        start = perf_counter()
+        exact = self.run(name, dirac=dirac).state
+        middle = perf_counter()
+        single = self.run(name, dirac=dirac, dtype=np.complex64, renormalise=renormalise).state
+        end = perf_counter()
+        overlap = np.abs(np.sum(np.conj(exact) * single, axis=-1)) ** 2
+        return {"fidelity": float(np.min(overlap)),
+                "max_error": float(np.max(np.abs(exact - single))),
+                "norm_error": float(np.max(np.abs(1 - np.linalg.norm(single.astype(np.complex128), axis=-1)))),
+                "double_seconds": middle - start,
+                "single_seconds": end - middle}
+
+    def __repr__(self) -> str:
+        """
+        Returns one operation per line
+        @return: String representation of the circuit
+        """
+        lines = [f"Circuit(n={self.n}, gates={len(self)}, depth={self.depth()})"]
+        for operation in self.operations:
+            name = operation.gate.name if isinstance(operation.gate, Gates) else operation.gate
+            params = f"({', '.join(f'{param:.4g}' if np.ndim(param) == 0 else 'array' for param in operation.params)})"
+            lines.append(f"  {name}{params if operation.params else ''} {list(operation.qubits)}")
+        return "\n".join(lines)
@@ -0,0 +1,178 @@
+from math import sqrt
+from typing import Self
+
+import numpy as np
+
+from backend import Backend
+from gates import Gates, gateMatrix
+from kernels import applyControlled, applyMatrix, applySingle, applySwap, parity, pauliMasks, sampleCounts
+
+
+# Kraus operators of the standard single qbit noise channels
+# Each channel maps rho to sum_i K_i rho K_i^dagger
+
+def depolarising(p: float) -> list[np.ndarray]:
+    """
+    With probability p the qbit is replaced by the maximally mixed state
+    @param p: The depolarising probability, from 0 to 1
+    @return: Kraus operators of the channel
+    """
+    identity = np.eye(2, dtype=np.complex128)
+    paulis = [gateMatrix(gate) for gate in (Gates.PAULI_X, Gates.PAULI_Y, Gates.PAULI_Z)]
+    return [sqrt(1 - 3 * p / 4) * identity] + [sqrt(p / 4) * pauli for pauli in paulis]
+
+
+def amplitudeDamping(gamma: float) -> list[np.ndarray]:
+    """
+    Energy loss, |1> decays to |0> with probability gamma
+    @param gamma: The decay probability, from 0 to 1
+    @return: Kraus operators of the channel
+    """
+    return [np.array([[1, 0], [0, sqrt(1 - gamma)]], dtype=np.complex128),
+            np.array([[0, sqrt(gamma)], [0, 0]], dtype=np.complex128)]
+
+
+def phaseDamping(lam: float) -> list[np.ndarray]:
+    """
+    Loss of phase information without energy loss, off-diagonal terms shrink by sqrt(1 - lam)
+    @param lam: The damping probability, from 0 to 1
+    @return: Kraus operators of the channel
+    """
+    return [np.array([[1, 0], [0, sqrt(1 - lam)]], dtype=np.complex128),
+            np.array([[0, 0], [0, sqrt(lam)]], dtype=np.complex128)]
+
+
+class DensityMatrix(Backend):
+    """
+    Mixed state simulation of n qbits.
+    The 2^n x 2^n density matrix is treated as a 2n qbit statevector whose first n qbits are the row index and last
+    n qbits are the column index, so U rho U^dagger is the usual gate kernel applied to the row qbits followed by
+    the conjugate gate applied to the column qbits. No 4^n x 4^n superoperator is ever built.
+    """
+
+    def __init__(self, n: int, dirac: int = 0) -> None:
+        """
+        Initialises the density matrix as the pure basis state |dirac><dirac|
+        @param n: The number of qbits
+        @param dirac: The basis state to start in, qbit 0 being the leftmost symbol in dirac notation (e.g. |0>)
+        @return: None
+        """
+        try:
+            assert type(n) is int and type(dirac) is int and n > 0 and 0 <= dirac < (1 << n)
+        except AssertionError:
+            print("E: 'n' must be a positive integer and 'dirac' must fit in n bits")
+            exit(1)
+        self.n = n
+        self.rho = np.zeros((1 << n, 1 << n), dtype=np.complex128)
+        self.rho[dirac, dirac] = 1
+
+    @classmethod
+    def fromState(cls, state: np.ndarray) -> Self:
+        """
+        Creates the density matrix of a pure statevector, e.g. Register.state
+        @param state: Amplitude array of length 2^n
+        @return: The density matrix |psi><psi|
+        """
+        density = cls(len(state).bit_length() - 1)
+        density.rho = np.outer(state, np.conj(state))
+        return density
+
+    @staticmethod
+    def _conjugate(flat: np.ndarray, matrix: np.ndarray, qubits: list[int], n: int) -> None:
+        """
+        Applies flat <- M rho M^dagger for a gate on some qbits, in place
+        @param flat: The density matrix flattened to a 2n qbit statevector
+        @param matrix: The 2^k x 2^k operator, need not be unitary (e.g. a Kraus operator)
+        @param qubits: The qbits the operator acts on
+        @param n: The number of qbits
+        @return: None
+        """
+        if len(qubits) == 1:
+            applySingle(flat, matrix, qubits[0], 2 * n)
+            applySingle(flat, np.conj(matrix), n + qubits[0], 2 * n)
+        else:
+            applyMatrix(flat, matrix, qubits, 2 * n)
+            applyMatrix(flat, np.conj(matrix), [n + qubit for qubit in qubits], 2 * n)
+
+    def apply(self, gate: Gates | list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a unitary gate, rho <- U rho U^dagger
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param qubits: The qbits the gate acts on, controls first for controlled gates
+        @return: The density matrix, else False
+        """
+        if not self._valid(*qubits) or not self._sized(gate, qubits):
+            return False
+        flat = self.rho.reshape(-1)
+        n = self.n
+        if isinstance(gate, Gates) and gate in (Gates.CNOT, Gates.CZ, Gates.TOFFOLI):
+            target = gateMatrix(Gates.PAULI_Z if gate is Gates.CZ else Gates.PAULI_X)
+            # X and Z are real so the column update uses the same matrix
+            applyControlled(flat, target, list(qubits[:-1]), qubits[-1], 2 * n)
+            applyControlled(flat, target, [n + qubit for qubit in qubits[:-1]], n + qubits[-1], 2 * n)
+            return self
+        if gate is Gates.SWAP:
+            applySwap(flat, qubits[0], qubits[1], 2 * n)
+            applySwap(flat, n + qubits[0], n + qubits[1], 2 * n)
+            return self
+        self._conjugate(flat, gateMatrix(gate), list(qubits), n)
+        return self
+
+    def channel(self, kraus: list[np.ndarray], qubit: int) -> Self | bool:
+        """
+        Applies a noise channel to one qbit, rho <- sum_i K_i rho K_i^dagger
+        @param kraus: The Kraus operators, e.g. from depolarising, amplitudeDamping or phaseDamping
+        @param qubit: The qbit the noise acts on
+        @return: The density matrix, else False
+        """
+        if not self._valid(qubit):
+            return False
+        # The channel only mixes the four (row, column) blocks of this qbit, so the Kraus sum collapses to a
+        # 4x4 single qbit superoperator contracted with the row and column axes of the qbit in one pass
+        superoperator = sum(np.kron(operator, np.conj(operator)) for operator in kraus)
+        applyMatrix(self.rho.reshape(-1), superoperator, [qubit, self.n + qubit], 2 * self.n)
+        return self
+
+    def probabilities(self) -> np.ndarray:
+        """
+        Returns the probability of collapsing to each basis state
+        @return: The real diagonal of rho
+        """
+        return np.real(np.diagonal(self.rho)).copy()
+
+    def purity(self) -> float:
+        """
+        Returns Tr(rho^2), 1 for a pure state and 1/2^n for the maximally mixed state
+        @return: The purity
+        """
+        return float(np.sum(np.abs(self.rho) ** 2))  # rho is Hermitian so Tr(rho rho) is the sum of |rho_ij|^2
+
+    def expectation(self, observable: str | dict[str, float]) -> float | bool:
+        """
+        Returns the exact expectation value Tr(rho P) of a Pauli string or a weighted sum of them.
+        P only has one non-zero entry per column, phase(j) at row j ^ x, so Tr(rho P) = sum_j phase(j) rho[j, j ^ x].
+        @param observable: A Pauli string such as "XIZ" (qbit 0 first), or a dict of Pauli strings to coefficients
+        @return: The expectation value, else False
+        """
+        split = self._observable(observable, self.n)
+        if split is False:
+            return False
+        terms, coefficients = split
+        basis = np.arange(1 << self.n, dtype=np.int64)
+        total = 0.0
+        for term, coefficient in zip(terms, coefficients):
+            x, z, y = pauliMasks(term)
+            signs = 1 - 2 * parity(basis & z)
+            total += coefficient * np.real(1j ** y * np.sum(signs * self.rho[basis, basis ^ x]))
+        return float(total)
+
+    def sample(self, shots: int = 1, seed: int | None = None) -> dict[str, int] | bool:
+        """
+        Measures the state many times without collapsing it
+        @param shots: The number of measurements to take
+        @param seed: Optional seed for a reproducible histogram
+        @return: Counts of each outcome keyed by bitstring (qbit 0 first), else False
+        """
+        if not self._shots(shots):
+            return False
+        return sampleCounts(np.sqrt(np.clip(self.probabilities(), 0, None)), shots, self.n, seed)
@@ -0,0 +1,94 @@
+import numpy as np
+
+from kernels import applyMatrix, applyMatrixBatch
+from operation import Operation
+
+
+def _embed(matrix: np.ndarray, qubits: tuple[int, ...], order: list[int]) -> np.ndarray:
+    """
+    Expands a gate on some qbits to a matrix over a larger ordered set of qbits
+    @param matrix: The 2^k x 2^k gate, or (B, 2^k, 2^k) gates for a batched register
+    @param qubits: The qbits the gate acts on
+    @param order: The qbits of the larger matrix, in order of significance
+    @return: The 2^m x 2^m matrix where m is the length of order, or B of them
+    """
+    size = 1 << len(order)
+    # The identity is treated as a 2m qbit state whose first m axes are the row index, so applying the gate to
+    # those axes left-multiplies it onto the identity
+    positions = [order.index(qubit) for qubit in qubits]
+    if matrix.ndim == 3:  # One gate per batch element, so one identity per batch element too
+        expanded = np.tile(np.eye(size, dtype=np.complex128).reshape(-1), (len(matrix), 1))
+        applyMatrixBatch(expanded, matrix, positions, 2 * len(order))
+        return expanded.reshape(len(matrix), size, size)
+    expanded = np.eye(size, dtype=np.complex128).reshape(-1)
+    applyMatrix(expanded, matrix, positions, 2 * len(order))
+    return expanded.reshape(size, size)
+
+
+class _Block(object):
+    """A run of operations on a small set of qbits that is being multiplied into one unitary"""
+
+    def __init__(self, operation: Operation) -> None:
+        """
+        Starts a block from its first operation
+        @param operation: The first operation of the block
+        @return: None
+        """
+        self.qubits = list(operation.qubits)
+        self.matrix = operation.matrix()
+        self.operations = [operation]
+
+    def absorb(self, others: list['_Block'], operation: Operation) -> None:
+        """
+        Merges disjoint blocks and then a following operation into this block
+        @param others: Other open blocks, they commute with this one as their qbits are disjoint
+        @param operation: The operation applied after every block
+        @return: None
+        """
+        order = sorted(set(self.qubits).union(*(block.qubits for block in others), operation.qubits))
+        matrix = _embed(self.matrix, tuple(self.qubits), order)
+        for block in others:
+            matrix = _embed(block.matrix, tuple(block.qubits), order) @ matrix
+            self.operations += block.operations
+        self.matrix = _embed(operation.matrix(), operation.qubits, order) @ matrix
+        self.qubits = order
+        self.operations.append(operation)
+
+    def emit(self) -> Operation:
+        """
+        Returns the operation that replaces the block
+        @return: The original operation if nothing was fused, else a FUSED operation
+        """
+        if len(self.operations) == 1:
+            return self.operations[0]
+        return Operation("FUSED", tuple(self.qubits), self.matrix)
+
+
+def fuse(operations: list[Operation], width: int = 2) -> tuple[list[Operation], int]:
+    """
+    Multiplies runs of adjacent gates that act on at most 'width' qbits into single unitaries, so the register is
+    swept once per run rather than once per gate.
+    Open blocks always have disjoint qbits and contain every earlier gate on those qbits, so merging or emitting
+    them never reorders gates that do not commute.
+    @param operations: The gates in execution order
+    @param width: The largest number of qbits a fused unitary may act on, usually 2 to 4
+    @return: The fused operations and the number of gates that were fused away
+    """
+    output = []
+    open_blocks = []
+    for operation in operations:
+        touching = [block for block in open_blocks if not set(block.qubits).isdisjoint(operation.qubits)]
+        qubits = set(operation.qubits).union(*(block.qubits for block in touching))
+        if touching and len(qubits) <= width:
+            touching[0].absorb(touching[1:], operation)
+            open_blocks = [block for block in open_blocks if block not in touching[1:]]
+            continue
+        for block in touching:
+            output.append(block.emit())
+            open_blocks.remove(block)
+        if len(operation.qubits) <= width:
+            open_blocks.append(_Block(operation))
+        else:
+            output.append(operation)
+    output += [block.emit() for block in open_blocks]
+    return output, len(operations) - len(output)
@@ -1,10 +1,13 @@
 from enum import Enum
-from math import sqrt, e, pi
+from functools import lru_cache
+from math import sqrt, e, pi, cos, sin
+from cmath import exp
 from random import randint
 from typing import Tuple, Any
 
 import numpy as np
 
+from kernels import applySingle
 from qbit import Qbit
 
 
@@ -54,6 +57,125 @@ class Gates(Enum):
                [0, 0, 0, 0, 0, 0, 1, 0]]
 
 
+def _frozen(values: list[list[complex]] | np.ndarray) -> np.ndarray:
+    """
+    Converts a gate to a read-only contiguous complex array so it can be shared without being copied or modified
+    @param values: The gate as nested lists or an array
+    @return: Read-only complex128 array
+    """
+    matrix = np.ascontiguousarray(values, dtype=np.complex128)
+    matrix.flags.writeable = False
+    return matrix
+
+
+# Every fixed gate converted once, so hot loops never convert the nested lists of the enum again
+MATRICES: dict[Gates, np.ndarray] = {gate: _frozen(gate.value) for gate in Gates}
+
+ANGLE_DECIMALS = 12  # Angles are rounded to this many places before caching so float noise still hits the cache
+
+
+@lru_cache(maxsize=4096)
+def _parameterised(name: str, angles: tuple[float, ...]) -> np.ndarray:
+    """
+    Builds a parameterised single qbit gate, cached by name and rounded angles
+    @param name: One of RX, RY, RZ or U3
+    @param angles: The rounded angles in radians, (theta,) or (theta, phi, lambda) for U3
+    @return: Read-only complex128 2x2 array
+    """
+    theta = angles[0]
+    c, s = cos(theta / 2), sin(theta / 2)
+    match name:
+        case "RX":
+            return _frozen([[c, -1j * s], [-1j * s, c]])
+        case "RY":
+            return _frozen([[c, -s], [s, c]])
+        case "RZ":
+            return _frozen([[exp(-1j * theta / 2), 0], [0, exp(1j * theta / 2)]])
+        case "U3":
+            phi, lam = angles[1], angles[2]
+            return _frozen([[c, -exp(1j * lam) * s], [exp(1j * phi) * s, exp(1j * (phi + lam)) * c]])
+    raise ValueError(f"Unknown parameterised gate {name}")
+
+
+PARAMETERISED = {"RX": 1, "RY": 1, "RZ": 1, "U3": 3}  # Name of each parameterised gate and its number of angles
+
+
+def _batched(name: str, angles: list[np.ndarray]) -> np.ndarray:
+    """
+    Builds one parameterised gate per batch element in a few whole-array operations
+    @param name: One of RX, RY, RZ or U3
+    @param angles: One array of B angles per parameter, scalars are broadcast
+    @return: Complex128 array of shape (B, 2, 2)
+    """
+    angles = np.broadcast_arrays(*angles)
+    theta = angles[0]
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    matrices = np.empty(theta.shape + (2, 2), dtype=np.complex128)
+    match name:
+        case "RX":
+            matrices[..., 0, 0] = matrices[..., 1, 1] = c
+            matrices[..., 0, 1] = matrices[..., 1, 0] = -1j * s
+        case "RY":
+            matrices[..., 0, 0] = matrices[..., 1, 1] = c
+            matrices[..., 0, 1] = -s
+            matrices[..., 1, 0] = s
+        case "RZ":
+            matrices[..., 0, 0] = np.exp(-1j * theta / 2)
+            matrices[..., 1, 1] = np.exp(1j * theta / 2)
+            matrices[..., 0, 1] = matrices[..., 1, 0] = 0
+        case "U3":
+            phi, lam = angles[1], angles[2]
+            matrices[..., 0, 0] = c
+            matrices[..., 0, 1] = -np.exp(1j * lam) * s
+            matrices[..., 1, 0] = np.exp(1j * phi) * s
+            matrices[..., 1, 1] = np.exp(1j * (phi + lam)) * c
+    return matrices
+
+
+def parameterised(name: str, *angles: float | np.ndarray) -> np.ndarray | bool:
+    """
+    Returns the matrix of a parameterised gate from the cache, building it on the first call.
+    If any angle is an array of B values, B matrices are built at once for a batched register instead.
+    @param name: One of RX, RY, RZ or U3
+    @param angles: The angles in radians, theta for the rotations or theta, phi, lambda for U3
+    @return: Read-only complex128 2x2 array, or a (B, 2, 2) array for batched angles, else False
+    """
+    try:
+        assert name in PARAMETERISED and len(angles) == PARAMETERISED[name]
+    except AssertionError:
+        print("E: Parameterised gates are RX, RY, RZ (one angle) and U3 (three angles)")
+        return False
+    if any(np.ndim(angle) > 0 for angle in angles):
+        return _batched(name, [np.asarray(angle, dtype=np.float64) for angle in angles])
+    return _parameterised(name, tuple(round(float(angle), ANGLE_DECIMALS) for angle in angles))
+
+
+def gateMatrix(gate: Gates | list | np.ndarray) -> np.ndarray:
+    """
+    Returns the complex matrix of a gate, using the precompiled array for Gates members
+    @param gate: A Gates member or any matrix
+    @return: Complex128 array, read-only for Gates members
+    """
+    if isinstance(gate, Gates):
+        return MATRICES[gate]
+    return np.asarray(gate, dtype=np.complex128)
+
+
+def controlledMatrix(gate: Gates | list | np.ndarray, values: tuple[int, ...]) -> np.ndarray:
+    """
+    Builds the full matrix of a controlled gate, for backends that cannot apply it on the controlled subspace
+    @param gate: The 2^k x 2^k gate applied to the targets
+    @param values: The value (1, or 0 for a negative control) each control qbit must hold, controls coming first
+    @return: 2^(c+k) x 2^(c+k) complex128 array, the identity except for the block the controls select
+    """
+    matrix = gateMatrix(gate)
+    size = len(matrix)
+    start = int("".join(map(str, values)) or "0", 2) * size
+    full = np.eye(size << len(values), dtype=np.complex128)
+    full[start:start + size, start:start + size] = matrix
+    return full
+
+
 # Below is another way you can create a constant class
 # It uses the metaclasses and an undermentioned to block any attempt at writing to a variable
 # I chose to go with the top implementation as it produced cleaner code.
@@ -79,16 +201,23 @@ class ImmutableConstants(metaclass=ImmutableConstantsMeta):
     CONSTANT_3 = None
 
 
+# Set by "with Circuit(n):" so the gate functions below take qbit indices and append to the circuit, returning it,
+# instead of executing
+_recorder: Any = None
+
+
 # Standard gates
 
 # noinspection PyPep8Naming
-def H(qbit: Qbit) -> Qbit:
+def H(qbit: Qbit | int) -> Qbit:
     """
     creates an equal superposition state if given a computational basis state
-    @param qbit: Qbit object being acted on
+    @param qbit: Qbit object being acted on, or its index while recording a Circuit
     @return: qbit
     """
-    gate = Gates["HADAMARD"].value
+    if _recorder is not None:
+        return _recorder.append(Gates.HADAMARD, qbit)
+    gate = MATRICES[Gates.HADAMARD]
     qbit = matrixMultiplication(gate, qbit)
     qbit.probability = [[0 for _ in range(11)] for _ in range(11)]
     for i in range(2):
@@ -99,77 +228,144 @@ def H(qbit: Qbit) -> Qbit:
 
 
 # noinspection PyPep8Naming
-def X(qbit: Qbit) -> Qbit:
+def X(qbit: Qbit | int) -> Qbit:
     """
     The Pauli-X gate is the quantum equivalent of the NOT gate for classical computers with respect to the standard
     basis
-    @param qbit: The Qbit object being acted on
+    @param qbit: The Qbit object being acted on, or its index while recording a Circuit
     @return: qbit
     """
-    gate = Gates["PAULI_X"].value
+    if _recorder is not None:
+        return _recorder.append(Gates.PAULI_X, qbit)
+    gate = MATRICES[Gates.PAULI_X]
     qbit = matrixMultiplication(gate, qbit)
     return qbit
 
 
 # noinspection PyPep8Naming
-def Y(qbit: Qbit) -> Qbit:
+def Y(qbit: Qbit | int) -> Qbit:
     """
     Uses the builtin complex type
-    @param qbit: Qbit object being acted on
+    @param qbit: Qbit object being acted on, or its index while recording a Circuit
     @return: qbit
     """
-    gate = Gates["PAULI_Y"].value
+    if _recorder is not None:
+        return _recorder.append(Gates.PAULI_Y, qbit)
+    gate = MATRICES[Gates.PAULI_Y]
     qbit = matrixMultiplication(gate, qbit)
     return qbit
 
 
 # noinspection PyPep8Naming
-def Z(qbit: Qbit) -> Qbit:
+def Z(qbit: Qbit | int) -> Qbit:
     """
     Pauli Z is sometimes called phase-flip.
-    @param qbit: Qbit object being acted on
+    @param qbit: Qbit object being acted on, or its index while recording a Circuit
     @return: qbit
     """
-    gate = Gates["PAULI_Z"].value
+    if _recorder is not None:
+        return _recorder.append(Gates.PAULI_Z, qbit)
+    gate = MATRICES[Gates.PAULI_Z]
     qbit = matrixMultiplication(gate, qbit)
     return qbit
 
 
 # noinspection PyPep8Naming
-def P(qbit: Qbit) -> Qbit:
+def P(qbit: Qbit | int) -> Qbit:
     """
     This is equivalent to tracing a horizontal circle (a line of constant latitude), or a rotation about the z-axis
     on the Bloch sphere
-    @param qbit: Qbit object being acted on
+    @param qbit: Qbit object being acted on, or its index while recording a Circuit
     @return: qbit
     """
-    gate = Gates["PHASE"].value
+    if _recorder is not None:
+        return _recorder.append(Gates.PHASE, qbit)
+    gate = MATRICES[Gates.PHASE]
     qbit = matrixMultiplication(gate, qbit)
     return qbit
 
 
-def CNOT(control: Qbit, target: Qbit) -> Qbit:
+# noinspection PyPep8Naming
+def Rx(qbit: Qbit | int, theta: float) -> Qbit:
+    """
+    Rotation of theta radians about the x-axis of the Bloch sphere
+    @param qbit: Qbit object being acted on, or its index while recording a Circuit
+    @param theta: The rotation angle in radians
+    @return: qbit
+    """
+    if _recorder is not None:
+        return _recorder.append("RX", qbit, params=(theta,))
+    # matrixMultiplication computes vector.gate, so the transpose is passed to apply the gate itself
+    return matrixMultiplication(parameterised("RX", theta).T, qbit)
+
+
+# noinspection PyPep8Naming
+def Ry(qbit: Qbit | int, theta: float) -> Qbit:
+    """
+    Rotation of theta radians about the y-axis of the Bloch sphere, keeps real amplitudes real
+    @param qbit: Qbit object being acted on, or its index while recording a Circuit
+    @param theta: The rotation angle in radians
+    @return: qbit
+    """
+    if _recorder is not None:
+        return _recorder.append("RY", qbit, params=(theta,))
+    return matrixMultiplication(parameterised("RY", theta).T, qbit)
+
+
+# noinspection PyPep8Naming
+def Rz(qbit: Qbit | int, theta: float) -> Qbit:
+    """
+    Rotation of theta radians about the z-axis of the Bloch sphere, equal to P up to a global phase
+    @param qbit: Qbit object being acted on, or its index while recording a Circuit
+    @param theta: The rotation angle in radians
+    @return: qbit
+    """
+    if _recorder is not None:
+        return _recorder.append("RZ", qbit, params=(theta,))
+    return matrixMultiplication(parameterised("RZ", theta).T, qbit)
+
+
+# noinspection PyPep8Naming
+def U3(qbit: Qbit | int, theta: float, phi: float, lam: float) -> Qbit:
+    """
+    The general single qbit gate, any single qbit gate is U3 for some angles up to a global phase
+    @param qbit: Qbit object being acted on, or its index while recording a Circuit
+    @param theta: The polar rotation in radians
+    @param phi: The first phase in radians
+    @param lam: The second phase in radians
+    @return: qbit
+    """
+    if _recorder is not None:
+        return _recorder.append("U3", qbit, params=(theta, phi, lam))
+    return matrixMultiplication(parameterised("U3", theta, phi, lam).T, qbit)
+
+
+def CNOT(control: Qbit | int, target: Qbit | int) -> Qbit:
     """
     This is equivalent to a controlled NOT gate
-    @param control: The control qbit
-    @param target: The target qbit
+    @param control: The control qbit, or its index while recording a Circuit
+    @param target: The target qbit, or its index while recording a Circuit
     @return: the target qbit after any changes
     """
-    if control.vector[1] == 0:
+    if _recorder is not None:
+        return _recorder.append(Gates.CNOT, control, target)
+    if control._get(1) == 0:
         return target
     else:
         qbit2 = X(target)
     return qbit2
 
 
-def CZ(control: Qbit, target: Qbit) -> Qbit:
+def CZ(control: Qbit | int, target: Qbit | int) -> Qbit:
     """
     This is equivalent to a controlled NOT gate
-    @param control: The control qbit
-    @param target: The target qbit
+    @param control: The control qbit, or its index while recording a Circuit
+    @param target: The target qbit, or its index while recording a Circuit
     @return: the target qbit after any changes
     """
-    if control.vector[1] == 0:
+    if _recorder is not None:
+        return _recorder.append(Gates.CZ, control, target)
+    if control._get(1) == 0:
         return target
     else:
         qbit2 = Z(target)
@@ -179,7 +375,7 @@ def CZ(control: Qbit, target: Qbit) -> Qbit:
 # Algorithms
 
 # noinspection PyPep8Naming
-def Entangle(qbit: Qbit, qbit2: Qbit) -> Qbit | bool:
+def Entangle(qbit: Qbit | int, qbit2: Qbit | int) -> Qbit | bool:
     """
     A complex combination of single gates that entangles two qbits, such that the measurement of one determines the
     measurement of the other.
@@ -187,6 +383,9 @@ def Entangle(qbit: Qbit, qbit2: Qbit) -> Qbit | bool:
     @param qbit2: The Qbit object being acted on
     @return: Entangled qbits
     """
+    if _recorder is not None:
+        H(qbit)
+        return CNOT(qbit, qbit2)
     qbit.vector = [1, 0]
     qbit2.vector = [1, 0]
     qbit = H(qbit)
@@ -218,14 +417,20 @@ def Teleport(qbit: Qbit, qbit2: Qbit) -> Qbit:
 # Procedures
 
 # noinspection PyPep8Naming
-def Measurement(qbit: Qbit) -> Qbit:
+def Measurement(qbit: Any, shots: int | None = None) -> Qbit | dict[str, int] | bool:
     """
     A function that measures the state of the qbit.
     This function is used over each instance measure function
     because it can be parsed straight into the diagram tool
-    @param qbit: The Qbit object being measured
-    @return: None
+    @param qbit: The Qbit, or a register of any backend, being measured
+    @param shots: If given, samples this many outcomes without collapsing the state instead of measuring once
+    @return: The collapsed qbit, or a histogram of outcomes keyed by bitstring if shots is given or a register is
+    measured once, else False
     """
+    if shots is not None:
+        return qbit.sample(shots)
+    if not isinstance(qbit, Qbit):
+        return qbit.sample(1)  # Registers do not collapse, a single shot is drawn instead
     return qbit.measure()
 
 
@@ -243,5 +448,28 @@ def Initialise(name: str, values: list) -> tuple[str, Any]:
 
 
 def matrixMultiplication(gate: list[list[float]], bit: Qbit) -> Qbit:
-    bit.Cbit.vector = np.dot(bit.Cbit.vector, gate).tolist()
+    if bit.Cbit.array:
+        bit.Cbit.vector = np.dot(bit.Cbit.vector, gate)  # Stays a complex128 array
+    else:
+        # Gates are stored as complex arrays, list vectors are kept real where the result has no imaginary part
+        bit.Cbit.vector = np.real_if_close(np.dot(bit.Cbit.vector, gate)).tolist()
+    return bit
+
+
+def applyGate(gate: list[list[complex]], bit: Qbit, qubit: int) -> Qbit | bool:
+    """
+    Applies a single qbit gate to one qbit of a multi-qbit register without building the full 2^n x 2^n matrix.
+    The register must use array storage as the amplitudes are updated in place.
+    @param gate: The 2x2 gate, usually a Gates value such as Gates["HADAMARD"].value
+    @param bit: The array backed Qbit register being acted on
+    @param qubit: The index of the qbit to act on, 0 being the leftmost in dirac notation
+    @return: bit, else False
+    """
+    n = len(bit.Cbit.vector).bit_length() - 1
+    try:
+        assert bit.Cbit.array and type(qubit) is int and 0 <= qubit < n
+    except AssertionError:
+        print("E: The register must use array storage and the qbit index must be in range")
+        return False
+    applySingle(bit.Cbit.vector, gateMatrix(gate), qubit, n)
     return bit
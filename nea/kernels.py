@@ -0,0 +1,675 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from typing import Callable
+
+import numpy as np
+
+
+# Qbit ordering used by every kernel in this file:
+# qbit 0 is the most significant bit of the basis index, i.e. the leftmost symbol in |q0 q1 ... q(n-1)>.
+# This matches the labels printed by Cbit.probcollapse.
+
+_PARALLEL_MIN = 1 << 16  # Below this many amplitudes thread dispatch costs more than it saves
+_executors: dict[int, ThreadPoolExecutor] = {}  # One shared pool per thread count
+_BLOCK = 1 << 13  # Amplitude pairs _update mixes at a time, so its scratch buffer stays small and in cache
+
+
+def _threaded(kernel: Callable[[np.ndarray], None], state: np.ndarray, qubits: tuple[int, ...], n: int,
+              threads: int) -> None:
+    """
+    Runs a kernel over blocks of the statevector on a thread pool.
+    The blocks fix the leading qbits the gate does not touch, so they are disjoint views that each contain every
+    amplitude the gate mixes together. The kernels are whole-array numpy calls, which release the GIL, so the blocks
+    really do run at the same time.
+    @param kernel: Function applying the gate in place to a (2,)*n shaped view
+    @param state: Contiguous amplitude array of length 2^n
+    @param qubits: The qbits the gate touches, including controls
+    @param n: Number of qbits in the register
+    @param threads: The number of threads to split the work between, rounded down to a power of 2
+    @return: None
+    """
+    view = state.reshape((2,) * n)
+    free = [axis for axis in range(n) if axis not in qubits][:threads.bit_length() - 1]
+    if threads <= 1 or len(state) < _PARALLEL_MIN or not free:
+        kernel(view)
+        return
+    if threads not in _executors:
+        _executors[threads] = ThreadPoolExecutor(threads)
+    futures = [_executors[threads].submit(kernel, view[_index(n, dict(zip(free, values)))])
+               for values in product((0, 1), repeat=len(free))]
+    for future in futures:
+        future.result()  # Re-raises any error from the block
+
+
+def applySingle(state: np.ndarray, gate: np.ndarray, qubit: int, n: int, threads: int = 1) -> np.ndarray:
+    """
+    Applies a 2x2 gate to one qbit of an n-qbit statevector in place.
+    The amplitude buffer is reshaped to (2^qubit, 2, 2^(n-qubit-1)) so the middle axis is the target qbit,
+    meaning no 2^n x 2^n matrix is ever built and the state is never reallocated.
+    @param state: Contiguous amplitude array of length 2^n, modified in place
+    @param gate: 2x2 unitary to apply
+    @param qubit: Index of the target qbit
+    @param n: Number of qbits in the register
+    @param threads: The number of threads to split the amplitudes between
+    @return: The same state array
+    """
+    if threads > 1:
+        _threaded(lambda view: _update(view[_index(n, {qubit: 0})], view[_index(n, {qubit: 1})], gate),
+                  state, (qubit,), n, threads)
+        return state
+    view = state.reshape(1 << qubit, 2, 1 << (n - qubit - 1))  # a view, not a copy, as state is contiguous
+    _update(view[:, 0, :], view[:, 1, :], gate)
+    return state
+
+
+def _update(zero: np.ndarray, one: np.ndarray, gate: np.ndarray) -> None:
+    """
+    Mixes a pair of amplitude views in place: (zero, one) <- gate @ (zero, one).
+    The views are updated in blocks of at most _BLOCK pairs through one scratch buffer reused for every block, so a
+    gate needs a fixed few hundred kilobytes beyond the state rather than a copy of half of it.
+    @param zero: View of the amplitudes where the target qbit is |0>
+    @param one: View of the amplitudes where the target qbit is |1>
+    @param gate: 2x2 unitary, or 2x2 entries that broadcast against the views
+    @return: None
+    """
+    scratch = np.empty((2, min(zero.size, _BLOCK)), dtype=zero.dtype)
+    _mix(zero, one, [[gate[0][0], gate[0][1]], [gate[1][0], gate[1][1]]], scratch)
+
+
+def _mix(zero: np.ndarray, one: np.ndarray, gate: list[list], scratch: np.ndarray) -> None:
+    """
+    Applies _update to a block of pairs, splitting it along its outermost non-trivial axis until it fits the scratch
+    @param zero: View of the amplitudes where the target qbit is |0>
+    @param one: View of the amplitudes where the target qbit is |1>
+    @param gate: The four gate entries, each a scalar or an array with one axis per view axis
+    @param scratch: (2, _BLOCK) buffer, or smaller if the views are
+    @return: None
+    """
+    size = zero.size
+    if size > scratch.shape[1]:
+        axis = next(axis for axis, length in enumerate(zero.shape) if length > 1)
+        step = max(1, scratch.shape[1] * zero.shape[axis] // size)
+        for start in range(0, zero.shape[axis], step):
+            block = (slice(None),) * axis + (slice(start, start + step),)
+            entries = [[entry[block] if np.ndim(entry) and entry.shape[axis] > 1 else entry for entry in row]
+                       for row in gate]
+            _mix(zero[block], one[block], entries, scratch)
+        return
+    old_zero = scratch[0, :size].reshape(zero.shape)
+    product = scratch[1, :size].reshape(zero.shape)
+    old_zero[...] = zero
+    zero *= gate[0][0]
+    np.multiply(one, gate[0][1], out=product)
+    zero += product
+    one *= gate[1][1]
+    np.multiply(old_zero, gate[1][0], out=product)
+    one += product
+
+
+def _index(n: int, fixed: dict[int, int]) -> tuple:
+    """
+    Builds a basic-indexing tuple for the (2,)*n view of a statevector with some qbits fixed
+    @param n: Number of qbits
+    @param fixed: Mapping of qbit index to the value (0 or 1) it is fixed to
+    @return: Index tuple, so slicing returns a view rather than a copy
+    """
+    # Length one slices rather than integers, otherwise fixing every axis would return a scalar copy
+    return tuple(slice(fixed[axis], fixed[axis] + 1) if axis in fixed else slice(None) for axis in range(n))
+
+
+def applyControlled(state: np.ndarray, gate: np.ndarray, controls: list[int] | dict[int, int], target: int | list[int],
+                    n: int, threads: int = 1) -> np.ndarray:
+    """
+    Applies a 2^k x 2^k gate to the target qbits only on the amplitudes where every control qbit holds its value.
+    The controlled subspace is selected by index arithmetic on a (2,)*n view, so superposed controls are simulated
+    correctly, no controlled operator matrix is built and only the 2^(n-c) amplitudes of the subspace are touched.
+    Diagonal and permutation gates are applied inside the subspace without mixing, see _subspace.
+    @param state: Contiguous amplitude array of length 2^n, modified in place
+    @param gate: 2^k x 2^k unitary to apply to the targets
+    @param controls: Indices of the control qbits, which must be |1>, or a dict of control qbit to the value it must
+    hold, 0 for a negative control
+    @param target: Index of the target qbit, or a list of k targets, the first being the most significant in the gate
+    @param n: Number of qbits in the register
+    @param threads: The number of threads to split the amplitudes between
+    @return: The same state array
+    """
+    fixed = controls if isinstance(controls, dict) else {control: 1 for control in controls}
+    targets = [target] if isinstance(target, int) else list(target)
+    update = _subspace(gate, targets, n)
+    _threaded(lambda view: update(view[_index(n, fixed)]), state, (*fixed, *targets), n, threads)
+    return state
+
+
+def applySwap(state: np.ndarray, first: int, second: int, n: int, threads: int = 1) -> np.ndarray:
+    """
+    Swaps two qbits in place by exchanging the |01> and |10> amplitude blocks
+    @param state: Contiguous amplitude array of length 2^n, modified in place
+    @param first: Index of the first qbit
+    @param second: Index of the second qbit
+    @param n: Number of qbits in the register
+    @param threads: The number of threads to split the amplitudes between
+    @return: The same state array
+    """
+    def kernel(view: np.ndarray) -> None:
+        zero_one = view[_index(n, {first: 0, second: 1})]
+        one_zero = view[_index(n, {first: 1, second: 0})]
+        temp = zero_one.copy()
+        zero_one[...] = one_zero
+        one_zero[...] = temp
+
+    _threaded(kernel, state, (first, second), n, threads)
+    return state
+
+
+def applyMatrix(state: np.ndarray, matrix: np.ndarray, qubits: list[int], n: int, threads: int = 1) -> np.ndarray:
+    """
+    Applies a 2^k x 2^k gate to k qbits (in the given order) by contracting it with the matching axes of the
+    statevector. Used for dense multi-qbit gates that have no specialised kernel.
+    @param state: Contiguous amplitude array of length 2^n, modified in place
+    @param matrix: The 2^k x 2^k unitary
+    @param qubits: Indices of the k qbits, the first being the most significant in the matrix
+    @param n: Number of qbits in the register
+    @param threads: The number of threads to split the amplitudes between
+    @return: The same state array
+    """
+    k = len(qubits)
+    tensor = matrix.reshape((2,) * (2 * k))
+
+    def kernel(view: np.ndarray) -> None:
+        result = np.tensordot(tensor, view, axes=(list(range(k, 2 * k)), list(qubits)))
+        # tensordot puts the gate's output axes first, move them back to where the qbits live
+        view[...] = np.moveaxis(result, list(range(k)), list(qubits))
+
+    _threaded(kernel, state, tuple(qubits), n, threads)
+    return state
+
+
+# Diagonal kernels: gates such as Z, PHASE, T, CZ and RZ only multiply each amplitude by a phase picked by its basis
+# state, so no amplitudes are mixed. They are applied as elementwise products, and runs of them can be multiplied
+# into one phase vector first so the statevector is swept once for the whole run.
+
+_DIAGONAL_BLOCKS = 16  # Up to this many phases each block is scaled on its own, so blocks with phase 1 are skipped
+
+
+def diagonalTensor(phases: np.ndarray, qubits: list[int], n: int) -> np.ndarray:
+    """
+    Reshapes the diagonal of a gate so it broadcasts against the (2,)*n view of a statevector
+    @param phases: The 2^k diagonal entries, the first qbit being the most significant
+    @param qubits: The k qbits the gate acts on, in any order
+    @param n: Number of qbits in the view
+    @return: Array with a length 2 axis at each of the gate's qbits and length 1 axes elsewhere
+    """
+    k = len(qubits)
+    order = sorted(range(k), key=lambda position: qubits[position])
+    shape = [2 if axis in qubits else 1 for axis in range(n)]
+    return np.transpose(np.reshape(phases, (2,) * k), order).reshape(shape)
+
+
+def combineDiagonals(qubits: list[int], phases: np.ndarray, others: list[int],
+                     more: np.ndarray) -> tuple[list[int], np.ndarray]:
+    """
+    Multiplies two diagonal gates into one acting on the union of their qbits. Diagonal gates commute, so the order
+    of the two does not matter.
+    @param qubits: The qbits of the first gate
+    @param phases: The diagonal of the first gate
+    @param others: The qbits of the second gate
+    @param more: The diagonal of the second gate
+    @return: The union of the qbits, and the diagonal over them
+    """
+    union = list(qubits) + [qubit for qubit in others if qubit not in qubits]
+    first = diagonalTensor(phases, [union.index(qubit) for qubit in qubits], len(union))
+    second = diagonalTensor(more, [union.index(qubit) for qubit in others], len(union))
+    return union, (first * second).reshape(-1)
+
+
+def chunkDiagonal(phases: np.ndarray, qubits: list[int], n: int, local: int,
+                  start: int) -> tuple[np.ndarray, list[int]]:
+    """
+    Restricts a diagonal gate to one chunk of 2^local amplitudes. The qbits above the chunk are fixed by its start
+    index, so they only select a slice of the phases, and the qbits inside it are renumbered from the chunk's top.
+    A diagonal gate never mixes amplitudes, so every chunk can be updated on its own.
+    @param phases: The 2^k diagonal entries, the first qbit being the most significant
+    @param qubits: The k qbits the gate acts on
+    @param n: Number of qbits in the register
+    @param local: log2 of the chunk size
+    @param start: The index of the chunk's first amplitude
+    @return: The phases over the qbits inside the chunk, one phase if there are none, and those qbits' indices
+    """
+    outer = n - local
+    index = tuple((start >> (n - 1 - qubit)) & 1 if qubit < outer else slice(None) for qubit in qubits)
+    inner = [qubit - outer for qubit in qubits if qubit >= outer]
+    return np.reshape(phases, (2,) * len(qubits))[index].reshape(-1), inner
+
+
+def _scale(view: np.ndarray, phases: np.ndarray, qubits: list[int], n: int, lead: tuple = ()) -> None:
+    """
+    Multiplies a (2,)*n view, after any leading batch axes, by a diagonal gate in place
+    @param view: The amplitudes, modified in place. The phase tensor broadcasts over leading axes
+    @param phases: The 2^k diagonal entries
+    @param qubits: The k qbits
+    @param n: Number of qbit axes in the view
+    @param lead: Slices selecting everything along the leading axes
+    @return: None
+    """
+    k = len(qubits)
+    if len(phases) > _DIAGONAL_BLOCKS:
+        view *= diagonalTensor(phases, qubits, n)
+        return
+    for row, phase in enumerate(phases):
+        if phase != 1:
+            view[lead + _index(n, {qubit: (row >> (k - 1 - bit)) & 1 for bit, qubit in enumerate(qubits)})] *= phase
+
+
+def applyDiagonal(state: np.ndarray, phases: np.ndarray, qubits: list[int], n: int, threads: int = 1) -> np.ndarray:
+    """
+    Applies a diagonal gate to k qbits in place by multiplying every amplitude by the phase of its basis state.
+    Small gates scale only the blocks whose phase is not 1, e.g. a quarter of the state for CZ, larger accumulated
+    gates are broadcast over the whole state in a single pass.
+    @param state: Contiguous amplitude array of length 2^n, modified in place
+    @param phases: The 2^k diagonal entries, the first qbit being the most significant
+    @param qubits: Indices of the k qbits
+    @param n: Number of qbits in the register
+    @param threads: The number of threads to split the amplitudes between
+    @return: The same state array
+    """
+    _threaded(lambda view: _scale(view, phases, qubits, n), state, tuple(qubits), n, threads)
+    return state
+
+
+# Permutation kernels: gates such as X, CNOT, SWAP and TOFFOLI only move amplitudes between basis states, so they
+# are applied by moving whole blocks of the (2,)*n view with no arithmetic. Runs of them compose into one
+# permutation of the basis states of the qbits they touch before the statevector is moved once.
+
+def permutationOf(matrix: np.ndarray) -> np.ndarray | None:
+    """
+    Recognises a permutation matrix, one 1 in every row and column and 0 elsewhere
+    @param matrix: A 2^k x 2^k gate
+    @return: Array whose entry i is the basis state |i> is sent to, else None
+    """
+    if matrix.ndim != 2 or np.count_nonzero(matrix) != len(matrix) or not np.all((matrix == 0) | (matrix == 1)):
+        return None
+    image = np.argmax(matrix != 0, axis=0)
+    return image if len(np.unique(image)) == len(image) else None
+
+
+def _spread(rows: np.ndarray, positions: list[int], k: int) -> np.ndarray:
+    """
+    Moves the k bits of each value to the given bit positions, the first bit being the most significant
+    @param rows: Values of k bits
+    @param positions: The bit position each of the k bits is moved to
+    @param k: The number of bits
+    @return: The spread values
+    """
+    return sum(((rows >> (k - 1 - bit)) & 1) << position for bit, position in enumerate(positions))
+
+
+def combinePermutations(qubits: list[int], permutation: np.ndarray, others: list[int],
+                        more: np.ndarray) -> tuple[list[int], np.ndarray]:
+    """
+    Composes two permutation gates, the first applied first, into one acting on the union of their qbits
+    @param qubits: The qbits of the first gate
+    @param permutation: The permutation of the first gate
+    @param others: The qbits of the second gate
+    @param more: The permutation of the second gate
+    @return: The union of the qbits, and the composed permutation over them
+    """
+    union = list(qubits) + [qubit for qubit in others if qubit not in qubits]
+    m = len(union)
+    rows = np.arange(1 << m)
+
+    def expand(gate: list[int], image: np.ndarray) -> np.ndarray:
+        positions = [m - 1 - union.index(qubit) for qubit in gate]
+        k = len(gate)
+        sub = sum(((rows >> position) & 1) << (k - 1 - bit) for bit, position in enumerate(positions))
+        cleared = rows & ~sum(1 << position for position in positions)
+        return cleared | _spread(np.asarray(image)[sub], positions, k)
+
+    return union, expand(others, more)[expand(qubits, permutation)]
+
+
+def _cycles(permutation: np.ndarray) -> list[list[int]]:
+    """
+    Splits a permutation into its cycles, leaving out fixed points
+    @param permutation: Entry i is where i is sent
+    @return: Each cycle as [c0, c1, ...] with c0 sent to c1, c1 to c2 and the last back to c0
+    """
+    seen = set()
+    cycles = []
+    for start in range(len(permutation)):
+        if start in seen or permutation[start] == start:
+            continue
+        cycle = [start]
+        while permutation[cycle[-1]] != start:
+            cycle.append(int(permutation[cycle[-1]]))
+        seen.update(cycle)
+        cycles.append(cycle)
+    return cycles
+
+
+def _move(view: np.ndarray, cycles: list[list[int]], qubits: list[int], n: int, lead: tuple = ()) -> None:
+    """
+    Moves the blocks of a (2,)*n view, after any leading batch axes, around each cycle in place, keeping only one
+    block aside per cycle
+    @param view: The amplitudes, modified in place
+    @param cycles: The cycles of the permutation, see _cycles
+    @param qubits: The k qbits the permutation acts on
+    @param n: Number of qbit axes in the view
+    @param lead: Slices selecting everything along the leading axes
+    @return: None
+    """
+    k = len(qubits)
+
+    def block(row: int) -> np.ndarray:
+        return view[lead + _index(n, {qubit: (row >> (k - 1 - bit)) & 1 for bit, qubit in enumerate(qubits)})]
+
+    for cycle in cycles:
+        last = block(cycle[-1]).copy()
+        for position in range(len(cycle) - 1, 0, -1):
+            block(cycle[position])[...] = block(cycle[position - 1])
+        block(cycle[0])[...] = last
+
+
+def applyPermutation(state: np.ndarray, permutation: np.ndarray, qubits: list[int], n: int,
+                     threads: int = 1) -> np.ndarray:
+    """
+    Applies a permutation gate to k qbits in place by moving amplitude blocks, with no floating point work.
+    Only blocks that move are touched, e.g. half the state for CNOT and a quarter for TOFFOLI.
+    @param state: Contiguous amplitude array of length 2^n, modified in place
+    @param permutation: Entry i is the basis state of the k qbits that |i> is sent to, the first qbit being the most
+    significant
+    @param qubits: Indices of the k qbits
+    @param n: Number of qbits in the register
+    @param threads: The number of threads to split the amplitudes between
+    @return: The same state array
+    """
+    cycles = _cycles(permutation)
+    _threaded(lambda view: _move(view, cycles, qubits, n), state, tuple(qubits), n, threads)
+    return state
+
+
+# Controlled kernels: a controlled gate acts on the view of the amplitudes whose controls hold their values, the
+# same length one slices as _index, so the gate helpers above work on it unchanged.
+
+def _contract(view: np.ndarray, gate: np.ndarray, targets: list[int], n: int, lead: tuple = ()) -> None:
+    """
+    Multiplies the target axes of a (2,)*n view, after any leading batch axis, by a dense gate in place
+    @param view: The amplitudes, modified in place
+    @param gate: 2^k x 2^k unitary, or one per row of a leading batch axis
+    @param targets: The k target qbits, the first being the most significant in the gate
+    @param n: Number of qbit axes in the view
+    @param lead: Slices selecting everything along the leading axes
+    @return: None
+    """
+    k = len(targets)
+    batched = gate.ndim == 3
+    tensor = gate.reshape(((len(gate),) if batched else ()) + (2,) * (2 * k))
+    # einsum labels: 0 is the batch axis if there is one, then the qbit axes and then the gate's output axes
+    first = len(lead)
+    axes = list(range(first + n))
+    inputs = [first + target for target in targets]
+    outputs = [first + n + position for position in range(k)]
+    output = [outputs[inputs.index(axis)] if axis in inputs else axis for axis in axes]
+    view[...] = np.einsum(tensor, ([0] if batched else []) + outputs + inputs, view, axes, output)
+
+
+def _subspace(gate: np.ndarray, targets: list[int], n: int, lead: tuple = ()) -> Callable[[np.ndarray], None]:
+    """
+    Picks the cheapest way to apply a gate to the targets of a view: a phase multiply for diagonal gates, block
+    moves for permutations, the paired update for single qbit gates and a contraction otherwise
+    @param gate: 2^k x 2^k unitary, or one per row of a leading batch axis
+    @param targets: The k target qbits, the first being the most significant in the gate
+    @param n: Number of qbit axes in the views
+    @param lead: Slices selecting everything along the leading axes
+    @return: Function applying the gate to a view in place
+    """
+    if gate.ndim == 2:
+        phases = np.diagonal(gate)
+        if np.count_nonzero(gate) == np.count_nonzero(phases):
+            return lambda view: _scale(view, phases, targets, n, lead)
+        permutation = permutationOf(gate)
+        if permutation is not None:
+            cycles = _cycles(permutation)
+            return lambda view: _move(view, cycles, targets, n, lead)
+    if len(targets) > 1:
+        return lambda view: _contract(view, gate, targets, n, lead)
+    target = targets[0]
+    matrix = _broadcast(gate, len(lead) + n)
+    return lambda view: _update(view[lead + _index(n, {target: 0})], view[lead + _index(n, {target: 1})], matrix)
+
+
+# Batched kernels: the statevector has shape (B, 2^n), one row per batch element, and each gate is either one
+# matrix shared by every row or an array of B matrices (e.g. a rotation over a vector of B angles).
+# Every gate is still a single whole-array numpy call, so a batch costs about one pass over the (B, 2^n) array.
+
+def _broadcast(gate: np.ndarray, ndim: int) -> np.ndarray:
+    """
+    Reshapes a (B, 2, 2) stack of gates so gate[i][j] broadcasts against an amplitude view with the batch axis first
+    @param gate: 2x2 gate shared by the batch, or (B, 2, 2) gates
+    @param ndim: The number of dimensions of the amplitude views the gate is applied to
+    @return: The gate, indexable as gate[i][j] either way
+    """
+    if gate.ndim == 2:
+        return gate
+    return np.moveaxis(gate, 0, -1).reshape((2, 2, len(gate)) + (1,) * (ndim - 1))
+
+
+def applySingleBatch(states: np.ndarray, gate: np.ndarray, qubit: int, n: int) -> np.ndarray:
+    """
+    Applies a 2x2 gate, or one 2x2 gate per row, to one qbit of every row of a batch of statevectors in place
+    @param states: Contiguous amplitude array of shape (B, 2^n), modified in place
+    @param gate: 2x2 unitary shared by the batch, or (B, 2, 2) unitaries
+    @param qubit: Index of the target qbit
+    @param n: Number of qbits in the register
+    @return: The same states array
+    """
+    view = states.reshape(len(states), 1 << qubit, 2, 1 << (n - qubit - 1))
+    _update(view[:, :, 0, :], view[:, :, 1, :], _broadcast(gate, 3))
+    return states
+
+
+def applyControlledBatch(states: np.ndarray, gate: np.ndarray, controls: list[int] | dict[int, int],
+                         target: int | list[int], n: int) -> np.ndarray:
+    """
+    Applies a 2^k x 2^k gate, or one per row, to the targets where every control qbit holds its value, across a
+    batch in place, see applyControlled
+    @param states: Contiguous amplitude array of shape (B, 2^n), modified in place
+    @param gate: 2^k x 2^k unitary shared by the batch, or (B, 2^k, 2^k) unitaries
+    @param controls: Indices of the control qbits, which must be |1>, or a dict of control qbit to its value
+    @param target: Index of the target qbit, or a list of k targets
+    @param n: Number of qbits in the register
+    @return: The same states array
+    """
+    fixed = controls if isinstance(controls, dict) else {control: 1 for control in controls}
+    targets = [target] if isinstance(target, int) else list(target)
+    lead = (slice(None),)
+    _subspace(gate, targets, n, lead)(states.reshape((len(states),) + (2,) * n)[lead + _index(n, fixed)])
+    return states
+
+
+def applySwapBatch(states: np.ndarray, first: int, second: int, n: int) -> np.ndarray:
+    """
+    Swaps two qbits in every row of a batch of statevectors in place
+    @param states: Contiguous amplitude array of shape (B, 2^n), modified in place
+    @param first: Index of the first qbit
+    @param second: Index of the second qbit
+    @param n: Number of qbits in the register
+    @return: The same states array
+    """
+    view = states.reshape((len(states),) + (2,) * n)
+    zero_one = view[(slice(None),) + _index(n, {first: 0, second: 1})]
+    one_zero = view[(slice(None),) + _index(n, {first: 1, second: 0})]
+    temp = zero_one.copy()
+    zero_one[...] = one_zero
+    one_zero[...] = temp
+    return states
+
+
+def applyMatrixBatch(states: np.ndarray, matrix: np.ndarray, qubits: list[int], n: int) -> np.ndarray:
+    """
+    Applies a 2^k x 2^k gate, or one per row, to k qbits of every row of a batch of statevectors in place
+    @param states: Contiguous amplitude array of shape (B, 2^n), modified in place
+    @param matrix: 2^k x 2^k unitary shared by the batch, or (B, 2^k, 2^k) unitaries
+    @param qubits: Indices of the k qbits, the first being the most significant in the matrix
+    @param n: Number of qbits in the register
+    @return: The same states array
+    """
+    k = len(qubits)
+    batched = matrix.ndim == 3
+    tensor = matrix.reshape(((len(matrix),) if batched else ()) + (2,) * (2 * k))
+    view = states.reshape((len(states),) + (2,) * n)
+    # einsum labels: 0 is the batch axis, 1..n the qbit axes and n+1..n+k the gate's output axes
+    inputs = [qubit + 1 for qubit in qubits]
+    outputs = [n + 1 + position for position in range(k)]
+    output = [0] + [outputs[inputs.index(axis)] if axis in inputs else axis for axis in range(1, n + 1)]
+    view[...] = np.einsum(tensor, ([0] if batched else []) + outputs + inputs, view, list(range(n + 1)), output)
+    return states
+
+
+def applyDiagonalBatch(states: np.ndarray, phases: np.ndarray, qubits: list[int], n: int) -> np.ndarray:
+    """
+    Applies a diagonal gate shared by the batch to k qbits of every row in place, see applyDiagonal
+    @param states: Contiguous amplitude array of shape (B, 2^n), modified in place
+    @param phases: The 2^k diagonal entries, the first qbit being the most significant
+    @param qubits: Indices of the k qbits
+    @param n: Number of qbits in the register
+    @return: The same states array
+    """
+    _scale(states.reshape((len(states),) + (2,) * n), phases, qubits, n, (slice(None),))
+    return states
+
+
+def applyPermutationBatch(states: np.ndarray, permutation: np.ndarray, qubits: list[int], n: int) -> np.ndarray:
+    """
+    Applies a permutation gate shared by the batch to k qbits of every row in place, see applyPermutation
+    @param states: Contiguous amplitude array of shape (B, 2^n), modified in place
+    @param permutation: Entry i is the basis state of the k qbits that |i> is sent to
+    @param qubits: Indices of the k qbits
+    @param n: Number of qbits in the register
+    @return: The same states array
+    """
+    _move(states.reshape((len(states),) + (2,) * n), _cycles(permutation), qubits, n, (slice(None),))
+    return states
+
+
+def pauliMasks(term: str) -> tuple[int, int, int]:
+    """
+    Encodes a Pauli string as bitmasks over the basis index, qbit 0 being the first character (e.g. "XIZ").
+    P|i> = i^y (-1)^parity(i & z) |i ^ x>, so the operator never has to be built.
+    @param term: One of I, X, Y or Z per qbit
+    @return: The flip mask x (X and Y), the sign mask z (Z and Y) and the number of Y factors
+    """
+    n = len(term)
+    x = sum(1 << (n - 1 - qubit) for qubit, pauli in enumerate(term) if pauli in "XY")
+    z = sum(1 << (n - 1 - qubit) for qubit, pauli in enumerate(term) if pauli in "ZY")
+    return x, z, term.count("Y")
+
+
+def parity(values: np.ndarray) -> np.ndarray:
+    """
+    Returns the parity of the set bits of each value by folding the bits onto the lowest one
+    @param values: Non-negative int64 array
+    @return: Array of 0 (even) and 1 (odd)
+    """
+    values = values.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        values ^= values >> shift
+    return values & 1
+
+
+def pauliExpectations(state: np.ndarray, terms: list[str], n: int, indices: np.ndarray | None = None,
+                      block: int = 16, chunk: int = 1 << 16) -> np.ndarray:
+    """
+    Computes <psi|P|psi> exactly for many Pauli strings without building any operator or collapsing the state.
+    Terms are grouped by their flip mask: conj(psi[i ^ x]) psi[i] is formed once per group, and the sign vectors of
+    every term in the group are applied in one matrix product. Both are built for a fixed number of amplitudes at a
+    time, so the memory used does not grow with the state.
+    @param state: Amplitude array of shape (..., 2^n), e.g. a (B, 2^n) batch, left unchanged
+    @param terms: Pauli strings of length n, qbit 0 first
+    @param n: Number of qbits in the register
+    @param indices: The sorted basis state of each amplitude if the state is stored sparsely, by default position i
+    is |i>
+    @param block: The number of terms whose sign vectors are built at once
+    @param chunk: The number of amplitudes whose products and signs are built at once
+    @return: Array of shape (..., len(terms)) of real expectation values
+    """
+    masks = [pauliMasks(term) for term in terms]
+    results = np.zeros(state.shape[:-1] + (len(terms),), dtype=np.float64)
+    groups: dict[int, list[int]] = {}
+    for position, (x, z, y) in enumerate(masks):
+        groups.setdefault(x, []).append(position)
+    length = state.shape[-1]
+    for begin in range(0, length, chunk):
+        end = min(begin + chunk, length)
+        basis = np.arange(begin, end, dtype=np.int64) if indices is None else indices[begin:end]
+        amplitudes = state[..., begin:end]
+        for x, positions in groups.items():
+            if not x:
+                products = np.abs(amplitudes) ** 2
+            elif indices is None:
+                products = np.conj(state[..., basis ^ x]) * amplitudes
+            else:
+                keys = basis ^ x
+                found = np.minimum(np.searchsorted(indices, keys), len(indices) - 1)
+                products = np.conj(np.where(indices[found] == keys, state[..., found], 0)) * amplitudes
+            for start in range(0, len(positions), block):
+                selected = positions[start:start + block]
+                z = np.array([masks[position][1] for position in selected], dtype=np.int64)
+                signs = 1 - 2 * parity(basis[None, :] & z[:, None])  # (terms, amplitudes) of +1 and -1
+                phases = np.array([1j ** masks[position][2] for position in selected])
+                # Pauli strings are Hermitian so the imaginary part is only rounding error
+                results[..., selected] += np.real(products @ signs.T * phases)
+    return results
+
+
+def chunkGroups(n: int, local: int, qubits: tuple[int, ...]) -> tuple[list[list[int]], dict[int, int]]:
+    """
+    Splits the statevector into chunks of 2^local amplitudes and groups together the chunks a gate has to see at
+    once. Chunk numbers have n - local bits: the bits of the gate's qbits select the chunks within a group, the
+    remaining bits enumerate the groups, so every group can be updated independently of the others.
+    @param n: Number of qbits in the register
+    @param local: log2 of the chunk size, qbits with index >= n - local lie inside a chunk
+    @param qubits: The qbits the gate touches, including controls
+    @return: The start index of every chunk in each group, and a map from qbit to its index in the group's block
+    """
+    outer = n - local
+    high = sorted(qubit for qubit in qubits if qubit < outer)
+    free = [bit for bit in range(outer) if (outer - 1 - bit) not in high]  # chunk number bits not in the gate
+
+    mapping = {qubit: position for position, qubit in enumerate(high)}
+    mapping |= {qubit: len(high) + qubit - outer for qubit in qubits if qubit >= outer}
+    offsets = [sum(1 << (outer - 1 - qubit) for position, qubit in enumerate(high)
+                   if (combo >> (len(high) - 1 - position)) & 1) for combo in range(1 << len(high))]
+
+    groups = []
+    for group in range(1 << len(free)):
+        base = sum(1 << bit for position, bit in enumerate(free) if (group >> position) & 1)
+        groups.append([(base | offset) << local for offset in offsets])
+    return groups, mapping
+
+
+def sampleCounts(state: np.ndarray, shots: int, n: int, seed: int | None = None,
+                 indices: np.ndarray | None = None) -> dict[str, int] | bool:
+    """
+    Draws many measurement outcomes from the amplitudes in one vectorised step without collapsing the state
+    @param state: Amplitude array of length 2^n, left unchanged
+    @param shots: The number of outcomes to draw
+    @param n: Number of qbits in the register
+    @param seed: Optional seed for a reproducible histogram
+    @param indices: The basis state of each amplitude if the state is stored sparsely, by default position i is |i>
+    @return: Histogram of outcomes keyed by bitstring, qbit 0 first, else False
+    """
+    cumulative = np.cumsum(np.abs(state) ** 2, dtype=np.float64)  # Summed in double even for single precision
+    try:
+        assert len(cumulative) > 0 and cumulative[-1] > 0
+    except AssertionError:
+        print("E: Cannot sample a state whose amplitudes are all zero")
+        return False
+    draws = np.random.default_rng(seed).random(shots) * cumulative[-1]  # scaled so the state need not be normalised
+    outcomes = np.minimum(np.searchsorted(cumulative, draws, side="right"), len(state) - 1)
+    counts = np.bincount(outcomes, minlength=len(state))
+    seen = np.flatnonzero(counts)
+    labels = seen if indices is None else indices[seen]
+    # Build every bitstring at once as ASCII '0'/'1' bytes rather than formatting each index in Python
+    bits = ((labels[:, None] >> np.arange(n - 1, -1, -1)) & 1).astype(np.uint8) + ord("0")
+    keys = np.ascontiguousarray(bits).view(f"S{n}").ravel().astype(str)
+    return dict(zip(keys.tolist(), counts[seen].tolist()))
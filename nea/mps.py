@@ -0,0 +1,223 @@
+from typing import Self
+
+import numpy as np
+
+from backend import Backend
+from gates import Gates, gateMatrix
+from operation import Operation
+from register import Register
+
+_SWAP = gateMatrix(Gates.SWAP)
+
+
+class MPSRegister(Backend):
+    """
+    A register stored as a matrix product state: one (left bond, 2, right bond) tensor per qbit, so memory grows
+    linearly with the number of qbits rather than as 2^n. Shallow or nearest-neighbour circuits on 50 to 100 qbits
+    keep small bonds and fit easily.
+    Two qbit gates are applied to neighbouring tensors and split again by an SVD, keeping at most 'bond' singular
+    values. The weight discarded by each truncation is summed in truncation_error and the estimated overlap with the
+    exact state is tracked in fidelity. The tensors are kept in mixed canonical form around 'center' so each
+    truncation is the best possible for that bond.
+    """
+
+    def __init__(self, n: int, dirac: int = 0, bond: int = 64, cutoff: float = 1e-12) -> None:
+        """
+        Initialises the register in a computational basis state, a product state with every bond of dimension 1
+        @param n: The number of qbits in the register
+        @param dirac: The basis state to start in, qbit 0 being the leftmost symbol in dirac notation (e.g. |0>)
+        @param bond: The largest bond dimension kept after each two qbit gate
+        @param cutoff: Singular values whose squared weight is below this fraction are always dropped
+        @return: None
+        """
+        try:
+            assert type(n) is int and type(dirac) is int and n > 0 and 0 <= dirac < (1 << n)
+            assert type(bond) is int and bond > 0
+        except AssertionError:
+            print("E: 'n' and 'bond' must be positive integers and 'dirac' must fit in n bits")
+            exit(1)
+        self.n = n
+        self.bond = bond
+        self.cutoff = cutoff
+        self.tensors = []
+        for qubit in range(n):
+            tensor = np.zeros((1, 2, 1), dtype=np.complex128)
+            tensor[0, (dirac >> (n - 1 - qubit)) & 1, 0] = 1
+            self.tensors.append(tensor)
+        self.center = 0  # Tensors left of the center are left canonical, those right of it right canonical
+        self.truncation_error = 0.0  # Total squared weight of the discarded singular values
+        self.fidelity = 1.0  # Product of the weight kept by every truncation
+        self.fused = 0
+
+    def _moveCenter(self, site: int) -> None:
+        """
+        Moves the orthogonality center to a site with QR decompositions, leaving the state unchanged
+        @param site: The qbit to move the center to
+        @return: None
+        """
+        while self.center < site:
+            left, _, right = self.tensors[self.center].shape
+            q, r = np.linalg.qr(self.tensors[self.center].reshape(left * 2, right))
+            self.tensors[self.center] = q.reshape(left, 2, -1)
+            self.tensors[self.center + 1] = np.tensordot(r, self.tensors[self.center + 1], axes=(1, 0))
+            self.center += 1
+        while self.center > site:
+            left, _, right = self.tensors[self.center].shape
+            q, r = np.linalg.qr(self.tensors[self.center].reshape(left, 2 * right).T)
+            self.tensors[self.center] = q.T.reshape(-1, 2, right)
+            self.tensors[self.center - 1] = np.tensordot(self.tensors[self.center - 1], r.T, axes=(2, 0))
+            self.center -= 1
+
+    def _applyAdjacent(self, matrix: np.ndarray, site: int) -> None:
+        """
+        Applies a 4x4 gate to the qbits at site and site + 1, then splits the pair with a truncated SVD
+        @param matrix: The gate, the qbit at site being the most significant
+        @param site: The left qbit of the pair
+        @return: None
+        """
+        self._moveCenter(site)
+        left, right = self.tensors[site], self.tensors[site + 1]
+        pair = np.tensordot(left, right, axes=(2, 0))  # (left bond, 2, 2, right bond)
+        pair = np.einsum("abcd,xcdy->xaby", matrix.reshape(2, 2, 2, 2), pair)
+        outer_left, outer_right = pair.shape[0], pair.shape[3]
+        u, s, vh = np.linalg.svd(pair.reshape(outer_left * 2, 2 * outer_right), full_matrices=False)
+        weights = s ** 2
+        total = weights.sum()
+        keep = max(1, min(self.bond, int(np.count_nonzero(weights > self.cutoff * total))))
+        discarded = float(weights[keep:].sum() / total)
+        self.truncation_error += discarded
+        self.fidelity *= 1 - discarded
+        s = s[:keep] / np.sqrt(weights[:keep].sum())  # Renormalise what is kept
+        self.tensors[site] = u[:, :keep].reshape(outer_left, 2, keep)
+        self.tensors[site + 1] = (s[:, None] * vh[:keep]).reshape(keep, 2, outer_right)
+        self.center = site + 1
+
+    def _applyTwo(self, matrix: np.ndarray, first: int, second: int) -> None:
+        """
+        Applies a 4x4 gate to any two qbits, moving the second next to the first with SWAP gates and back again
+        @param matrix: The gate, the first qbit being the most significant
+        @param first: The first qbit
+        @param second: The second qbit
+        @return: None
+        """
+        if first > second:
+            first, second, matrix = second, first, _SWAP @ matrix @ _SWAP
+        for site in range(second - 1, first, -1):
+            self._applyAdjacent(_SWAP, site)
+        self._applyAdjacent(matrix, first)
+        for site in range(first + 1, second):
+            self._applyAdjacent(_SWAP, site)
+
+    def apply(self, gate: Gates | list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a one or two qbit gate. Gates on qbits that are not neighbours are routed with SWAP gates.
+        @param gate: A Gates member or a 2x2 or 4x4 matrix
+        @param qubits: The qbits the gate acts on, control first for controlled gates
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        matrix = gateMatrix(gate)
+        try:
+            assert len(qubits) in (1, 2)
+            assert matrix.shape == (1 << len(qubits), 1 << len(qubits))
+        except AssertionError:
+            print("E: The MPS backend only supports one and two qbit gates matching the number of qbits given")
+            return False
+        if len(qubits) == 1:
+            self.tensors[qubits[0]] = np.einsum("ab,xby->xay", matrix, self.tensors[qubits[0]])
+        else:
+            self._applyTwo(matrix, *qubits)
+        return self
+
+    def run(self, operations: list[Operation], fusion: bool = False, width: int = 2) -> Self | bool:
+        """
+        Applies a list of operations in order, optionally fusing adjacent gates first
+        @param operations: The gates to apply
+        @param fusion: If True, runs of gates on at most 'width' qbits are multiplied together before execution
+        @param width: The largest number of qbits a fused gate may act on, at most 2 for this backend
+        @return: The register, else False
+        """
+        return super().run(operations, fusion, min(width, 2))
+
+    def bonds(self) -> list[int]:
+        """
+        Returns the dimension of every bond between neighbouring qbits
+        @return: n - 1 bond dimensions
+        """
+        return [tensor.shape[2] for tensor in self.tensors[:-1]]
+
+    def amplitude(self, dirac: int) -> complex:
+        """
+        Returns the amplitude of one basis state by multiplying one matrix per qbit
+        @param dirac: The basis state, qbit 0 being the leftmost symbol in dirac notation
+        @return: The amplitude
+        """
+        vector = np.ones(1, dtype=np.complex128)
+        for qubit, tensor in enumerate(self.tensors):
+            vector = vector @ tensor[:, (dirac >> (self.n - 1 - qubit)) & 1, :]
+        return complex(vector[0])
+
+    def expectation(self, observable: str | dict[str, float]) -> float | bool:
+        """
+        Returns the exact expectation value of a Pauli string or a weighted sum of them by contracting the state with
+        itself one qbit at a time, costing O(n bond^3) per term
+        @param observable: A Pauli string such as "XIZ" (qbit 0 first), or a dict of Pauli strings to coefficients
+        @return: <psi|observable|psi>, else False
+        """
+        split = self._observable(observable, self.n)
+        if split is False:
+            return False
+        terms, coefficients = split
+        paulis = {"I": np.eye(2, dtype=np.complex128), "X": gateMatrix(Gates.PAULI_X),
+                  "Y": gateMatrix(Gates.PAULI_Y), "Z": gateMatrix(Gates.PAULI_Z)}
+        total = 0.0
+        for term, coefficient in zip(terms, coefficients):
+            environment = np.ones((1, 1), dtype=np.complex128)
+            for pauli, tensor in zip(term, self.tensors):
+                acted = np.einsum("ab,xby->xay", paulis[pauli], tensor)
+                environment = np.einsum("xu,xav,uaw->vw", environment, np.conj(tensor), acted)
+            total += coefficient * environment[0, 0].real
+        return float(total)
+
+    def sample(self, shots: int = 1, seed: int | None = None) -> dict[str, int] | bool:
+        """
+        Measures the register many times without collapsing it, drawing every shot one qbit at a time from the
+        right canonical form so no 2^n array is ever built
+        @param shots: The number of measurements to take
+        @param seed: Optional seed for a reproducible histogram
+        @return: Counts of each outcome keyed by bitstring (qbit 0 first), else False
+        """
+        if not self._shots(shots):
+            return False
+        self._moveCenter(0)
+        rng = np.random.default_rng(seed)
+        environment = np.ones((shots, 1), dtype=np.complex128)
+        bits = np.empty((shots, self.n), dtype=np.uint8)
+        for qubit, tensor in enumerate(self.tensors):
+            branches = np.einsum("sx,xby->sby", environment, tensor)
+            weights = np.sum(np.abs(branches) ** 2, axis=2)
+            outcome = rng.random(shots) * weights.sum(axis=1) >= weights[:, 0]
+            bits[:, qubit] = outcome
+            environment = branches[np.arange(shots), outcome.astype(np.intp)]
+            environment /= np.linalg.norm(environment, axis=1, keepdims=True)
+        keys, counts = np.unique((bits + ord("0")).view(f"S{self.n}").ravel(), return_counts=True)
+        return dict(zip(keys.astype(str).tolist(), counts.tolist()))
+
+    def toDense(self) -> Register:
+        """
+        Contracts the tensors into a dense Register, only possible for registers small enough to fit in memory
+        @return: Dense register with the same amplitudes
+        """
+        state = np.ones((1, 1), dtype=np.complex128)
+        for tensor in self.tensors:
+            state = np.tensordot(state, tensor, axes=(1, 0)).reshape(-1, tensor.shape[2])
+        return Register.fromState(np.ascontiguousarray(state.reshape(-1)))
+
+    def __repr__(self) -> str:
+        """
+        Returns the size of the state rather than its amplitudes, which may not fit in memory
+        @return: String representation of the register
+        """
+        return f"MPSRegister(n={self.n}, bonds<={max(self.bonds(), default=1)}, " \
+               f"truncation_error={self.truncation_error:.3g}, fidelity={self.fidelity:.3g})"
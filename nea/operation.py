@@ -0,0 +1,68 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from gates import Gates, controlledMatrix, gateMatrix, parameterised
+from kernels import permutationOf
+
+
+@dataclass
+class Operation:
+    """
+    One gate acting on specific qbits of a register.
+    Named gates refer to a Gates member, parameterised gates (RX, RY, RZ, U3) are named by a string with their angles
+    in params, and generated gates (e.g. the output of fusion) carry their own unitary. A "CONTROLLED" gate carries
+    the unitary of its targets and the value each control must hold in params, its qbits being the controls then the
+    targets.
+    """
+    gate: Gates | str
+    qubits: tuple[int, ...]
+    unitary: np.ndarray | None = None
+    params: tuple[float, ...] = ()
+
+    def matrix(self) -> np.ndarray:
+        """
+        Returns the 2^k x 2^k unitary of the operation
+        @return: Complex matrix of the gate
+        """
+        if self.gate == "CONTROLLED":
+            return controlledMatrix(self.unitary, self.params)
+        if self.unitary is not None:
+            return self.unitary
+        if isinstance(self.gate, str):
+            return parameterised(self.gate, *self.params)
+        return gateMatrix(self.gate)
+
+    def diagonal(self) -> np.ndarray | None:
+        """
+        Returns the diagonal of the operation's unitary if every other entry is zero, e.g. for Z, T, CZ and RZ
+        @return: The 2^k phases, else None, including for batched parameters
+        """
+        matrix = self.matrix()
+        if matrix is False or matrix.ndim != 2:
+            return None
+        phases = np.diagonal(matrix)
+        return phases if np.count_nonzero(matrix) == np.count_nonzero(phases) else None
+
+    def permutation(self) -> np.ndarray | None:
+        """
+        Returns where the operation sends each basis state if its unitary is a permutation matrix, e.g. for X, CNOT,
+        SWAP and TOFFOLI
+        @return: Array whose entry i is the basis state |i> is sent to, else None, including for batched parameters
+        """
+        matrix = self.matrix()
+        return None if matrix is False else permutationOf(matrix)
+
+
+def depth(operations: list[Operation]) -> int:
+    """
+    Returns the number of layers of gates, where gates in the same layer act on disjoint qbits
+    @param operations: The gates in execution order
+    @return: The circuit depth
+    """
+    layers: dict[int, int] = {}
+    for operation in operations:
+        layer = max(layers.get(qubit, 0) for qubit in operation.qubits) + 1
+        for qubit in operation.qubits:
+            layers[qubit] = layer
+    return max(layers.values(), default=0)
@@ -0,0 +1,139 @@
+from math import isclose, pi, tau
+
+import numpy as np
+
+from gates import Gates
+from operation import Operation, depth
+
+# Gates that undo themselves, so two in a row on the same qbits cancel
+SELF_INVERSE = {Gates.HADAMARD, Gates.PAULI_X, Gates.PAULI_Y, Gates.PAULI_Z, Gates.CNOT, Gates.CZ, Gates.SWAP,
+                Gates.TOFFOLI}
+SYMMETRIC = {Gates.CZ, Gates.SWAP}  # Gates whose qbits can be given in any order
+
+# Phase gates diag(1, e^(i phi)), which merge by adding their angles
+PHASES = {Gates.PAULI_Z: pi, Gates.PHASE: pi / 2, Gates.T: pi / 4}
+
+
+def _phase(operation: Operation) -> float | None:
+    """
+    Returns the angle of a single qbit phase gate
+    @param operation: Any operation
+    @return: phi if the operation is diag(1, e^(i phi)), else None
+    """
+    if operation.gate in PHASES:
+        return PHASES[operation.gate]
+    if operation.gate == "DIAGONAL":
+        return operation.params[0]
+    return None
+
+
+def _phaseGate(qubit: int, phi: float) -> list[Operation]:
+    """
+    Builds the simplest operation for a phase gate, a named gate where there is one
+    @param qubit: The qbit the gate acts on
+    @param phi: The phase angle
+    @return: No operations for the identity, else one operation
+    """
+    phi %= tau
+    if isclose(phi, 0, abs_tol=1e-12) or isclose(phi, tau):
+        return []
+    for gate, angle in PHASES.items():
+        if isclose(phi, angle):
+            return [Operation(gate, (qubit,))]
+    return [Operation("DIAGONAL", (qubit,), np.diag([1, np.exp(1j * phi)]), (phi,))]
+
+
+def _basis(operation: Operation, qubit: int) -> str | None:
+    """
+    Returns the basis a gate is diagonal in on one of its qbits
+    @param operation: The operation
+    @param qubit: One of the operation's qbits
+    @return: "Z" for phase gates and controls, "X" for X, RX and controlled targets, else None
+    """
+    if operation.gate in PHASES or operation.gate in (Gates.CZ, "RZ", "DIAGONAL"):
+        return "Z"
+    if operation.gate in (Gates.CNOT, Gates.TOFFOLI):
+        return "Z" if qubit != operation.qubits[-1] else "X"
+    if operation.gate in (Gates.PAULI_X, "RX"):
+        return "X"
+    return None
+
+
+def _commutes(first: Operation, second: Operation) -> bool:
+    """
+    Checks whether two gates can be swapped. Gates on disjoint qbits always commute, otherwise both gates must be
+    diagonal in the same basis (Z or X) on every qbit they share, e.g. Z with a CNOT control or X with its target.
+    @param first: The earlier operation
+    @param second: The later operation
+    @return: True if the order of the two gates does not matter
+    """
+    for qubit in set(first.qubits) & set(second.qubits):
+        basis = _basis(first, qubit)
+        if basis is None or basis != _basis(second, qubit):
+            return False
+    return True
+
+
+def _combine(first: Operation, second: Operation) -> list[Operation] | None:
+    """
+    Replaces a pair of gates on the same qbits by their product where it is simpler
+    @param first: The earlier operation
+    @param second: The later operation
+    @return: The operations replacing both, empty if they cancel, else None if they do not combine
+    """
+    same = first.qubits == second.qubits or (first.gate in SYMMETRIC and set(first.qubits) == set(second.qubits))
+    if not same:
+        return None
+    if first.gate is second.gate and first.gate in SELF_INVERSE:
+        return []
+    if len(first.qubits) != 1:
+        return None
+    phases = _phase(first), _phase(second)
+    if None not in phases:
+        return _phaseGate(first.qubits[0], sum(phases))
+    if first.gate == second.gate and first.gate in ("RX", "RY", "RZ") and \
+            np.ndim(first.params[0]) == 0 and np.ndim(second.params[0]) == 0:
+        theta = (first.params[0] + second.params[0]) % (2 * tau)  # Rotations repeat every 4 pi
+        if isclose(theta, 0, abs_tol=1e-12) or isclose(theta, 2 * tau):
+            return []
+        return [Operation(first.gate, first.qubits, params=(theta,))]
+    return None
+
+
+def _insert(output: list[Operation], operation: Operation, window: int) -> bool:
+    """
+    Adds a gate to the end of the optimised circuit, first looking back past the gates it commutes with for one it
+    cancels or merges with
+    @param output: The optimised operations so far, modified in place
+    @param operation: The next operation
+    @param window: How many earlier gates to look at
+    @return: True if the gate was cancelled or merged, else False
+    """
+    for position in range(len(output) - 1, max(-1, len(output) - 1 - window), -1):
+        replacement = _combine(output[position], operation)
+        if replacement is not None:
+            output[position:position + 1] = replacement
+            return True
+        if not _commutes(output[position], operation):
+            break
+    output.append(operation)
+    return False
+
+
+def optimise(operations: list[Operation], window: int = 64) -> tuple[list[Operation], dict[str, int]]:
+    """
+    Peephole optimiser: cancels pairs of self-inverse gates, merges phase gates (Z, PHASE, T) into one diagonal and
+    adds up repeated rotations, looking past gates that commute so more pairs meet. Passes repeat until nothing
+    changes, as each cancellation can bring another pair together.
+    @param operations: The gates in execution order
+    @param window: How many earlier gates each gate is compared against
+    @return: The optimised operations, and the gate count and depth before and after
+    """
+    report = {"gates_before": len(operations), "depth_before": depth(operations)}
+    changed = True
+    while changed:
+        output = []
+        changed = any([_insert(output, operation, window) for operation in operations])
+        operations = output
+    report |= {"gates_after": len(operations), "depth_after": depth(operations)}
+    return operations, report
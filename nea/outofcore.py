@@ -0,0 +1,249 @@
+import os
+import tempfile
+import weakref
+from typing import Callable, Self
+
+import numpy as np
+
+from backend import RUN_WIDTH
+from gates import Gates
+from kernels import chunkDiagonal, chunkGroups, pauliExpectations, sampleCounts
+from register import Register
+
+
+class OutOfCoreRegister(Register):
+    """
+    A register whose statevector lives in a file through np.memmap, for registers too large to hold in memory.
+    Gates are applied a few chunks at a time: for each gate, the chunks that differ only in the gate's high qbits are
+    loaded together, treated as a small in-memory Register, updated and written back. Peak resident memory is about
+    2^k chunks for a k qbit gate regardless of the register size.
+    """
+
+    def __init__(self, n: int, dirac: int = 0, path: str | None = None, chunk: int = 1 << 20) -> None:
+        """
+        Creates the statevector file in a computational basis state
+        @param n: The number of qbits in the register
+        @param dirac: The basis state to start in, qbit 0 being the leftmost symbol in dirac notation (e.g. |0>)
+        @param path: The file to store the amplitudes in, by default a new temporary file
+        @param chunk: The number of amplitudes loaded at a time, rounded down to a power of 2
+        @return: None
+        """
+        try:
+            assert type(n) is int and type(dirac) is int and n > 0 and 0 <= dirac < (1 << n)
+            assert type(chunk) is int and chunk > 0
+        except AssertionError:
+            print("E: 'n' and 'chunk' must be positive integers and 'dirac' must fit in n bits")
+            exit(1)
+        self.remove = None  # Deletes a temporary file on close, or once the register is garbage collected
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix=".statevector")
+            os.close(handle)
+            self.remove = weakref.finalize(self, os.remove, path)
+        self.n = n
+        self.path = path
+        self.local = min(chunk.bit_length() - 1, n)  # Qbits whose bit lies inside one chunk
+        self.state = np.memmap(path, dtype=np.complex128, mode="w+", shape=(1 << n,))  # The file starts zeroed
+        self.state[dirac] = 1
+        self.threads = 1
+        self.renormalise = 0
+        self.run_width = min(RUN_WIDTH, self.local)
+        self.fused = 0
+        self.bytes_read = 0  # Traffic of the last gate
+        self.bytes_written = 0
+        self.resident = 0  # The most bytes of amplitudes the last gate held in memory at once
+        self.history: list[tuple[int, int]] = []  # (bytes read, bytes written) of every gate applied
+
+    def _combinable(self, kind: str, qubits: set[int]) -> bool:
+        """
+        Checks whether run may accumulate a gate of this kind over these qbits into one. Permutations are only
+        combined inside a chunk, as a combined permutation on high qbits would load a group of chunks for each of them.
+        @param kind: "diagonal" or "permutation"
+        @param qubits: Every qbit the combined gate would act on
+        @return: True if the combined gate may be applied in one sweep
+        """
+        if kind == "permutation" and min(qubits) < self.n - self.local:
+            return False
+        return super()._combinable(kind, qubits)
+
+    def _chunked(self, qubits: tuple[int, ...], operation: Callable[[Register, dict[int, int]], object]) -> None:
+        """
+        Applies an operation one group of chunks at a time, see kernels.chunkGroups
+        @param qubits: The qbits the gate touches, including controls
+        @param operation: Called with an in-memory Register for the group and a map from qbit to its index in it
+        @return: None
+        """
+        size = 1 << self.local
+        groups, mapping = chunkGroups(self.n, self.local, qubits)
+        self.bytes_read = self.bytes_written = self.resident = 0
+        for starts in groups:
+            block = np.concatenate([self.state[start:start + size] for start in starts])
+            self.resident = max(self.resident, block.nbytes)
+            operation(Register.fromState(block), mapping)
+            for position, start in enumerate(starts):
+                self.state[start:start + size] = block[position * size:(position + 1) * size]
+            self.bytes_read += block.nbytes
+            self.bytes_written += block.nbytes
+        self.history.append((self.bytes_read, self.bytes_written))
+
+    def apply(self, gate: Gates | list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a gate to the given qbits, chunk by chunk
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param qubits: The qbits the gate acts on, controls first for controlled gates
+        @return: The register, else False
+        """
+        if not self._valid(*qubits) or not self._sized(gate, qubits):
+            return False
+        self._chunked(qubits, lambda block, mapping: block.apply(gate, *(mapping[qubit] for qubit in qubits)))
+        return self
+
+    def diagonal(self, phases: list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a diagonal gate one chunk at a time. Nothing is mixed, so no chunks are grouped even for high qbits:
+        those only pick the phases for the chunk, see kernels.chunkDiagonal, and chunks whose phases are all 1 are
+        skipped.
+        @param phases: The 2^k diagonal entries, the first qbit being the most significant
+        @param qubits: The k qbits the gate acts on
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        try:
+            assert np.shape(phases) == (1 << len(qubits),)
+        except AssertionError:
+            print("E: A diagonal gate needs 2^k phases for k qbits")
+            return False
+        size = 1 << self.local
+        self.bytes_read = self.bytes_written = 0
+        self.resident = size * self.state.itemsize
+        for start in range(0, 1 << self.n, size):
+            inner_phases, inner = chunkDiagonal(phases, list(qubits), self.n, self.local, start)
+            if np.all(inner_phases == 1):
+                continue
+            block = np.array(self.state[start:start + size])
+            Register.fromState(block).diagonal(inner_phases, *inner)
+            self.state[start:start + size] = block
+            self.bytes_read += block.nbytes
+            self.bytes_written += block.nbytes
+        self.history.append((self.bytes_read, self.bytes_written))
+        return self
+
+    def permute(self, permutation: list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a permutation gate, chunk by chunk
+        @param permutation: Entry i is the basis state of the k qbits that |i> is sent to
+        @param qubits: The k qbits the gate acts on
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        self._chunked(qubits, lambda block, mapping: block.permute(permutation, *(mapping[qubit] for qubit in qubits)))
+        return self
+
+    def controlled(self, gate: Gates | list | np.ndarray, controls: list[int], target: int | list[int],
+                   negative: list[int] | None = None) -> Self | bool:
+        """
+        Applies a gate to the targets where every control is |1> and every negative control is |0>, chunk by chunk
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param controls: The control qbits
+        @param target: The target qbit, or a list of k target qbits
+        @param negative: Control qbits that must be |0> rather than |1>
+        @return: The register, else False
+        """
+        targets = [target] if isinstance(target, int) else list(target)
+        negative = list(negative or [])
+        if not self._valid(*controls, *negative, *targets):
+            return False
+        self._chunked((*controls, *negative, *targets),
+                      lambda block, mapping: block.controlled(gate, [mapping[control] for control in controls],
+                                                              [mapping[qubit] for qubit in targets],
+                                                              [mapping[control] for control in negative]))
+        return self
+
+    def swap(self, first: int, second: int) -> Self | bool:
+        """
+        Exchanges the states of two qbits, chunk by chunk
+        @param first: The first qbit
+        @param second: The second qbit
+        @return: The register, else False
+        """
+        if not self._valid(first, second):
+            return False
+        self._chunked((first, second), lambda block, mapping: block.swap(mapping[first], mapping[second]))
+        return self
+
+    def sample(self, shots: int = 1, seed: int | None = None) -> dict[str, int] | bool:
+        """
+        Measures the register many times without collapsing it or loading the whole state.
+        The shots are first split between chunks by their total probability and then drawn within each chunk.
+        @param shots: The number of measurements to take
+        @param seed: Optional seed for a reproducible histogram
+        @return: Counts of each outcome keyed by bitstring (qbit 0 first), else False
+        """
+        if not self._shots(shots):
+            return False
+        size = 1 << self.local
+        starts = range(0, 1 << self.n, size)
+        totals = np.array([np.sum(np.abs(self.state[start:start + size]) ** 2) for start in starts])
+        try:
+            assert totals.sum() > 0
+        except AssertionError:
+            print("E: Cannot sample a state whose amplitudes are all zero")
+            return False
+        rng = np.random.default_rng(seed)
+        counts = {}
+        for start, chunk_shots in zip(starts, rng.multinomial(shots, totals / totals.sum())):
+            if chunk_shots:
+                counts |= sampleCounts(self.state[start:start + size], int(chunk_shots), self.n,
+                                       int(rng.integers(1 << 32)), np.arange(start, start + size))
+        return counts
+
+    def probabilities(self) -> np.ndarray:
+        """
+        Returns the probability of collapsing to each basis state, filled in one chunk at a time so the amplitudes are
+        never all loaded together
+        @return: Array of |amplitude|^2 indexed by basis state
+        """
+        size = 1 << self.local
+        probabilities = np.empty(1 << self.n, dtype=np.float64)
+        for start in range(0, 1 << self.n, size):
+            probabilities[start:start + size] = np.abs(self.state[start:start + size]) ** 2
+        return probabilities
+
+    def expectation(self, observable: str | dict[str, float]) -> float | bool:
+        """
+        Returns the exact expectation value of a Pauli string or a weighted sum of them, reading the amplitudes one
+        chunk at a time, see kernels.pauliExpectations
+        @param observable: A Pauli string such as "XIZ" (qbit 0 first), or a dict of Pauli strings to coefficients
+        @return: <psi|observable|psi>, else False
+        """
+        split = self._observable(observable, self.n)
+        if split is False:
+            return False
+        terms, coefficients = split
+        return float(pauliExpectations(self.state, terms, self.n, chunk=1 << self.local) @ coefficients)
+
+    def __repr__(self) -> str:
+        """
+        Returns the non-zero amplitudes using dirac notation, one chunk at a time
+        @return: String representation of the register
+        """
+        size = 1 << self.local
+        terms = []
+        for start in range(0, 1 << self.n, size):
+            block = np.asarray(self.state[start:start + size])
+            terms += [f"{block[index]:.4g}|{start + index:0{self.n}b}>" for index in np.flatnonzero(block)]
+        return " + ".join(terms)
+
+    def close(self) -> None:
+        """
+        Flushes the statevector to its file and releases the mapping, deleting the file if it was a temporary one.
+        A temporary file is also deleted if the register is garbage collected without being closed.
+        @return: None
+        """
+        if not hasattr(self, "state"):
+            return  # Already closed
+        self.state.flush()
+        del self.state
+        if self.remove is not None:
+            self.remove()
@@ -5,19 +5,21 @@ from typing import override, Self
 import numpy as np
 
 from cbit import Cbit
+from kernels import sampleCounts
 
 
 class Qbit(Cbit):
 
-    def __init__(self, dirac: int, sub=None) -> None:
+    def __init__(self, dirac: int, sub=None, array: bool = False) -> None:
         """
         Qbits are the quantum extension of Cbits that can take values intermediate of 0/1
         @param dirac: Refers to the integer that would be shown in the symbol used in dirac notation (e.g. |0>)
         @param sub: Refers to the number of bits (elements) to be used in the vector form.
         It is the subscript of dirac notation, by default, it is the minimum number required
+        @param array: If True the state is stored as a contiguous complex128 numpy array
         @return: None
         """
-        super().__init__(dirac, sub)  # Error checking is provided in the super function
+        super().__init__(dirac, sub, array)  # Error checking is provided in the super function
         self.Qbit = self.Cbit
 
         # Visualisation grid setup
@@ -37,12 +39,27 @@ class Qbit(Cbit):
             return False
         else:
             bits = [0, 1]
-            collapse = int(choices(bits, weights=(self.Cbit.vector[0] ** 2, self.Cbit.vector[1] ** 2), k=1)[0])
+            collapse = int(choices(bits, weights=(abs(self.Cbit._get(0)) ** 2, abs(self.Cbit._get(1)) ** 2), k=1)[0])
             # Qbit vectors are probabilities rather than deterministic values
-            self.Qbit.vector[0] = collapse
-            self.Qbit.vector[1] = abs(1 - collapse)
+            self.Qbit._set(0, collapse)
+            self.Qbit._set(1, abs(1 - collapse))
             return self.Qbit
 
+    def sample(self, shots: int = 1, seed: int | None = None) -> dict[str, int] | bool:
+        """
+        Measures the Qbit many times at once without collapsing it, unlike measure this works for any number of bits
+        @param shots: The number of measurements to take
+        @param seed: Optional seed for a reproducible histogram
+        @return: Counts of each outcome keyed by bitstring, else False
+        """
+        try:
+            assert type(shots) is int and shots > 0
+        except AssertionError:
+            print("E: 'shots' must be a positive integer")
+            return False
+        n = len(self.Qbit.vector).bit_length() - 1
+        return sampleCounts(np.asarray(self.Qbit.vector, dtype=np.complex128), shots, n, seed)
+
     @staticmethod
     def _softmax(vector: list) -> list | bool:
         """
@@ -162,13 +179,13 @@ class Qbit(Cbit):
 
         if len(self.Qbit.vector) == 2:  # If the length is 2 then it must be a standard Qbit
             try:
-                assert 1 >= value >= -1
-            except AssertionError:
+                assert abs(value) <= 1  # Complex amplitudes are bounded by their modulus
+            except (AssertionError, TypeError):
                 print("Value can only take the range [-1,1]")
                 # Checks to see if the element you're trying to add is a valid format
                 return False
 
-        self.Qbit.vector[index] = value
+        self.Qbit._set(index, value)
         return True
 
     # def __repr__(self):
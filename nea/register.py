@@ -0,0 +1,276 @@
+from typing import Self
+
+import numpy as np
+
+from backend import RUN_WIDTH, Backend
+from gates import Gates, gateMatrix
+from kernels import (applyControlled, applyDiagonal, applyMatrix, applyPermutation, applySingle, applySwap,
+                     pauliExpectations, permutationOf, sampleCounts)
+from operation import Operation
+
+PRECISIONS = (np.complex64, np.complex128)  # Single precision halves the memory and traffic of every gate
+
+
+class Register(Backend):
+    """
+    A register of n qbits sharing one joint statevector.
+    Unlike separate Qbit objects, entanglement between qbits is represented exactly, so controlled gates act
+    correctly on superposed controls. Every gate is applied in place by index arithmetic on the amplitudes.
+    """
+
+    def __init__(self, n: int, dirac: int = 0, threads: int = 1, dtype: type = np.complex128,
+                 renormalise: int = 0) -> None:
+        """
+        Initialises the register in a computational basis state
+        @param n: The number of qbits in the register
+        @param dirac: The basis state to start in, qbit 0 being the leftmost symbol in dirac notation (e.g. |0>)
+        @param threads: The number of threads gate kernels split the amplitudes between
+        @param dtype: The precision of the amplitudes, np.complex64 or np.complex128
+        @param renormalise: Rescale the state to unit norm after every this many gates of a run, 0 never does
+        @return: None
+        """
+        try:
+            assert type(n) is int and type(dirac) is int and n > 0 and 0 <= dirac < (1 << n)
+            assert type(threads) is int and threads > 0
+            assert dtype in PRECISIONS and type(renormalise) is int and renormalise >= 0
+        except AssertionError:
+            print("E: 'n' and 'threads' must be positive integers, 'dirac' must fit in n bits and 'dtype' must be "
+                  "np.complex64 or np.complex128")
+            exit(1)
+        self.n = n
+        self.state = np.zeros(1 << n, dtype=dtype)
+        self.state[dirac] = 1
+        self.threads = threads
+        self.renormalise = renormalise
+        self.run_width = RUN_WIDTH  # The most qbits run accumulates diagonal or permutation gates over
+        self.fused = 0  # Number of gates removed by fusion in the last run
+
+    @classmethod
+    def fromState(cls, state: np.ndarray) -> Self:
+        """
+        Wraps an existing amplitude array as a register without copying it, so gates act on that array
+        @param state: Contiguous complex array of length 2^n
+        @return: The register
+        """
+        register = cls.__new__(cls)
+        register.n = len(state).bit_length() - 1
+        register.state = state
+        register.threads = 1
+        register.renormalise = 0
+        register.run_width = RUN_WIDTH
+        register.fused = 0
+        return register
+
+    def _cast(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        Converts a gate to the precision of the state, so single precision kernels never promote to double
+        @param matrix: A complex gate matrix
+        @return: The matrix in the state's dtype
+        """
+        return matrix.astype(self.state.dtype, copy=False)
+
+    def normalise(self) -> Self:
+        """
+        Rescales the state to unit norm, removing the drift rounding error builds up over many gates
+        @return: The register
+        """
+        self.state /= np.linalg.norm(self.state, axis=-1, keepdims=True)
+        return self
+
+    def apply(self, gate: Gates | list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a gate to the given qbits. Single qbit gates and the named controlled gates use the specialised
+        kernels, any other 2^k x 2^k matrix is contracted with the k qbit axes.
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param qubits: The qbits the gate acts on, controls first for controlled gates
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        if isinstance(gate, Gates):
+            if not self._sized(gate, qubits):
+                return False
+            match gate:
+                case Gates.CNOT:
+                    return self.cnot(*qubits)
+                case Gates.CZ:
+                    return self.cz(*qubits)
+                case Gates.SWAP:
+                    return self.swap(*qubits)
+                case Gates.TOFFOLI:
+                    return self.toffoli(*qubits)
+        matrix = gateMatrix(gate)
+        try:
+            assert matrix.shape == (1 << len(qubits), 1 << len(qubits))
+        except AssertionError:
+            print("E: The gate size does not match the number of qbits given")
+            return False
+        phases = np.diagonal(matrix)
+        if np.count_nonzero(matrix) == np.count_nonzero(phases):
+            return self.diagonal(phases, *qubits)
+        permutation = permutationOf(matrix)
+        if permutation is not None:
+            return self.permute(permutation, *qubits)
+        matrix = self._cast(matrix)
+        if len(qubits) == 1:
+            applySingle(self.state, matrix, qubits[0], self.n, self.threads)
+        else:
+            applyMatrix(self.state, matrix, list(qubits), self.n, self.threads)
+        return self
+
+    def diagonal(self, phases: list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a diagonal gate, multiplying each amplitude by the phase its basis state selects. Nothing is mixed,
+        so this is a single elementwise pass that skips the amplitudes whose phase is 1.
+        @param phases: The 2^k diagonal entries, the first qbit being the most significant
+        @param qubits: The k qbits the gate acts on
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        try:
+            assert np.shape(phases) == (1 << len(qubits),)
+        except AssertionError:
+            print("E: A diagonal gate needs 2^k phases for k qbits")
+            return False
+        applyDiagonal(self.state, np.asarray(phases, dtype=self.state.dtype), list(qubits), self.n, self.threads)
+        return self
+
+    def permute(self, permutation: list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a permutation gate by moving amplitude blocks between basis states, with no arithmetic
+        @param permutation: Entry i is the basis state of the k qbits that |i> is sent to, the first qbit being the
+        most significant
+        @param qubits: The k qbits the gate acts on
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        try:
+            assert np.array_equal(np.sort(permutation), np.arange(1 << len(qubits)))
+        except AssertionError:
+            print("E: A permutation gate needs each of the 2^k basis states of its k qbits exactly once")
+            return False
+        applyPermutation(self.state, np.asarray(permutation), list(qubits), self.n, self.threads)
+        return self
+
+    def controlled(self, gate: Gates | list | np.ndarray, controls: list[int], target: int | list[int],
+                   negative: list[int] | None = None) -> Self | bool:
+        """
+        Applies a gate to the targets on the part of the state where every control is |1> and every negative control
+        is |0>. Only the 2^(n-c) amplitudes of that subspace are touched, and diagonal or permutation gates are
+        applied there without arithmetic mixing.
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param controls: The control qbits
+        @param target: The target qbit, or a list of k target qbits
+        @param negative: Control qbits that must be |0> rather than |1>
+        @return: The register, else False
+        """
+        targets = [target] if isinstance(target, int) else list(target)
+        negative = list(negative or [])
+        if not self._valid(*controls, *negative, *targets):
+            return False
+        matrix = gateMatrix(gate)
+        try:
+            assert matrix.shape == (1 << len(targets), 1 << len(targets))
+        except AssertionError:
+            print("E: The gate size does not match the number of target qbits given")
+            return False
+        fixed = {control: 1 for control in controls} | {control: 0 for control in negative}
+        applyControlled(self.state, self._cast(matrix), fixed, targets, self.n, self.threads)
+        return self
+
+    def cnot(self, control: int, target: int) -> Self | bool:
+        """
+        Controlled NOT, flips the target where the control is |1>
+        @param control: The control qbit
+        @param target: The target qbit
+        @return: The register, else False
+        """
+        return self.permute(permutationOf(gateMatrix(Gates.CNOT)), control, target)
+
+    def cz(self, control: int, target: int) -> Self | bool:
+        """
+        Controlled Z, negates the amplitudes where both qbits are |1>
+        @param control: The control qbit
+        @param target: The target qbit
+        @return: The register, else False
+        """
+        return self.diagonal(np.diagonal(gateMatrix(Gates.CZ)), control, target)
+
+    def toffoli(self, first: int, second: int, target: int) -> Self | bool:
+        """
+        Doubly controlled NOT, flips the target where both controls are |1>
+        @param first: The first control qbit
+        @param second: The second control qbit
+        @param target: The target qbit
+        @return: The register, else False
+        """
+        return self.permute(permutationOf(gateMatrix(Gates.TOFFOLI)), first, second, target)
+
+    def swap(self, first: int, second: int) -> Self | bool:
+        """
+        Exchanges the states of two qbits
+        @param first: The first qbit
+        @param second: The second qbit
+        @return: The register, else False
+        """
+        if not self._valid(first, second):
+            return False
+        applySwap(self.state, first, second, self.n, self.threads)
+        return self
+
+    @staticmethod
+    def _special(operation: Operation) -> tuple[str, np.ndarray] | None:
+        """
+        Classifies an operation that run can accumulate with its neighbours
+        @param operation: Any operation
+        @return: ("diagonal", phases) or ("permutation", permutation), else None
+        """
+        if len(set(operation.qubits)) != len(operation.qubits) or operation.gate == "CONTROLLED":
+            return None  # Left to apply to report the repeated qbit, or to controlled to touch only its subspace
+        phases = operation.diagonal()
+        if phases is not None:
+            return "diagonal", phases
+        permutation = operation.permutation()
+        return None if permutation is None else ("permutation", permutation)
+
+    def probabilities(self) -> np.ndarray:
+        """
+        Returns the probability of collapsing to each basis state
+        @return: Array of |amplitude|^2 indexed by basis state
+        """
+        return np.abs(self.state) ** 2
+
+    def sample(self, shots: int = 1, seed: int | None = None) -> dict[str, int] | bool:
+        """
+        Measures the register many times without collapsing it
+        @param shots: The number of measurements to take
+        @param seed: Optional seed for a reproducible histogram
+        @return: Counts of each outcome keyed by bitstring (qbit 0 first), else False
+        """
+        if not self._shots(shots):
+            return False
+        return sampleCounts(self.state, shots, self.n, seed)
+
+    def expectation(self, observable: str | dict[str, float]) -> float | np.ndarray | bool:
+        """
+        Returns the exact expectation value of a Pauli string or a weighted sum of them without collapsing the state.
+        Every term is evaluated in one batched pass over the amplitudes, e.g. a whole Hamiltonian at once.
+        @param observable: A Pauli string such as "XIZ" (qbit 0 first), or a dict of Pauli strings to coefficients
+        @return: <psi|observable|psi>, one per row for a batched register, else False
+        """
+        split = self._observable(observable, self.n)
+        if split is False:
+            return False
+        terms, coefficients = split
+        value = pauliExpectations(self.state, terms, self.n) @ coefficients
+        return float(value) if np.ndim(value) == 0 else value
+
+    def __repr__(self) -> str:
+        """
+        Returns the non-zero amplitudes using dirac notation
+        @return: String representation of the register
+        """
+        terms = [f"{self.state[index]:.4g}|{index:0{self.n}b}>" for index in np.flatnonzero(self.state)]
+        return " + ".join(terms)
@@ -0,0 +1,252 @@
+import os
+import weakref
+from multiprocessing import get_all_start_methods, get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Self
+
+import numpy as np
+
+from backend import RUN_WIDTH
+from gates import Gates
+from kernels import chunkDiagonal, chunkGroups
+from register import Register
+
+# Shared memory blocks each worker process has attached to, keyed by name, so they are only opened once per process
+_attached: dict[str, tuple[SharedMemory, np.ndarray]] = {}
+
+
+def _attach(name: str, length: int) -> np.ndarray:
+    """
+    Returns the statevector in a shared memory block, attaching to it the first time this process sees it
+    @param name: The name of the shared memory block holding the statevector
+    @param length: The number of amplitudes in the statevector
+    @return: The amplitudes, backed by the shared memory
+    """
+    if name not in _attached:
+        memory = SharedMemory(name=name)
+        _attached[name] = (memory, np.ndarray((length,), dtype=np.complex128, buffer=memory.buf))
+    return _attached[name][1]
+
+
+def _release(pool, memory: SharedMemory) -> None:
+    """
+    Stops the workers and frees the shared memory of a ShardedRegister, on close or once it is garbage collected
+    @param pool: The register's worker pool
+    @param memory: The shared memory block holding the statevector
+    @return: None
+    """
+    pool.terminate()  # Already joined after close, so this only stops the workers of a register never closed
+    try:
+        memory.close()
+    except BufferError:
+        pass  # An array still views the block, its mapping goes with that array but the name is freed below
+    memory.unlink()
+
+
+def _runDiagonal(name: str, length: int, local: int, start: int, phases: np.ndarray, qubits: list[int]) -> None:
+    """
+    Worker task: applies a diagonal gate to one shard in place. Nothing is mixed, so no shards are exchanged even
+    for global qbits, which only pick the phases for the shard.
+    @param name: The name of the shared memory block holding the statevector
+    @param length: The number of amplitudes in the statevector
+    @param local: log2 of the shard size
+    @param start: The index of the shard's first amplitude
+    @param phases: The 2^k diagonal entries of the gate
+    @param qubits: The k qbits the gate acts on
+    @return: None
+    """
+    n = length.bit_length() - 1
+    inner_phases, inner = chunkDiagonal(phases, qubits, n, local, start)
+    if not np.all(inner_phases == 1):
+        Register.fromState(_attach(name, length)[start:start + (1 << local)]).diagonal(inner_phases, *inner)
+
+
+def _runGroup(name: str, length: int, size: int, starts: list[int], method: str, args: tuple) -> None:
+    """
+    Worker task: gathers one group of shards from shared memory, applies a Register method to it and writes it back.
+    Groups never overlap, so workers can update the shared statevector at the same time without locking.
+    @param name: The name of the shared memory block holding the statevector
+    @param length: The number of amplitudes in the statevector
+    @param size: The number of amplitudes in each chunk of the group
+    @param starts: The start index of every chunk in the group
+    @param method: The Register method to call, e.g. "apply"
+    @param args: The arguments of the method, with qbits already mapped to the group's block
+    @return: None
+    """
+    state = _attach(name, length)
+    if len(starts) == 1:
+        block = state[starts[0]:starts[0] + size]  # A single contiguous chunk can be updated in place
+    else:
+        block = np.concatenate([state[start:start + size] for start in starts])
+    getattr(Register.fromState(block), method)(*args)
+    if len(starts) > 1:
+        for position, start in enumerate(starts):
+            state[start:start + size] = block[position * size:(position + 1) * size]
+
+
+class ShardedRegister(Register):
+    """
+    A register whose statevector is held in shared memory and updated by a pool of worker processes.
+    The amplitudes are split into one shard per worker by their top qbits. Gates on the remaining "local" qbits run on
+    every shard in parallel. Gates on the top "global" qbits pair up the shards that differ in those qbits, each
+    worker exchanging data only with its partners for that gate, with the shards split further so every worker stays
+    busy.
+    """
+
+    def __init__(self, n: int, dirac: int = 0, workers: int | None = None) -> None:
+        """
+        Creates the shared statevector in a computational basis state and starts the worker processes
+        @param n: The number of qbits in the register
+        @param dirac: The basis state to start in, qbit 0 being the leftmost symbol in dirac notation (e.g. |0>)
+        @param workers: The number of worker processes, rounded down to a power of 2, by default one per core
+        @return: None
+        """
+        workers = os.cpu_count() if workers is None else workers
+        try:
+            assert type(n) is int and type(dirac) is int and n > 0 and 0 <= dirac < (1 << n)
+            assert type(workers) is int and workers > 0
+        except AssertionError:
+            print("E: 'n' and 'workers' must be positive integers and 'dirac' must fit in n bits")
+            exit(1)
+        self.n = n
+        self.workers = 1 << min(workers.bit_length() - 1, n)
+        self.memory = SharedMemory(create=True, size=(1 << n) * np.dtype(np.complex128).itemsize)
+        self.state = np.ndarray((1 << n,), dtype=np.complex128, buffer=self.memory.buf)
+        self.state.fill(0)
+        self.state[dirac] = 1
+        self.threads = 1
+        self.renormalise = 0
+        self.run_width = min(RUN_WIDTH, n - (self.workers.bit_length() - 1))  # At most the qbits inside a shard
+        self.fused = 0
+        # forkserver rather than fork, as forking a process that already runs kernel threads can deadlock. Windows has
+        # no forkserver, so spawn is used there
+        method = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+        self.pool = get_context(method).Pool(self.workers)
+        self.release = weakref.finalize(self, _release, self.pool, self.memory)
+
+    def _combinable(self, kind: str, qubits: set[int]) -> bool:
+        """
+        Checks whether run may accumulate a gate of this kind over these qbits into one. Permutations are only
+        combined inside a shard, as a combined permutation on global qbits would leave fewer groups than workers.
+        @param kind: "diagonal" or "permutation"
+        @param qubits: Every qbit the combined gate would act on
+        @return: True if the combined gate may be applied in one sweep
+        """
+        if kind == "permutation" and min(qubits) < self.workers.bit_length() - 1:
+            return False
+        return super()._combinable(kind, qubits)
+
+    def _parallel(self, qubits: tuple[int, ...], method: str, args: tuple) -> None:
+        """
+        Runs a Register method over the shards in parallel.
+        Chunks start as one shard per worker and are halved until there is at least one group per worker, which only
+        happens when the gate touches global qbits.
+        @param qubits: The qbits the gate touches, including controls
+        @param method: The Register method to call on each group
+        @param args: The method's arguments, where each qbit index is replaced with the placeholder ("q", index)
+        @return: None
+        """
+        local = self.n - (self.workers.bit_length() - 1)
+        groups, mapping = chunkGroups(self.n, local, qubits)
+        while len(groups) < self.workers and local > 0:
+            local -= 1
+            groups, mapping = chunkGroups(self.n, local, qubits)
+
+        def remap(arg):
+            if isinstance(arg, tuple) and len(arg) == 2 and arg[0] == "q":
+                return mapping[arg[1]]
+            if isinstance(arg, list):
+                return [remap(item) for item in arg]
+            return arg
+
+        mapped = tuple(remap(arg) for arg in args)
+        self.pool.starmap(_runGroup, [(self.memory.name, 1 << self.n, 1 << local, starts, method, mapped)
+                                      for starts in groups])
+
+    def apply(self, gate: Gates | list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a gate to the given qbits across the shards
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param qubits: The qbits the gate acts on, controls first for controlled gates
+        @return: The register, else False
+        """
+        if not self._valid(*qubits) or not self._sized(gate, qubits):
+            return False
+        self._parallel(qubits, "apply", (gate, *(("q", qubit) for qubit in qubits)))
+        return self
+
+    def diagonal(self, phases: list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a diagonal gate with one task per shard, as diagonal gates never exchange amplitudes between shards
+        @param phases: The 2^k diagonal entries, the first qbit being the most significant
+        @param qubits: The k qbits the gate acts on
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        try:
+            assert np.shape(phases) == (1 << len(qubits),)
+        except AssertionError:
+            print("E: A diagonal gate needs 2^k phases for k qbits")
+            return False
+        local = self.n - (self.workers.bit_length() - 1)
+        self.pool.starmap(_runDiagonal, [(self.memory.name, 1 << self.n, local, start, np.asarray(phases), list(qubits))
+                                         for start in range(0, 1 << self.n, 1 << local)])
+        return self
+
+    def permute(self, permutation: list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a permutation gate across the shards
+        @param permutation: Entry i is the basis state of the k qbits that |i> is sent to
+        @param qubits: The k qbits the gate acts on
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        self._parallel(qubits, "permute", (permutation, *(("q", qubit) for qubit in qubits)))
+        return self
+
+    def controlled(self, gate: Gates | list | np.ndarray, controls: list[int], target: int | list[int],
+                   negative: list[int] | None = None) -> Self | bool:
+        """
+        Applies a gate to the targets where every control is |1> and every negative control is |0>, across the
+        shards
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param controls: The control qbits
+        @param target: The target qbit, or a list of k target qbits
+        @param negative: Control qbits that must be |0> rather than |1>
+        @return: The register, else False
+        """
+        targets = [target] if isinstance(target, int) else list(target)
+        negative = list(negative or [])
+        if not self._valid(*controls, *negative, *targets):
+            return False
+        self._parallel((*controls, *negative, *targets), "controlled",
+                       (gate, [("q", control) for control in controls], [("q", qubit) for qubit in targets],
+                        [("q", control) for control in negative]))
+        return self
+
+    def swap(self, first: int, second: int) -> Self | bool:
+        """
+        Exchanges the states of two qbits across the shards
+        @param first: The first qbit
+        @param second: The second qbit
+        @return: The register, else False
+        """
+        if not self._valid(first, second):
+            return False
+        self._parallel((first, second), "swap", (("q", first), ("q", second)))
+        return self
+
+    def close(self) -> None:
+        """
+        Stops the workers and frees the shared memory, which also happens if the register is garbage collected
+        without being closed
+        @return: None
+        """
+        if not self.release.alive:
+            return  # Already closed
+        self.pool.close()
+        self.pool.join()
+        del self.state
+        self.release()
@@ -0,0 +1,211 @@
+from typing import Self
+
+import numpy as np
+
+from backend import Backend
+from gates import Gates, gateMatrix
+from kernels import pauliExpectations, sampleCounts
+from register import Register
+
+
+class SparseRegister(Backend):
+    """
+    A register that only stores its non-zero amplitudes, as a sorted array of basis indices and a matching array of
+    amplitudes. Mostly classical circuits stay very sparse, so far more qbits fit than with a dense statevector.
+    It has the same gate API as Register and switches to a dense Register automatically once enough of the
+    amplitudes are non-zero.
+    """
+
+    def __init__(self, n: int, dirac: int = 0, threshold: float = 0.1) -> None:
+        """
+        Initialises the register in a computational basis state
+        @param n: The number of qbits in the register, at most 62 so indices fit in int64
+        @param dirac: The basis state to start in, qbit 0 being the leftmost symbol in dirac notation (e.g. |0>)
+        @param threshold: The fraction of non-zero amplitudes above which the register becomes dense
+        @return: None
+        """
+        try:
+            assert type(n) is int and type(dirac) is int and 0 < n <= 62 and 0 <= dirac < (1 << n)
+        except AssertionError:
+            print("E: 'n' must be an integer from 1 to 62 and 'dirac' must fit in n bits")
+            exit(1)
+        self.n = n
+        self.threshold = threshold
+        self.indices = np.array([dirac], dtype=np.int64)
+        self.amplitudes = np.array([1], dtype=np.complex128)
+        self.dense: Register | None = None  # Set once the register has switched to dense storage
+        self.fused = 0
+
+    def _mask(self, qubits: list[int]) -> int:
+        """
+        Returns the basis index bitmask of some qbits
+        @param qubits: The qbit indices
+        @return: Bitmask with a 1 at each qbit's position
+        """
+        return sum(1 << (self.n - 1 - qubit) for qubit in qubits)
+
+    def _lookup(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Returns the amplitudes of the given basis states, 0 for any that are not stored
+        @param keys: Basis indices to look up
+        @return: Amplitudes in the same order as keys
+        """
+        positions = np.minimum(np.searchsorted(self.indices, keys), len(self.indices) - 1)
+        return np.where(self.indices[positions] == keys, self.amplitudes[positions], 0)
+
+    def _applySparse(self, matrix: np.ndarray, qubits: list[int], controls: list[int],
+                     negative: list[int] | None = None) -> None:
+        """
+        Applies a 2^k x 2^k gate to k qbits on the stored amplitudes whose controls are all |1> and negative controls
+        all |0>.
+        The stored states are grouped by their index with the target bits cleared, each group is gathered into a
+        column, multiplied by the gate and scattered back.
+        @param matrix: The gate
+        @param qubits: The target qbits, the first being the most significant in the matrix
+        @param controls: Control qbits that must all be |1>
+        @param negative: Control qbits that must all be |0>
+        @return: None
+        """
+        control_mask = self._mask(controls)
+        selected = (self.indices & (control_mask | self._mask(negative or []))) == control_mask
+        indices = self.indices[selected]
+
+        k = len(qubits)
+        offsets = np.array([self._mask([qubit for bit, qubit in enumerate(qubits) if (row >> (k - 1 - bit)) & 1])
+                            for row in range(1 << k)], dtype=np.int64)
+        bases = np.unique(indices & ~self._mask(qubits))
+        columns = np.array([self._lookup(bases | offset) for offset in offsets])
+        columns = matrix @ columns
+
+        new_indices = np.concatenate([self.indices[~selected], (bases[None, :] | offsets[:, None]).ravel()])
+        new_amplitudes = np.concatenate([self.amplitudes[~selected], columns.ravel()])
+        keep = np.abs(new_amplitudes) > 1e-14  # Drop amplitudes that interfered away
+        order = np.argsort(new_indices[keep])
+        self.indices = new_indices[keep][order]
+        self.amplitudes = new_amplitudes[keep][order]
+
+    def _densify(self) -> None:
+        """
+        Switches to a dense Register once the occupancy passes the threshold
+        @return: None
+        """
+        if len(self.indices) > self.threshold * (1 << self.n):
+            self.dense = self.toDense()
+
+    def apply(self, gate: Gates | list | np.ndarray, *qubits: int) -> Self | bool:
+        """
+        Applies a gate to the given qbits
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param qubits: The qbits the gate acts on, controls first for controlled gates
+        @return: The register, else False
+        """
+        if self.dense is not None:
+            return self if self.dense.apply(gate, *qubits) else False
+        if not self._valid(*qubits) or not self._sized(gate, qubits):
+            return False
+        if isinstance(gate, Gates):
+            match gate:
+                case Gates.CNOT | Gates.TOFFOLI:
+                    return self.controlled(Gates.PAULI_X, list(qubits[:-1]), qubits[-1])
+                case Gates.CZ:
+                    return self.controlled(Gates.PAULI_Z, list(qubits[:-1]), qubits[-1])
+                case Gates.SWAP:
+                    return self.swap(*qubits)
+        self._applySparse(gateMatrix(gate), list(qubits), [])
+        self._densify()
+        return self
+
+    def controlled(self, gate: Gates | list | np.ndarray, controls: list[int], target: int | list[int],
+                   negative: list[int] | None = None) -> Self | bool:
+        """
+        Applies a gate to the targets on the part of the state where every control is |1> and every negative control
+        is |0>
+        @param gate: A Gates member or a 2^k x 2^k matrix
+        @param controls: The control qbits
+        @param target: The target qbit, or a list of k target qbits
+        @param negative: Control qbits that must be |0> rather than |1>
+        @return: The register, else False
+        """
+        targets = [target] if isinstance(target, int) else list(target)
+        negative = list(negative or [])
+        if self.dense is not None:
+            return self if self.dense.controlled(gate, controls, targets, negative) else False
+        if not self._valid(*controls, *negative, *targets):
+            return False
+        matrix = gateMatrix(gate)
+        try:
+            assert matrix.shape == (1 << len(targets), 1 << len(targets))
+        except AssertionError:
+            print("E: The gate size does not match the number of target qbits given")
+            return False
+        self._applySparse(matrix, targets, list(controls), negative)
+        self._densify()
+        return self
+
+    def swap(self, first: int, second: int) -> Self | bool:
+        """
+        Exchanges the states of two qbits by swapping their bits in every stored index
+        @param first: The first qbit
+        @param second: The second qbit
+        @return: The register, else False
+        """
+        if self.dense is not None:
+            return self if self.dense.swap(first, second) else False
+        if not self._valid(first, second):
+            return False
+        mask = self._mask([first, second])
+        differ = ((self.indices >> (self.n - 1 - first)) & 1) != ((self.indices >> (self.n - 1 - second)) & 1)
+        self.indices = np.where(differ, self.indices ^ mask, self.indices)
+        order = np.argsort(self.indices)
+        self.indices, self.amplitudes = self.indices[order], self.amplitudes[order]
+        return self
+
+    def sample(self, shots: int = 1, seed: int | None = None) -> dict[str, int] | bool:
+        """
+        Measures the register many times without collapsing it
+        @param shots: The number of measurements to take
+        @param seed: Optional seed for a reproducible histogram
+        @return: Counts of each outcome keyed by bitstring (qbit 0 first), else False
+        """
+        if self.dense is not None:
+            return self.dense.sample(shots, seed)
+        if not self._shots(shots):
+            return False
+        return sampleCounts(self.amplitudes, shots, self.n, seed, self.indices)
+
+    def expectation(self, observable: str | dict[str, float]) -> float | bool:
+        """
+        Returns the exact expectation value of a Pauli string or a weighted sum of them using only the stored
+        amplitudes
+        @param observable: A Pauli string such as "XIZ" (qbit 0 first), or a dict of Pauli strings to coefficients
+        @return: <psi|observable|psi>, else False
+        """
+        if self.dense is not None:
+            return self.dense.expectation(observable)
+        split = self._observable(observable, self.n)
+        if split is False:
+            return False
+        terms, coefficients = split
+        return float(pauliExpectations(self.amplitudes, terms, self.n, self.indices) @ coefficients)
+
+    def toDense(self) -> Register:
+        """
+        Returns the state as a dense Register, only possible for registers small enough to fit in memory
+        @return: Dense register with the same amplitudes
+        """
+        if self.dense is not None:
+            return self.dense
+        dense = Register(self.n)
+        dense.state[0] = 0
+        dense.state[self.indices] = self.amplitudes
+        return dense
+
+    def __repr__(self) -> str:
+        """
+        Returns the non-zero amplitudes using dirac notation
+        @return: String representation of the register
+        """
+        if self.dense is not None:
+            return repr(self.dense)
+        return " + ".join(f"{amplitude:.4g}|{index:0{self.n}b}>"
+                          for index, amplitude in zip(self.indices.tolist(), self.amplitudes))
@@ -0,0 +1,382 @@
+from math import isclose, pi
+from typing import Self
+
+import numpy as np
+
+from backend import Backend
+from gates import Gates
+from operation import Operation
+from register import Register
+
+# The gates the tableau can simulate, every other gate (e.g. T, TOFFOLI or a dense matrix) needs a statevector
+CLIFFORD = {Gates.HADAMARD, Gates.PAULI_X, Gates.PAULI_Y, Gates.PAULI_Z, Gates.PHASE, Gates.CNOT, Gates.CZ,
+            Gates.SWAP}
+
+_ONE = np.uint64(1)
+
+
+def _quarterTurns(operation: Operation) -> int | None:
+    """
+    Returns how many PHASE gates a single qbit DIAGONAL operation is equal to, as the optimiser merges phase gates
+    into one, e.g. PAULI_Z then PHASE into a phase of 3 pi / 2
+    @param operation: Any operation
+    @return: 0 to 3 if the operation is diag(1, i^k), else None
+    """
+    if operation.gate != "DIAGONAL" or len(operation.qubits) != 1 or np.ndim(operation.params[0]) != 0:
+        return None
+    turns = operation.params[0] / (pi / 2)
+    if not isclose(turns, round(turns), abs_tol=1e-9):
+        return None
+    return round(turns) % 4
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    """
+    Counts the set bits of each row of packed words
+    @param words: uint64 array of shape (..., words)
+    @return: The number of set bits in each row
+    """
+    if hasattr(np, "bitwise_count"):  # numpy 2.0 and later
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return np.unpackbits(np.ascontiguousarray(words).view(np.uint8), axis=-1).sum(axis=-1, dtype=np.int64)
+
+
+class StabilizerRegister(Backend):
+    """
+    A CHP style stabilizer tableau (Aaronson and Gottesman) for circuits made only of Clifford gates.
+    Rows 0 to n-1 are the destabilizers, rows n to 2n-1 the stabilizers and row 2n is scratch space. Each row is a
+    Pauli string stored as packed x and z bits, 64 qbits per uint64 word (x=z=1 being Y), plus a sign bit in r.
+    Gates update one or two bit columns and measurements combine rows with whole-word operations, so thousands of
+    qbits take milliseconds instead of needing a 2^n statevector.
+    """
+
+    def __init__(self, n: int, dirac: int = 0) -> None:
+        """
+        Initialises the register in a computational basis state, stabilised by +Z or -Z on every qbit
+        @param n: The number of qbits in the register
+        @param dirac: The basis state to start in, qbit 0 being the leftmost symbol in dirac notation (e.g. |0>)
+        @return: None
+        """
+        try:
+            assert type(n) is int and type(dirac) is int and n > 0 and 0 <= dirac < (1 << n)
+        except AssertionError:
+            print("E: 'n' must be a positive integer and 'dirac' must fit in n bits")
+            exit(1)
+        self.n = n
+        words = (n + 63) >> 6
+        self.x = np.zeros((2 * n + 1, words), dtype=np.uint64)
+        self.z = np.zeros((2 * n + 1, words), dtype=np.uint64)
+        self.r = np.zeros(2 * n + 1, dtype=np.uint8)
+        for qubit in range(n):
+            self.x[qubit, qubit >> 6] |= _ONE << np.uint64(qubit & 63)
+            self.z[n + qubit, qubit >> 6] |= _ONE << np.uint64(qubit & 63)
+            self.r[n + qubit] = (dirac >> (n - 1 - qubit)) & 1
+        self.fused = 0
+
+    @staticmethod
+    def _column(bits: np.ndarray, qubit: int) -> np.ndarray:
+        """
+        Returns one qbit's bit from every row
+        @param bits: The packed x or z bits
+        @param qubit: The qbit
+        @return: uint64 array of 0 and 1, one per row
+        """
+        return (bits[:, qubit >> 6] >> np.uint64(qubit & 63)) & _ONE
+
+    @staticmethod
+    def _flip(bits: np.ndarray, qubit: int, values: np.ndarray) -> None:
+        """
+        XORs a column of 0 and 1 values into one qbit's bit of every row
+        @param bits: The packed x or z bits, modified in place
+        @param qubit: The qbit
+        @param values: uint64 array of 0 and 1, one per row
+        @return: None
+        """
+        bits[:, qubit >> 6] ^= values << np.uint64(qubit & 63)
+
+    def _hadamard(self, qubit: int) -> None:
+        """H: X <-> Z, Y -> -Y"""
+        x, z = self._column(self.x, qubit), self._column(self.z, qubit)
+        self.r ^= (x & z).astype(np.uint8)
+        self._flip(self.x, qubit, x ^ z)
+        self._flip(self.z, qubit, x ^ z)
+
+    def _phase(self, qubit: int) -> None:
+        """S: X -> Y, Y -> -X"""
+        x, z = self._column(self.x, qubit), self._column(self.z, qubit)
+        self.r ^= (x & z).astype(np.uint8)
+        self._flip(self.z, qubit, x)
+
+    def _cnot(self, control: int, target: int) -> None:
+        """CNOT: X on the control spreads to the target, Z on the target spreads to the control"""
+        xc, zc = self._column(self.x, control), self._column(self.z, control)
+        xt, zt = self._column(self.x, target), self._column(self.z, target)
+        self.r ^= (xc & zt & (xt ^ zc ^ _ONE)).astype(np.uint8)
+        self._flip(self.x, target, xc)
+        self._flip(self.z, control, zt)
+
+    def _rowsum(self, targets: np.ndarray | int, source: int) -> None:
+        """
+        Multiplies the source row into each target row, tracking the sign of the product.
+        The phase of each qbit's product is +1, -1 or 0 powers of i depending on the Pauli pair, so the total is
+        counted with two popcounts over masks of the pairs giving +i and -i.
+        @param targets: The rows to update
+        @param source: The row multiplied in
+        @return: None
+        """
+        x1, z1 = self.x[source], self.z[source]
+        x2, z2 = self.x[targets], self.z[targets]
+        plus = (x1 & z1 & z2 & ~x2) | (x1 & ~z1 & x2 & z2) | (~x1 & z1 & x2 & ~z2)
+        minus = (x1 & z1 & x2 & ~z2) | (x1 & ~z1 & z2 & ~x2) | (~x1 & z1 & x2 & z2)
+        total = 2 * self.r[targets].astype(np.int64) + 2 * int(self.r[source]) + _popcount(plus) - _popcount(minus)
+        self.r[targets] = (total % 4 == 2).astype(np.uint8)
+        self.x[targets] ^= x1
+        self.z[targets] ^= z1
+
+    def _product(self, rows: np.ndarray) -> int:
+        """
+        Multiplies the given rows together in order into the scratch row in one vectorised step.
+        The phase of each multiplication only depends on the row and the product of the rows before it, which are
+        all found at once with a cumulative XOR.
+        @param rows: The rows to multiply
+        @return: The sign bit of the product
+        """
+        scratch = 2 * self.n
+        x1, z1 = self.x[rows], self.z[rows]
+        x2 = np.bitwise_xor.accumulate(x1, axis=0)
+        z2 = np.bitwise_xor.accumulate(z1, axis=0)
+        self.x[scratch], self.z[scratch] = (x2[-1], z2[-1]) if len(rows) else (0, 0)
+        x2, z2 = np.roll(x2, 1, axis=0), np.roll(z2, 1, axis=0)  # The product before each row
+        x2[:1] = 0
+        z2[:1] = 0
+        plus = (x1 & z1 & z2 & ~x2) | (x1 & ~z1 & x2 & z2) | (~x1 & z1 & x2 & ~z2)
+        minus = (x1 & z1 & x2 & ~z2) | (x1 & ~z1 & z2 & ~x2) | (~x1 & z1 & x2 & z2)
+        total = 2 * int(self.r[rows].sum()) + int(_popcount(plus).sum()) - int(_popcount(minus).sum())
+        self.r[scratch] = total % 4 == 2
+        return int(self.r[scratch])
+
+    def apply(self, gate: Gates, *qubits: int) -> Self | bool:
+        """
+        Applies a Clifford gate
+        @param gate: One of the Gates members in CLIFFORD
+        @param qubits: The qbits the gate acts on, control first for controlled gates
+        @return: The register, else False
+        """
+        if not self._valid(*qubits):
+            return False
+        try:
+            assert isinstance(gate, Gates) and gate in CLIFFORD
+            assert len(qubits) == (2 if gate in (Gates.CNOT, Gates.CZ, Gates.SWAP) else 1)
+        except AssertionError:
+            print("E: The stabilizer backend only supports H, X, Y, Z, PHASE, CNOT, CZ and SWAP on matching qbits")
+            return False
+        match gate:
+            case Gates.HADAMARD:
+                self._hadamard(qubits[0])
+            case Gates.PHASE:
+                self._phase(qubits[0])
+            case Gates.PAULI_X:
+                self.r ^= self._column(self.z, qubits[0]).astype(np.uint8)
+            case Gates.PAULI_Z:
+                self.r ^= self._column(self.x, qubits[0]).astype(np.uint8)
+            case Gates.PAULI_Y:
+                self.r ^= (self._column(self.x, qubits[0]) ^ self._column(self.z, qubits[0])).astype(np.uint8)
+            case Gates.CNOT:
+                self._cnot(*qubits)
+            case Gates.CZ:
+                self._hadamard(qubits[1])
+                self._cnot(*qubits)
+                self._hadamard(qubits[1])
+            case Gates.SWAP:
+                for bits in (self.x, self.z):
+                    first, second = self._column(bits, qubits[0]), self._column(bits, qubits[1])
+                    self._flip(bits, qubits[0], first ^ second)
+                    self._flip(bits, qubits[1], first ^ second)
+        return self
+
+    def _apply(self, operation: Operation) -> Self | bool:
+        """
+        Applies one operation, phases the optimiser merged into a multiple of pi / 2 as that many PHASE gates
+        @param operation: Any operation
+        @return: The register, else False
+        """
+        turns = _quarterTurns(operation)
+        if turns is None:
+            return super()._apply(operation)
+        return self if all(self.apply(Gates.PHASE, *operation.qubits) for _ in range(turns)) else False
+
+    def run(self, operations: list[Operation], fusion: bool = False, width: int = 2) -> Self | bool:
+        """
+        Applies a list of Clifford operations in order. Fusion is ignored as fused blocks are no longer Clifford
+        gates, and a tableau update is already cheaper than any fused matrix.
+        @param operations: The gates to apply
+        @param fusion: Accepted for compatibility with the other backends
+        @param width: Accepted for compatibility with the other backends
+        @return: The register, else False
+        """
+        return super().run(operations)
+
+    def measure(self, qubit: int, rng: np.random.Generator | None = None) -> int | bool:
+        """
+        Measures one qbit in the computational basis, collapsing the state
+        @param qubit: The qbit to measure
+        @param rng: Optional random generator for reproducible outcomes
+        @return: The outcome 0 or 1, else False
+        """
+        if not self._valid(qubit):
+            return False
+        n = self.n
+        anticommuting = np.flatnonzero(self._column(self.x[n:2 * n], qubit)) + n
+        if len(anticommuting):
+            # Random outcome: every other row that anticommutes with Z absorbs the first such stabilizer, which
+            # is then replaced by +-Z on the qbit
+            pivot = int(anticommuting[0])
+            others = np.flatnonzero(self._column(self.x[:2 * n], qubit))
+            others = others[others != pivot]
+            if len(others):
+                self._rowsum(others, pivot)
+            self.x[pivot - n], self.z[pivot - n], self.r[pivot - n] = self.x[pivot], self.z[pivot], self.r[pivot]
+            self.x[pivot] = 0
+            self.z[pivot] = 0
+            self.z[pivot, qubit >> 6] = _ONE << np.uint64(qubit & 63)
+            self.r[pivot] = (rng or np.random.default_rng()).integers(2)
+            return int(self.r[pivot])
+        # Deterministic outcome: Z on the qbit is a product of stabilizers, its sign is the outcome
+        return self._product(np.flatnonzero(self._column(self.x[:n], qubit)) + n)
+
+    def _eliminate(self, bits: np.ndarray, start: int) -> tuple[int, list[tuple[int, int]]]:
+        """
+        Gauss-Jordan elimination of stabilizer rows start to 2n-1 on their x or z bits, multiplying rows together
+        with _rowsum so their signs stay correct
+        @param bits: self.x, or self.z once every row from start has no x bits
+        @param start: The first stabilizer row to include
+        @return: The row after the last pivot, and the (row, qbit) of every pivot
+        """
+        end, pivot, pivots = 2 * self.n, start, []
+        for qubit in range(self.n):
+            rows = np.flatnonzero(self._column(bits[pivot:end], qubit)) + pivot
+            if not len(rows):
+                continue
+            found = int(rows[0])
+            for array in (self.x, self.z, self.r):
+                array[[pivot, found]] = array[[found, pivot]]
+            others = np.flatnonzero(self._column(bits[start:end], qubit)) + start
+            others = others[others != pivot]
+            if bits is self.z:  # Only Z strings are left, they multiply without any phase so a XOR is enough
+                self.z[others] ^= self.z[pivot]
+                self.r[others] ^= self.r[pivot]
+            elif len(others):
+                self._rowsum(others, pivot)
+            pivots.append((pivot, qubit))
+            pivot += 1
+            if pivot == end:
+                break
+        return pivot, pivots
+
+    def _support(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the basis states the state is spread over, s0 ^ span(x parts of the stabilizers). Eliminating the
+        stabilizers on their x bits leaves k independent rows with x bits, spanning the offsets, and rows that are
+        +-Z strings, each fixing the parity of some qbits, which are solved for s0 on their z pivots.
+        The tableau is restored afterwards.
+        @return: s0 as a 0/1 array qbit 0 first, and the packed x bits of the k independent rows
+        """
+        saved = (self.x.copy(), self.z.copy(), self.r.copy())
+        start, _ = self._eliminate(self.x, self.n)
+        _, pivots = self._eliminate(self.z, start)
+        bits = np.zeros(self.n, dtype=np.uint8)
+        for row, qubit in pivots:  # Other qbits in each row are not pivots, so they are 0 and only the pivot is set
+            bits[qubit] = self.r[row]
+        offsets = self.x[self.n:start].copy()
+        self.x[...], self.z[...], self.r[...] = saved
+        return bits, offsets
+
+    def sample(self, shots: int = 1, seed: int | None = None) -> dict[str, int] | bool:
+        """
+        Measures the register many times without collapsing it.
+        A stabilizer state is a uniform superposition over the basis states s0 ^ span(x parts of the stabilizers), so
+        every shot XORs one possible outcome s0 with a random combination of the independent x parts, all at once.
+        @param shots: The number of measurements to take
+        @param seed: Optional seed for a reproducible histogram
+        @return: Counts of each outcome keyed by bitstring (qbit 0 first), else False
+        """
+        if not self._shots(shots):
+            return False
+        rng = np.random.default_rng(seed)
+        n = self.n
+        first, offsets = self._support()
+        # Unpack the x bits to a k x n 0/1 matrix, qbit q being bit q & 63 of word q >> 6
+        x = np.unpackbits(offsets.view(np.uint8), axis=1, bitorder="little")[:, :n]
+        combinations = rng.integers(0, 2, size=(shots, len(x)), dtype=np.uint8)
+        # float32 sums are exact for up to 2^24 qbits, and far faster than integer matrix products
+        outcomes = (combinations.astype(np.float32) @ x.astype(np.float32)).astype(np.int64) & 1 ^ first
+        # Each row viewed as one n byte string, so unique compares whole bitstrings rather than columns
+        keys, counts = np.unique((outcomes.astype(np.uint8) + ord("0")).view(f"S{n}").ravel(), return_counts=True)
+        return dict(zip(keys.astype(str).tolist(), counts.tolist()))
+
+    def expectation(self, observable: str | dict[str, float]) -> float | bool:
+        """
+        Returns the exact expectation value of a Pauli string or a weighted sum of them.
+        For a stabilizer state each string has expectation 0 if it anticommutes with any stabilizer, otherwise it is
+        +-1 times the product of the stabilizers whose destabilizers it anticommutes with.
+        @param observable: A Pauli string such as "XIZ" (qbit 0 first), or a dict of Pauli strings to coefficients
+        @return: <psi|observable|psi>, else False
+        """
+        split = self._observable(observable, self.n)
+        if split is False:
+            return False
+        terms, coefficients = split
+        n = self.n
+        total = 0.0
+        for term, coefficient in zip(terms, coefficients):
+            px = np.zeros(self.x.shape[1], dtype=np.uint64)
+            pz = np.zeros(self.x.shape[1], dtype=np.uint64)
+            for qubit, pauli in enumerate(term):
+                if pauli in "XY":
+                    px[qubit >> 6] |= _ONE << np.uint64(qubit & 63)
+                if pauli in "ZY":
+                    pz[qubit >> 6] |= _ONE << np.uint64(qubit & 63)
+            anticommutes = _popcount((self.x[:2 * n] & pz) ^ (self.z[:2 * n] & px)) & 1
+            if anticommutes[n:].any():
+                continue
+            total += coefficient * (-1 if self._product(np.flatnonzero(anticommutes[:n]) + n) else 1)
+        return float(total)
+
+    def __repr__(self) -> str:
+        """
+        Returns the stabilizer generators as signed Pauli strings
+        @return: String representation of the register, one generator per line
+        """
+        letters = np.array(["I", "X", "Z", "Y"])
+        lines = []
+        for row in range(self.n, 2 * self.n):
+            x = np.array([(int(self.x[row, q >> 6]) >> (q & 63)) & 1 for q in range(self.n)])
+            z = np.array([(int(self.z[row, q >> 6]) >> (q & 63)) & 1 for q in range(self.n)])
+            lines.append(("-" if self.r[row] else "+") + "".join(letters[x + 2 * z]))
+        return "\n".join(lines)
+
+
+def isClifford(operations: list[Operation]) -> bool:
+    """
+    Checks whether a circuit only uses gates the stabilizer backend can simulate
+    @param operations: The gates in execution order
+    @return: True if every gate is a Clifford Gates member, or a phase the optimiser merged into a multiple of pi / 2
+    """
+    return all(isinstance(operation.gate, Gates) and operation.gate in CLIFFORD or _quarterTurns(operation) is not None
+               for operation in operations)
+
+
+def simulate(n: int, operations: list[Operation], dirac: int = 0, fusion: bool = False,
+             width: int = 2) -> StabilizerRegister | Register | bool:
+    """
+    Runs a circuit on the cheapest backend that can simulate it exactly: the stabilizer tableau for Clifford only
+    circuits, which scales to thousands of qbits, and a dense Register otherwise
+    @param n: The number of qbits
+    @param operations: The gates in execution order
+    @param dirac: The basis state to start in
+    @param fusion: Passed on to the dense backend
+    @param width: Passed on to the dense backend
+    @return: The register the circuit was run on, else False
+    """
+    register = StabilizerRegister(n, dirac) if isClifford(operations) else Register(n, dirac)
+    return register.run(operations, fusion, width)
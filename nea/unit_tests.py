@@ -2,8 +2,10 @@ import io
 import os
 import re
 import sqlite3
+import tracemalloc
 import unittest
 from math import isclose, sqrt
+from multiprocessing.shared_memory import SharedMemory
 from unittest import mock
 from unittest.mock import Mock, patch
 
@@ -12,16 +14,31 @@ import numpy as np
 from matplotlib.patches import Circle
 
 import abstract
+import backend
+import batch
+import cache
 import cbit
+import circuit
+import density
 import draggable
+import fusion
 import gates
 import interface
+import kernels
 import lexer
 import login
 import main
+import mps
+import operation
+import optimiser
+import outofcore
 import point
 import qbit
+import register
 import renderer
+import sharded
+import sparse
+import stabilizer
 import system
 import vector
 import wall
@@ -134,6 +151,132 @@ class TestAbstract(unittest.TestCase):
         pass
 
 
+class TestBackend(unittest.TestCase):
+
+    def test_shared_run(self):
+        # Every backend takes the same run loop, shorthands and checks from Backend
+        gate = gates.Gates
+        operations = [operation.Operation(gate.HADAMARD, (0,)), operation.Operation(gate.CNOT, (0, 1)),
+                      operation.Operation("RY", (2,), params=(0.9,)), operation.Operation(gate.CZ, (1, 2)),
+                      operation.Operation("CONTROLLED", (2, 0), gates.gateMatrix(gate.HADAMARD), (0,))]
+        expected = register.Register(3).run(operations).probabilities()
+        for simulator in (sparse.SparseRegister(3), mps.MPSRegister(3), density.DensityMatrix(3)):
+            self.assertIsInstance(simulator, backend.Backend)
+            self.assertTrue(simulator.run(operations))
+            probabilities = simulator.probabilities() if hasattr(simulator, "probabilities") else \
+                simulator.toDense().probabilities()
+            self.assertTrue(np.allclose(probabilities, expected))
+            self.assertFalse(simulator.cnot(1, 1))
+            self.assertFalse(simulator.sample(shots=0))
+        self.assertTrue(np.allclose(register.Register(3).toffoli(0, 1, 2).state, np.eye(8)[0]))
+        self.assertFalse(mps.MPSRegister(3).toffoli(0, 1, 2))  # The MPS only takes one and two qbit gates
+
+    def test_apply_required(self):
+        class Incomplete(backend.Backend):
+            n = 1
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class TestBatchRegister(unittest.TestCase):
+
+    @staticmethod
+    def circuit(angle):
+        return [operation.Operation(gates.Gates.HADAMARD, (0,)),
+                operation.Operation("RY", (1,), params=(angle,)),
+                operation.Operation(gates.Gates.CNOT, (1, 2)),
+                operation.Operation("U3", (2,), params=(angle, 0.3, angle / 2)),
+                operation.Operation(gates.Gates.SWAP, (0, 2))]
+
+    def setUp(self):
+        self.angles = np.linspace(0, np.pi, 5)
+
+    def test_matches_single_registers(self):
+        states = batch.BatchRegister(3, 5).run(self.circuit(self.angles)).state
+        for row, angle in enumerate(self.angles):
+            self.assertTrue(np.allclose(states[row], register.Register(3).run(self.circuit(angle)).state))
+
+    def test_fusion_and_rotate(self):
+        plain = batch.BatchRegister(3, 5).run(self.circuit(self.angles))
+        fused = batch.BatchRegister(3, 5).run(self.circuit(self.angles), fusion=True)
+        self.assertTrue(np.allclose(plain.state, fused.state))
+        swept = batch.BatchRegister(1, 5).rotate("RX", 0, self.angles)
+        self.assertTrue(np.allclose(swept.probabilities()[:, 1], np.sin(self.angles / 2) ** 2))
+        self.assertFalse(swept.apply(np.zeros((4, 2, 2)), 0))  # Wrong batch size
+        self.assertEqual(len(swept.sample(10, seed=1)), 5)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.bell = circuit.Circuit(2).append(gates.Gates.HADAMARD, 0).append(gates.Gates.CNOT, 0, 1)
+
+    def test_key(self):
+        rebuilt = circuit.Circuit(2)
+        with rebuilt:
+            gates.H(0)
+            gates.CNOT(0, 1)
+        key = cache.circuitKey(2, self.bell.operations, "state")
+        self.assertEqual(key, cache.circuitKey(2, rebuilt.operations, "state"))
+        self.assertNotEqual(key, cache.circuitKey(2, self.bell.operations, "state", dirac=1))
+        self.assertNotEqual(key, cache.circuitKey(2, self.bell.operations[:1], "state"))
+        rotated = [operation.Operation("RX", (0,), params=(0.1,))]
+        noisy = [operation.Operation("RX", (0,), params=(0.1 + 1e-15,))]
+        self.assertEqual(cache.circuitKey(1, rotated, "state"), cache.circuitKey(1, noisy, "state"))
+
+    def test_statevector(self):
+        results = cache.ResultCache()
+        first = self.bell.statevector(results=results)
+        second = self.bell.statevector(results=results)
+        self.assertTrue(np.allclose(second, [1 / sqrt(2), 0, 0, 1 / sqrt(2)]))
+        self.assertTrue(np.array_equal(first, second))
+        self.assertFalse(second.flags.writeable)
+        self.assertEqual((results.hits, results.misses), (1, 1))
+
+    def test_sample(self):
+        results = cache.ResultCache()
+        counts = self.bell.sample(100, seed=3, results=results)
+        self.assertEqual(self.bell.sample(100, seed=3, results=results), counts)
+        self.bell.sample(100, results=results)  # Unseeded samples are never cached
+        self.assertEqual(results.stats()["hits"], 1)
+        self.assertEqual(results.stats()["entries"], 1)
+
+    def test_eviction(self):
+        results = cache.ResultCache(budget=100)
+        results.put("a", np.zeros(4, dtype=np.complex128))
+        results.put("b", np.zeros(4, dtype=np.complex128))
+        self.assertIsNone(results.get("a"))
+        self.assertIsNotNone(results.get("b"))
+        self.assertEqual(results.stats()["evictions"], 1)
+        self.assertEqual(results.stats()["bytes"], 64)
+        # A result over 'largest' is not kept, so it cannot evict the smaller ones
+        self.assertLessEqual(cache.results.budget, 64 << 20)  # The shared cache lives as long as the process
+        results = cache.ResultCache(budget=1000, largest=100)
+        results.put("a", np.zeros(4, dtype=np.complex128))
+        results.put("unitary", np.eye(4, dtype=np.complex128))
+        self.assertIsNotNone(results.get("a"))
+        self.assertIsNone(results.get("unitary"))
+        self.assertEqual(results.stats()["evictions"], 0)
+
+    def test_disk(self):
+        path = "test_results.db"
+        try:
+            results = cache.ResultCache(disk=True, path=path)
+            results.put("state", np.arange(4, dtype=np.complex128))
+            results.put("counts", {"00": 3})
+            results.close()
+            reopened = cache.ResultCache(disk=True, path=path)
+            self.assertTrue(np.array_equal(reopened.get("state"), np.arange(4)))
+            self.assertEqual(reopened.get("counts"), {"00": 3})
+            self.assertEqual(reopened.disk_hits, 2)
+            reopened.get("state")
+            self.assertEqual(reopened.hits, 1)
+            reopened.close()
+        finally:
+            os.remove(path)
+
+
 class TestCbit(unittest.TestCase):
     def setUp(self):
         self.single_bit_cbit = cbit.Cbit(int(1))
@@ -170,6 +313,14 @@ class TestCbit(unittest.TestCase):
         # Test invalid value
         self.assertEqual(self.tensor_product_cbit.Cbit.vector, expected_tensor_product_vector)
 
+    def test_init_basis_index(self):
+        # The basis state is the single 1 at index 'dirac', qbit 0 being the most significant bit
+        self.assertEqual(cbit.Cbit(1, 3).Cbit.vector, [0, 1, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(cbit.Cbit(6, 3).Cbit.vector, [0, 0, 0, 0, 0, 0, 1, 0])
+        wide = cbit.Cbit(5, 24, array=True)
+        self.assertEqual(len(wide.Cbit.vector), 2 ** 24)
+        self.assertEqual(np.flatnonzero(wide.Cbit.vector).tolist(), [5])
+
     def test_measure_single_bit_cbit(self):
         # Since it's a single bit, measure should return the second element of the vector
         self.assertEqual(self.single_bit_cbit.measure(), 1)
@@ -201,6 +352,115 @@ class TestCbit(unittest.TestCase):
         self.assertEqual(repr(self.tensor_product_cbit), expected_representation)
 
 
+class TestCircuit(unittest.TestCase):
+
+    def test_recording(self):
+        with circuit.Circuit(3) as recorded:
+            gates.H(0)
+            gates.CNOT(0, 1)
+            gates.Rx(2, 0.3)
+            gates.CZ(1, 2)
+        self.assertIsNone(gates._recorder)
+        self.assertEqual([op.gate for op in recorded], [gates.Gates.HADAMARD, gates.Gates.CNOT, "RX", gates.Gates.CZ])
+        self.assertEqual(recorded.operations[2].params, (0.3,))
+        self.assertEqual(recorded.depth(), 3)
+        self.assertEqual(recorded.counts()["CNOT"], 1)
+        # Outside the block the gate functions execute again
+        self.assertAlmostEqual(gates.H(qbit.Qbit(0)).Cbit.vector[1], 1 / sqrt(2))
+
+    def test_backends_agree(self):
+        built = circuit.Circuit(4).append(gates.Gates.HADAMARD, 0).append(gates.Gates.CNOT, 0, 3)
+        built.append("RY", 2, params=(0.7,)).append(gates.Gates.SWAP, 1, 2).append(gates.Gates.T, 3)
+        self.assertEqual(built.backend(), "dense")
+        dense = built.run()
+        for backend in ("sparse", "mps"):
+            self.assertTrue(np.allclose(built.run(backend).toDense().state, dense.state))
+        self.assertFalse(built.run("unknown"))
+        self.assertFalse(built.append(gates.Gates.HADAMARD, 4))
+
+    def test_automatic_backend(self):
+        with circuit.Circuit(50) as clifford:
+            gates.H(0)
+            for qubit in range(49):
+                gates.CNOT(qubit, qubit + 1)
+        self.assertIsInstance(clifford.run(), stabilizer.StabilizerRegister)
+        with circuit.Circuit(2) as sweep:
+            gates.Ry(0, np.linspace(0, np.pi, 3))
+        self.assertEqual(sweep.backend(), "batch")
+        self.assertTrue(np.allclose(sweep.run().probabilities()[:, 2], [0, 0.5, 1]))
+        with circuit.Circuit(30) as wide:
+            gates.H(0)
+            gates.Rx(1, 0.3)
+            gates.CNOT(0, 29)
+        self.assertEqual(wide.backend(), "mps")
+        wide.append(gates.Gates.TOFFOLI, 0, 1, 29)  # The MPS only takes gates on one or two qbits
+        self.assertEqual(wide.backend(), "outofcore")
+        # Options a backend does not take move auto to one that does, or are reported
+        with circuit.Circuit(3) as clifford:
+            gates.Entangle(0, 1)
+            gates.CZ(1, 2)
+        self.assertEqual(clifford.backend(), "stabilizer")
+        self.assertIsInstance(clifford.run(threads=2), register.Register)
+        self.assertEqual(set(clifford.sample(100, seed=2, threads=2, results=None)), {"000", "110"})
+        self.assertIsInstance(clifford.run(bond=8), mps.MPSRegister)
+        self.assertFalse(clifford.run("stabilizer", threads=2))
+        self.assertFalse(clifford.run(colour="red"))
+
+    def test_unitary(self):
+        with circuit.Circuit(2) as bell:
+            gates.Entangle(0, 1)
+        results = cache.ResultCache()
+        matrix = circuit.unitary(bell, results=results)
+        hadamard = np.array([[1, 1], [1, -1]]) / sqrt(2)
+        cnot = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]])
+        self.assertTrue(np.allclose(matrix, cnot @ np.kron(hadamard, np.eye(2))))
+        self.assertIs(bell.unitary(results=results), results.get(cache.circuitKey(2, bell.operations, "unitary")))
+        self.assertEqual(results.misses, 1)
+        built = circuit.Circuit(3).append(gates.Gates.T, 2).append("RY", 0, params=(0.4,))
+        built.append(gates.Gates.SWAP, 0, 2).append(gates.Gates.TOFFOLI, 1, 2, 0)
+        matrix = built.unitary(fusion=False, results=None)
+        self.assertTrue(np.allclose(matrix.conj().T @ matrix, np.eye(8)))
+        self.assertTrue(np.allclose(matrix[:, 5], built.run(dirac=5).state))
+        self.assertFalse(circuit.Circuit(13).unitary())
+
+    def test_accuracy(self):
+        built = circuit.Circuit(4).append(gates.Gates.HADAMARD, 0).append("RZ", 0, params=(0.2,))
+        built.append(gates.Gates.CNOT, 0, 3).append("U3", 2, params=(0.1, 0.2, 0.3))
+        report = built.accuracy(renormalise=1)
+        self.assertAlmostEqual(report["fidelity"], 1, places=6)
+        self.assertLess(report["max_error"], 1e-6)
+        self.assertLess(report["norm_error"], 1e-6)
+        self.assertEqual(built.statevector(dtype=np.complex64, results=None).dtype, np.complex64)
+        with circuit.Circuit(2) as bell:
+            gates.Entangle(0, 1)
+        self.assertEqual(bell.backend(), "stabilizer")  # Which takes no dtype, so a dense register is used instead
+        self.assertEqual(set(bell.sample(100, seed=3, dtype=np.complex64, results=None)), {"00", "11"})
+
+    def test_multi_controlled(self):
+        # A 3-controlled X with one negative control flips the target only from |1 0 1> on the controls
+        built = circuit.Circuit(5).controlled(gates.Gates.PAULI_X, [0, 2], 4, negative=[1])
+        self.assertEqual(built.run(dirac=0b10100).state[0b10101], 1)
+        self.assertEqual(built.run(dirac=0b11100).state[0b11100], 1)
+        rotation = gates.parameterised("RY", 0.8) @ gates.parameterised("RZ", 0.3)
+        built = circuit.Circuit(4)
+        for qubit in range(4):
+            built.append(gates.Gates.HADAMARD, qubit)
+        built.controlled(np.kron(rotation, rotation.T), [0], 3, 2, negative=[1])
+        dense = built.run("dense").state
+        self.assertTrue(np.allclose(built.run("sparse").toDense().state, dense))
+        self.assertTrue(np.allclose(built.unitary(results=None)[:, 0], dense))
+        self.assertEqual(built.operations[-1].matrix().shape, (16, 16))
+        self.assertFalse(built.controlled(gates.Gates.CNOT, [0], 1))
+        self.assertFalse(register.Register(3).controlled(gates.Gates.PAULI_X, [0], 1, negative=[0]))
+
+    def test_custom_backend(self):
+        circuit.addBackend("threaded", lambda n, **options: register.Register(n, threads=2, **options))
+        custom = circuit.Circuit(2).append(gates.Gates.HADAMARD, 1).run("threaded", dirac=2)
+        del circuit.BACKENDS["threaded"]
+        self.assertEqual(custom.threads, 2)
+        self.assertTrue(np.allclose(custom.probabilities(), [0, 0, 0.5, 0.5]))
+
+
 class TestSetupInit(unittest.TestCase):
     def setUp(self):
         # Remove any existing database file and achievements.json before testing
@@ -273,6 +533,43 @@ class TestSetupInit(unittest.TestCase):
             os.remove("achievements.json")
 
 
+class TestDensityMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.density = density.DensityMatrix(3)
+
+    def test_unitary_matches_register(self):
+        state = register.Register(3)
+        for gate, qubits in ((gates.Gates.HADAMARD, (0,)), (gates.Gates.CNOT, (0, 2)), (gates.Gates.T, (2,)),
+                             (gates.Gates.SWAP, (1, 2)), (gates.Gates.PAULI_Y, (0,)), (gates.Gates.TOFFOLI, (0, 1, 2))):
+            state.apply(gate, *qubits)
+            self.density.apply(gate, *qubits)
+        self.assertTrue(np.allclose(self.density.rho, np.outer(state.state, np.conj(state.state))))
+        self.assertAlmostEqual(self.density.purity(), 1)
+        # A named gate with the wrong number of qbits must not fall into the controlled fast path
+        before = self.density.rho.copy()
+        for gate, qubits in ((gates.Gates.CNOT, (0,)), (gates.Gates.SWAP, (1,)), (gates.Gates.TOFFOLI, (0, 1)),
+                             (gates.Gates.CZ, (0, 1, 2)), (np.eye(4), (0,))):
+            self.assertFalse(self.density.apply(gate, *qubits))
+        self.assertTrue(np.array_equal(self.density.rho, before))
+
+    def test_channels_against_kraus_sum(self):
+        self.density.apply(gates.Gates.HADAMARD, 1)
+        self.density.apply(gates.Gates.CNOT, 1, 0)
+        for kraus in (density.depolarising(0.3), density.amplitudeDamping(0.2), density.phaseDamping(0.4)):
+            full = [np.kron(np.kron(np.eye(2), operator), np.eye(2)) for operator in kraus]
+            expected = sum(operator @ self.density.rho @ operator.conj().T for operator in full)
+            self.density.channel(kraus, 1)
+            self.assertTrue(np.allclose(self.density.rho, expected))
+            self.assertAlmostEqual(np.trace(self.density.rho).real, 1)
+        self.assertLess(self.density.purity(), 1)
+
+    def test_full_depolarising_is_mixed(self):
+        self.density.channel(density.depolarising(1), 0)
+        self.assertTrue(np.allclose(self.density.probabilities()[[0, 4]], [0.5, 0.5]))
+        self.assertEqual(set(self.density.sample(shots=200, seed=1)), {"000", "100"})
+
+
 class TestDraggable(unittest.TestCase):
     def setUp(self):
         self.fig, self.ax = plt.subplots()
@@ -325,6 +622,29 @@ class TestDraggable(unittest.TestCase):
         plt.close()
 
 
+class TestFusion(unittest.TestCase):
+
+    def setUp(self):
+        gate = gates.Gates
+        self.operations = [operation.Operation(gate.HADAMARD, (0,)), operation.Operation(gate.T, (0,)),
+                           operation.Operation(gate.PAULI_Z, (1,)), operation.Operation(gate.CNOT, (0, 1)),
+                           operation.Operation(gate.HADAMARD, (2,)), operation.Operation(gate.PHASE, (1,)),
+                           operation.Operation(gate.TOFFOLI, (0, 1, 2)), operation.Operation(gate.PAULI_Y, (2,))]
+
+    def test_fuse_count(self):
+        fused, count = fusion.fuse(self.operations, 2)
+        self.assertEqual(count, len(self.operations) - len(fused))
+        self.assertEqual(len(fused), 4)
+        self.assertTrue(all(len(op.qubits) <= 2 or op.gate is gates.Gates.TOFFOLI for op in fused))
+
+    def test_fused_state_matches(self):
+        for width in (1, 2, 3):
+            plain = register.Register(3).run(self.operations)
+            fused = register.Register(3).run(self.operations, fusion=True, width=width)
+            self.assertTrue(np.allclose(plain.state, fused.state))
+        self.assertEqual(fused.fused, 7)
+
+
 class TestGates(unittest.TestCase):
     def setUp(self):
         self.qbit0 = qbit.Qbit(0)
@@ -373,6 +693,39 @@ class TestGates(unittest.TestCase):
         measurement_result = gates.Measurement(self.qbit0)
         self.assertEqual(measurement_result.vector, [0, 1])
 
+    def test_measurement_shots(self):
+        gates.H(self.qbit0)
+        counts = gates.Measurement(self.qbit0, shots=1000)
+        self.assertEqual(sum(counts.values()), 1000)
+        self.assertEqual(set(counts), {"0", "1"})
+        self.assertAlmostEqual(self.qbit0.Cbit.vector[0], 1 / sqrt(2))  # State is not collapsed
+
+    def test_measurement_register(self):
+        bell = register.Register(2).apply(gates.Gates.HADAMARD, 0).cnot(0, 1)
+        outcome = gates.Measurement(bell)
+        self.assertIn(outcome, ({"00": 1}, {"11": 1}))
+        self.assertEqual(sum(gates.Measurement(stabilizer.StabilizerRegister(3), shots=5).values()), 5)
+        self.assertEqual(gates.Measurement(stabilizer.StabilizerRegister(3)), {"000": 1})
+
+    def test_rotation_gates(self):
+        gates.Rx(self.qbit0, np.pi)
+        self.assertTrue(np.allclose(self.qbit0.Cbit.vector, [0, -1j]))
+        gates.Ry(self.qbit1, np.pi / 2)
+        self.assertTrue(np.allclose(self.qbit1.Cbit.vector, [-1 / sqrt(2), 1 / sqrt(2)]))
+        u3 = gates.parameterised("U3", np.pi / 2, 0, np.pi)
+        self.assertTrue(np.allclose(u3, gates.MATRICES[gates.Gates.HADAMARD]))  # U3(pi/2, 0, pi) is H
+        self.assertFalse(gates.parameterised("RX", 1, 2))
+
+    def test_gate_cache(self):
+        self.assertFalse(gates.MATRICES[gates.Gates.HADAMARD].flags.writeable)
+        self.assertIs(gates.gateMatrix(gates.Gates.CNOT), gates.MATRICES[gates.Gates.CNOT])
+        first = gates.parameterised("RZ", 0.1 + 0.2)
+        self.assertIs(gates.parameterised("RZ", 0.3), first)  # Rounding lets float noise hit the cache
+        self.assertFalse(first.flags.writeable)
+        for name, angles in (("RX", (0.7,)), ("RY", (0.7,)), ("RZ", (0.7,)), ("U3", (0.7, 0.2, 1.3))):
+            matrix = gates.parameterised(name, *angles)
+            self.assertTrue(np.allclose(matrix @ matrix.conj().T, np.eye(2)))
+
     def test_initialize(self):
         name, value = gates.Initialise("new_qbit", [0])
         vars()[name] = value
@@ -403,6 +756,15 @@ class TestGates(unittest.TestCase):
                                                      [0, 0, 0, 0, 0, 0, 0, 1],
                                                      [0, 0, 0, 0, 0, 0, 1, 0]])
 
+    def test_apply_gate(self):
+        register = qbit.Qbit(0, 3, array=True)
+        gates.applyGate(gates.Gates["PAULI_X"].value, register, 1)
+        self.assertEqual(register.Cbit.vector[0b010], 1)
+        gates.applyGate(gates.Gates["HADAMARD"].value, register, 0)
+        self.assertAlmostEqual(register.Cbit.vector[0b010], 1 / sqrt(2))
+        self.assertAlmostEqual(register.Cbit.vector[0b110], 1 / sqrt(2))
+        self.assertFalse(gates.applyGate(gates.Gates["HADAMARD"].value, register, 3))
+
     def tearDown(self):
         self.qbit0 = qbit.Qbit(0)
         self.qbit1 = qbit.Qbit(1)
@@ -478,8 +840,8 @@ class TestFileMenu(unittest.TestCase):
         self.mocked_exit = patch('builtins.exit').start()
         self.mocked_os_system = patch('os.system').start()
         self.mocked_askopenfilename = patch('interface.askopenfilename', return_value='mocked_file.txt').start()
-        self.mocked_open = patch('builtins.open', create=True)
-        self.mocked_open.__enter__().readlines.return_value = [
+        self.mocked_open = patch('builtins.open', create=True).start()  # started so stopall also restores open
+        self.mocked_open.readlines.return_value = [
             'recent_file_1.txt\n', 'recent_file_2.txt\n', 'recent_file_3.txt\n'
         ]
 
@@ -734,6 +1096,97 @@ class TestInputScanner(unittest.TestCase):
             self.input_scanner.scan_next()
 
 
+class TestKernels(unittest.TestCase):
+
+    def test_apply_single_matches_dense(self):
+        # Compare the strided kernel against the full kronecker product operator
+        n = 4
+        rng = np.random.default_rng(1)
+        state = rng.normal(size=2 ** n) + 1j * rng.normal(size=2 ** n)
+        gate = np.asarray(gates.Gates["T"].value) @ np.asarray(gates.Gates["HADAMARD"].value)
+        for k in range(n):
+            dense = np.kron(np.kron(np.eye(2 ** k), gate), np.eye(2 ** (n - k - 1))) @ state
+            result = kernels.applySingle(state.copy(), gate, k, n)
+            self.assertTrue(np.allclose(result, dense))
+
+    def test_apply_single_blocked(self):
+        # Views larger than the scratch buffer are mixed block by block, with no copy of half the state
+        n = 6
+        rng = np.random.default_rng(2)
+        state = rng.normal(size=2 ** n) + 1j * rng.normal(size=2 ** n)
+        states = rng.normal(size=(3, 2 ** n)) + 1j * rng.normal(size=(3, 2 ** n))
+        gate = np.asarray(gates.Gates["T"].value) @ np.asarray(gates.Gates["HADAMARD"].value)
+        stack = np.stack([gate, gate.T, gate.conj()])
+        with patch.object(kernels, "_BLOCK", 4):
+            for k in range(n):
+                dense = np.kron(np.kron(np.eye(2 ** k), gate), np.eye(2 ** (n - k - 1)))
+                self.assertTrue(np.allclose(kernels.applySingle(state.copy(), gate, k, n), dense @ state))
+                expected = np.stack([np.kron(np.kron(np.eye(2 ** k), one), np.eye(2 ** (n - k - 1))) @ row
+                                     for one, row in zip(stack, states)])
+                self.assertTrue(np.allclose(kernels.applySingleBatch(states.copy(), stack, k, n), expected))
+        state = np.ones(1 << 18, dtype=np.complex128)
+        tracemalloc.start()
+        kernels.applySingle(state, gate, 0, 18)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertLess(peak, state.nbytes // 8)
+
+    def test_threaded_kernels_match(self):
+        # Blocks dispatched to the thread pool must give the same state as the single threaded kernels
+        n = 17
+        rng = np.random.default_rng(5)
+        state = rng.normal(size=2 ** n) + 1j * rng.normal(size=2 ** n)
+        gate = np.asarray(gates.Gates["HADAMARD"].value)
+        for qubit in (0, 8, 16):
+            self.assertTrue(np.allclose(kernels.applySingle(state.copy(), gate, qubit, n, threads=4),
+                                        kernels.applySingle(state.copy(), gate, qubit, n)))
+        self.assertTrue(np.allclose(kernels.applyControlled(state.copy(), gate, [0, 1], 2, n, threads=4),
+                                    kernels.applyControlled(state.copy(), gate, [0, 1], 2, n)))
+        self.assertTrue(np.allclose(kernels.applySwap(state.copy(), 0, 16, n, threads=8),
+                                    kernels.applySwap(state.copy(), 0, 16, n)))
+        swap = np.asarray(gates.Gates["SWAP"].value, dtype=complex)
+        self.assertTrue(np.allclose(kernels.applyMatrix(state.copy(), swap, [3, 1], n, threads=2),
+                                    kernels.applySwap(state.copy(), 1, 3, n)))
+
+    def test_apply_single_in_place(self):
+        state = np.zeros(8, dtype=np.complex128)
+        state[0] = 1
+        result = kernels.applySingle(state, np.asarray(gates.Gates["PAULI_X"].value), 2, 3)
+        self.assertIs(result, state)
+        self.assertEqual(state[1], 1)
+
+    def test_apply_diagonal(self):
+        # Small gates scale blocks, large ones broadcast, both must match the dense matrix on unsorted qbits
+        n = 6
+        rng = np.random.default_rng(2)
+        state = rng.normal(size=2 ** n) + 1j * rng.normal(size=2 ** n)
+        for qubits in ([4, 1], [5, 0, 3, 2, 1]):
+            phases = np.exp(1j * rng.normal(size=2 ** len(qubits)))
+            expected = kernels.applyMatrix(state.copy(), np.diag(phases), qubits, n)
+            self.assertTrue(np.allclose(kernels.applyDiagonal(state.copy(), phases, qubits, n), expected))
+            self.assertTrue(np.allclose(kernels.applyDiagonal(state.copy(), phases, qubits, n, threads=4), expected))
+            batched = kernels.applyDiagonalBatch(np.array([state, 2 * state]), phases, qubits, n)
+            self.assertTrue(np.allclose(batched, [expected, 2 * expected]))
+        union, phases = kernels.combineDiagonals([2, 0], np.array([1, 1, 1, -1]), [0], np.array([1, 1j]))
+        self.assertEqual(union, [2, 0])
+        self.assertTrue(np.allclose(phases, [1, 1j, 1, -1j]))
+
+    def test_apply_multi_controlled(self):
+        # Negative controls and several targets, for dense, diagonal and permutation gates, against the full matrix
+        n = 5
+        rng = np.random.default_rng(4)
+        state = rng.normal(size=2 ** n) + 1j * rng.normal(size=2 ** n)
+        dense = np.linalg.qr(rng.normal(size=(4, 4)) + 1j * rng.normal(size=(4, 4)))[0]
+        for gate in (dense, np.diag(np.exp(1j * np.arange(4))), np.asarray(gates.Gates.SWAP.value, dtype=complex),
+                     np.asarray(gates.Gates.HADAMARD.value, dtype=complex)):
+            targets = [3, 0] if len(gate) == 4 else [0]
+            expected = kernels.applyMatrix(state.copy(), gates.controlledMatrix(gate, (1, 0)), [4, 1, *targets], n)
+            result = kernels.applyControlled(state.copy(), gate, {4: 1, 1: 0}, targets, n, threads=2)
+            self.assertTrue(np.allclose(result, expected))
+            batched = kernels.applyControlledBatch(np.array([state, -state]), gate, {4: 1, 1: 0}, targets, n)
+            self.assertTrue(np.allclose(batched, [expected, -expected]))
+
+
 class TestLexer(unittest.TestCase):
 
     def setUp(self):
@@ -894,6 +1347,192 @@ class TestDrawGraph(unittest.TestCase):
             self.assertTrue(True)
 
 
+class TestMPSRegister(unittest.TestCase):
+
+    def setUp(self):
+        gate = gates.Gates
+        self.operations = [operation.Operation(gate.HADAMARD, (0,)), operation.Operation(gate.CNOT, (0, 3)),
+                           operation.Operation("U3", (2,), params=(0.4, 1.1, 0.2)), operation.Operation(gate.CZ, (3, 1)),
+                           operation.Operation(gate.SWAP, (0, 2)), operation.Operation(gate.T, (1,)),
+                           operation.Operation(gate.CNOT, (2, 1)), operation.Operation(gate.PAULI_Y, (3,))]
+
+    def test_matches_dense(self):
+        state = mps.MPSRegister(4).run(self.operations)
+        dense = register.Register(4).run(self.operations)
+        self.assertTrue(np.allclose(state.toDense().state, dense.state))
+        self.assertAlmostEqual(state.amplitude(6), dense.state[6])
+        for term in ("ZIZI", "XYIZ", "IXXI"):
+            self.assertAlmostEqual(state.expectation(term), dense.expectation(term))
+        self.assertAlmostEqual(state.truncation_error, 0)
+        self.assertFalse(state.apply(gates.Gates.TOFFOLI, 0, 1, 2))
+
+    def test_wide_ghz(self):
+        state = mps.MPSRegister(80).apply(gates.Gates.HADAMARD, 0)
+        for qubit in range(79):
+            state.cnot(qubit, qubit + 1)
+        self.assertEqual(max(state.bonds()), 2)
+        self.assertEqual(set(state.sample(200, seed=1)), {"0" * 80, "1" * 80})
+        self.assertAlmostEqual(state.expectation("X" * 80), 1)
+
+    def test_truncation(self):
+        state = mps.MPSRegister(8, bond=2)
+        for layer in range(3):
+            for qubit in range(8):
+                state.apply(gates.parameterised("RY", 0.7 + qubit), qubit)
+            for qubit in range(7):
+                state.cnot(qubit, qubit + 1)
+        self.assertLessEqual(max(state.bonds()), 2)
+        self.assertGreater(state.truncation_error, 0)
+        self.assertLess(state.fidelity, 1)
+        self.assertAlmostEqual(np.linalg.norm(state.toDense().state), 1)
+
+
+class TestOptimiser(unittest.TestCase):
+
+    def test_cancellations(self):
+        with circuit.Circuit(3) as redundant:
+            gates.H(0)
+            gates.H(0)
+            gates.X(1)
+            gates.CNOT(0, 1)
+            gates.X(1)  # Commutes back through the CNOT target and cancels
+            gates.CNOT(0, 1)
+            gates.Z(0)
+            gates.CZ(2, 0)
+            gates.Z(0)  # Commutes back through the CZ and cancels
+        report = redundant.optimise()
+        self.assertEqual([op.gate for op in redundant], [gates.Gates.CZ])
+        self.assertEqual(report, {"gates_before": 9, "depth_before": 8, "gates_after": 1, "depth_after": 1})
+
+    def test_phase_merging(self):
+        gate = gates.Gates
+        operations = [operation.Operation(gate.T, (0,)), operation.Operation(gate.CNOT, (0, 1)),
+                      operation.Operation(gate.T, (0,)), operation.Operation(gate.PHASE, (0,)),
+                      operation.Operation(gate.T, (1,)), operation.Operation(gate.PHASE, (1,))]
+        optimised, report = optimiser.optimise(operations)
+        self.assertEqual(optimised[0].gate, gate.PAULI_Z)
+        self.assertEqual(optimised[-1].gate, "DIAGONAL")
+        self.assertEqual(report["gates_after"], 3)
+        before = register.Register(2, 1).apply(gate.HADAMARD, 0).run(operations)
+        after = register.Register(2, 1).apply(gate.HADAMARD, 0).run(optimised)
+        self.assertTrue(np.allclose(before.state, after.state))
+
+    def test_preserves_state(self):
+        rng = np.random.default_rng(3)
+        singles = [gates.Gates.HADAMARD, gates.Gates.PAULI_X, gates.Gates.PAULI_Z, gates.Gates.T, gates.Gates.PHASE]
+        pairs = [gates.Gates.CNOT, gates.Gates.CZ, gates.Gates.SWAP]
+        for trial in range(20):
+            operations = []
+            for _ in range(30):
+                if rng.random() < 0.6:
+                    operations.append(operation.Operation(singles[rng.integers(5)], (int(rng.integers(3)),)))
+                else:
+                    first, second = rng.choice(3, 2, replace=False)
+                    operations.append(operation.Operation(pairs[rng.integers(3)], (int(first), int(second))))
+            optimised, report = optimiser.optimise(operations)
+            self.assertLessEqual(report["gates_after"], report["gates_before"])
+            self.assertTrue(np.allclose(register.Register(3, 5).run(operations).state,
+                                        register.Register(3, 5).run(optimised).state))
+
+
+class TestOutOfCoreRegister(unittest.TestCase):
+
+    def setUp(self):
+        self.register = outofcore.OutOfCoreRegister(6, chunk=4)
+        gate = gates.Gates
+        self.operations = [operation.Operation(gate.HADAMARD, (0,)), operation.Operation(gate.CNOT, (0, 5)),
+                           operation.Operation(gate.T, (5,)), operation.Operation(gate.HADAMARD, (3,)),
+                           operation.Operation(gate.SWAP, (1, 4)), operation.Operation(gate.TOFFOLI, (0, 3, 1)),
+                           operation.Operation(gate.CZ, (1, 2)), operation.Operation(gate.PAULI_Y, (2,))]
+
+    def test_matches_in_memory(self):
+        self.register.run(self.operations)
+        expected = register.Register(6).run(self.operations).state
+        self.assertTrue(np.allclose(np.asarray(self.register.state), expected))
+        self.assertEqual(self.register.sample(shots=500, seed=4).keys(),
+                         {key for key, amplitude in zip(map("{0:06b}".format, range(64)), expected)
+                          if abs(amplitude) > 1e-12})
+
+    def test_traffic_report(self):
+        self.register.run(self.operations)
+        # SWAP and TOFFOLI span more qbits than fit in a chunk, so they are not composed into one permutation
+        self.assertEqual(len(self.register.history), len(self.operations))
+        self.assertEqual(self.register.bytes_read, 64 * 16)
+        self.assertTrue(all(read == written for read, written in self.register.history))
+        # CZ on two high qbits only touches the quarter of the chunks where both are |1>
+        self.assertEqual(self.register.history[6], (16 * 16, 16 * 16))
+
+    def test_streamed_readouts(self):
+        self.register.run(self.operations)
+        dense = register.Register(6).run(self.operations)
+        self.assertTrue(np.allclose(self.register.probabilities(), dense.probabilities()))
+        self.assertEqual(repr(self.register), repr(dense))
+        for observable in ("XIIIIZ", "ZZIIII", {"IYIYII": 0.5, "XIIZII": -2}):
+            self.assertAlmostEqual(self.register.expectation(observable), dense.expectation(observable))
+        self.assertFalse(self.register.expectation("ZZ"))
+
+    def test_wrong_qubit_count(self):
+        self.assertFalse(self.register.apply(gates.Gates.CNOT, 0))
+        self.assertFalse(self.register.apply(np.eye(4), 0))
+        self.assertEqual(self.register.history, [])
+
+    def test_permutations_combine_inside_chunk(self):
+        gate = gates.Gates
+        self.register.run([operation.Operation(gate.PAULI_X, (4,)), operation.Operation(gate.CNOT, (4, 5))])
+        self.assertEqual(len(self.register.history), 1)
+        # Qbit 0 selects chunks, so composing these would gather chunk groups for the whole run
+        self.register.run([operation.Operation(gate.PAULI_X, (0,)), operation.Operation(gate.CNOT, (0, 5))])
+        self.assertEqual(len(self.register.history), 3)
+        self.assertTrue(np.allclose(np.asarray(self.register.state), np.eye(64)[0b100010]))
+
+    def test_diagonal_streams(self):
+        # Phase ladders on the high qbits must not pull the whole file in, each chunk is scaled on its own
+        big = outofcore.OutOfCoreRegister(12, chunk=1 << 6)
+        operations = [operation.Operation(gates.Gates.HADAMARD, (qubit,)) for qubit in range(12)]
+        for target in range(6):
+            operations += [operation.Operation("UNITARY", (control, target),
+                                               np.diag([1, 1, 1, np.exp(1j * np.pi / (1 << (control - target)))]))
+                           for control in range(target + 1, 6)]
+        big.run(operations[12:])
+        self.assertEqual(big.resident, (1 << 6) * 16)  # One chunk, although the run touched six chunk index qbits
+        big.run(operations[:12])
+        self.assertTrue(np.allclose(np.asarray(big.state), register.Register(12).run(operations[:12]).state))
+        big.run(operations[12:])
+        self.assertTrue(np.allclose(np.asarray(big.state), register.Register(12).run(operations).state))
+        self.assertEqual(big.run_width, 6)
+        big.close()
+
+    def test_file_released(self):
+        with outofcore.OutOfCoreRegister(4, chunk=4) as scoped:
+            path = scoped.apply(gates.Gates.HADAMARD, 0).path
+        self.assertFalse(os.path.exists(path))
+        scoped.close()  # Closing twice does nothing
+        forgotten = outofcore.OutOfCoreRegister(4)
+        path = forgotten.path
+        del forgotten  # Never closed, the temporary file goes with the register
+        self.assertFalse(os.path.exists(path))
+        kept = outofcore.OutOfCoreRegister(2, path=path)
+        kept.close()
+        self.assertTrue(os.path.exists(path))  # A file the caller named is theirs
+        os.remove(path)
+
+    def test_sample_cleans_up(self):
+        with circuit.Circuit(3) as ghz:
+            gates.Entangle(0, 1)
+            gates.Rx(2, 0.3)
+        close = outofcore.OutOfCoreRegister.close
+        with patch.object(outofcore.OutOfCoreRegister, "close", autospec=True, side_effect=close) as spy:
+            self.assertEqual(set(ghz.sample(200, seed=1, backend="outofcore", results=None)),
+                             {"000", "001", "110", "111"})
+        spy.assert_called_once()
+        self.assertFalse(os.path.exists(spy.call_args[0][0].path))
+
+    def tearDown(self):
+        path = self.register.path
+        self.register.close()
+        self.assertFalse(os.path.exists(path))
+
+
 class TestPoint(unittest.TestCase):
 
     def test_point_creation(self):
@@ -970,6 +1609,165 @@ class TestQbit(unittest.TestCase):
         step = 1
         self.assertIsNone(self.qbit.diffuse(step))
 
+    def test_array_mode(self):
+        # Test that array backed Qbits accept complex amplitudes
+        array_qbit = qbit.Qbit(0, 3, array=True)
+        self.assertEqual(array_qbit.Qbit.vector.dtype, np.complex128)
+        self.assertEqual(len(array_qbit.Qbit.vector), 8)
+        self.assertEqual(array_qbit.Qbit.vector[0], 1)
+        single = qbit.Qbit(0, array=True)
+        self.assertTrue(single.setElement(index=1, value=1j))
+        self.assertEqual(single.Qbit.vector[1], 1j)
+
+
+class TestRegister(unittest.TestCase):
+
+    def setUp(self):
+        self.register = register.Register(3)
+
+    def test_register_init(self):
+        self.assertEqual(len(self.register.state), 8)
+        self.assertEqual(self.register.state[0], 1)
+        self.assertEqual(register.Register(2, 0b10).state[2], 1)
+
+    def test_superposed_cnot(self):
+        # A Hadamard control must produce a Bell state rather than a classical branch
+        self.register.apply(gates.Gates.HADAMARD, 0)
+        self.register.cnot(0, 2)
+        self.assertAlmostEqual(self.register.state[0b000], 1 / sqrt(2))
+        self.assertAlmostEqual(self.register.state[0b101], 1 / sqrt(2))
+        self.assertAlmostEqual(sum(self.register.probabilities()), 1)
+
+    def test_cz_swap_toffoli(self):
+        self.register.apply(gates.Gates.PAULI_X, 0)
+        self.register.apply(gates.Gates.PAULI_X, 1)
+        self.register.toffoli(0, 1, 2)
+        self.assertEqual(self.register.state[0b111], 1)
+        self.register.cz(0, 2)
+        self.assertEqual(self.register.state[0b111], -1)
+        self.register.apply(gates.Gates.PAULI_X, 1)
+        self.register.swap(1, 2)
+        self.assertEqual(self.register.state[0b110], -1)
+
+    def test_dense_gates_agree(self):
+        # The named kernels should match the dense Gates matrices
+        rng = np.random.default_rng(2)
+        state = rng.normal(size=8) + 1j * rng.normal(size=8)
+        for gate in (gates.Gates.CNOT, gates.Gates.CZ, gates.Gates.SWAP):
+            kernel = register.Register(3)
+            kernel.state = state.copy()
+            kernel.apply(gate, 2, 0)
+            dense = register.Register(3)
+            dense.state = state.copy()
+            dense.apply(np.asarray(gate.value), 2, 0)
+            self.assertTrue(np.allclose(kernel.state, dense.state))
+
+    def test_sample(self):
+        self.register.apply(gates.Gates.HADAMARD, 0)
+        self.register.cnot(0, 1)
+        counts = self.register.sample(shots=10000, seed=3)
+        self.assertEqual(set(counts), {"000", "110"})
+        self.assertEqual(sum(counts.values()), 10000)
+        self.assertAlmostEqual(counts["000"] / 10000, 0.5, places=1)
+        self.assertEqual(self.register.sample(shots=100, seed=3), self.register.sample(shots=100, seed=3))
+        self.assertFalse(self.register.sample(shots=0))
+        # An all zero state has no outcomes, rather than every shot landing on the last basis state
+        self.assertFalse(register.Register.fromState(np.zeros(8, dtype=np.complex128)).sample(shots=10))
+        self.assertFalse(batch.BatchRegister.fromState(np.zeros((2, 8), dtype=np.complex128)).sample(shots=10))
+        empty = outofcore.OutOfCoreRegister(3)
+        empty.state[:] = 0
+        self.assertFalse(empty.sample(shots=10))
+        empty.close()
+
+    def test_invalid_qubits(self):
+        self.assertFalse(self.register.cnot(0, 0))
+        self.assertFalse(self.register.apply(gates.Gates.HADAMARD, 3))
+        # Named gates given the wrong number of qbits are reported rather than raising
+        for gate, qubits in ((gates.Gates.CNOT, (0,)), (gates.Gates.SWAP, (0, 1, 2)), (gates.Gates.TOFFOLI, (0, 1)),
+                             (gates.Gates.CZ, (2,))):
+            self.assertFalse(self.register.apply(gate, *qubits))
+            self.assertFalse(batch.BatchRegister(3, 2).apply(gate, *qubits))
+
+    def test_expectation(self):
+        self.register.apply(gates.Gates.HADAMARD, 0).cnot(0, 1).apply(gates.Gates.PHASE, 2)
+        self.assertAlmostEqual(self.register.expectation("ZZI"), 1)
+        self.assertAlmostEqual(self.register.expectation("XXI"), 1)
+        self.assertAlmostEqual(self.register.expectation("YYI"), -1)
+        self.assertAlmostEqual(self.register.expectation("ZII"), 0)
+        self.assertAlmostEqual(self.register.expectation({"ZZI": 0.5, "XXI": 0.25, "IIZ": -1}), -0.25)
+        self.assertFalse(self.register.expectation("ZZ"))
+        # Every term against the dense operator on a random state
+        state = np.random.default_rng(0).normal(size=(8, 2)) @ np.array([1, 1j])
+        state /= np.linalg.norm(state)
+        paulis = {"I": np.eye(2), "X": np.array(gates.Gates.PAULI_X.value),
+                  "Y": np.array(gates.Gates.PAULI_Y.value), "Z": np.array(gates.Gates.PAULI_Z.value)}
+        for term in ("XYZ", "YIY", "ZXX", "IYI"):
+            operator = np.kron(np.kron(paulis[term[0]], paulis[term[1]]), paulis[term[2]])
+            expected = np.vdot(state, operator @ state).real
+            self.assertAlmostEqual(register.Register.fromState(state).expectation(term), expected)
+            self.assertAlmostEqual(density.DensityMatrix.fromState(state).expectation(term), expected)
+        # Amplitudes are taken a chunk at a time, a tiny chunk must give the same values densely and sparsely
+        terms = ["XYZ", "YIY", "ZXX", "IYI", "ZZI"]
+        whole = kernels.pauliExpectations(state, terms, 3)
+        self.assertTrue(np.allclose(kernels.pauliExpectations(state, terms, 3, block=2, chunk=3), whole))
+        indices = np.array([0, 2, 3, 6])
+        sparse_state = state[indices] / np.linalg.norm(state[indices])
+        dense_state = np.zeros(8, dtype=complex)
+        dense_state[indices] = sparse_state
+        self.assertTrue(np.allclose(kernels.pauliExpectations(sparse_state, terms, 3, indices, chunk=3),
+                                    kernels.pauliExpectations(dense_state, terms, 3)))
+
+    def test_diagonal_runs(self):
+        # Runs of diagonal gates are accumulated into one phase vector, the state must match gate by gate
+        operations = [operation.Operation(gates.Gates.HADAMARD, (qubit,)) for qubit in range(4)]
+        operations += [operation.Operation(gates.Gates.T, (3,)), operation.Operation(gates.Gates.CZ, (2, 0)),
+                       operation.Operation("RZ", (1,), params=(0.7,)), operation.Operation(gates.Gates.PAULI_Z, (0,)),
+                       operation.Operation(gates.Gates.CNOT, (0, 1)), operation.Operation(gates.Gates.PHASE, (1,)),
+                       operation.Operation("UNITARY", (3, 1), np.diag(np.exp(1j * np.arange(4))))]
+        expected = register.Register(4)
+        for op in operations:
+            expected.apply(op.matrix(), *op.qubits)
+        self.assertTrue(np.allclose(register.Register(4).run(operations).state, expected.state))
+        self.assertTrue(np.allclose(register.Register(4, renormalise=3).run(operations).state, expected.state))
+        self.assertIsNone(operations[-3].diagonal())
+        self.assertFalse(register.Register(2).diagonal([1, -1], 0, 1))
+
+    def test_permutation_runs(self):
+        # Runs of permutation gates are composed into one permutation, the state must match gate by gate
+        rng = np.random.default_rng(3)
+        state = rng.normal(size=32) + 1j * rng.normal(size=32)
+        operations = [operation.Operation(gates.Gates.PAULI_X, (4,)), operation.Operation(gates.Gates.CNOT, (4, 0)),
+                      operation.Operation(gates.Gates.SWAP, (0, 2)), operation.Operation(gates.Gates.TOFFOLI, (2, 4, 1)),
+                      operation.Operation(gates.Gates.HADAMARD, (3,)), operation.Operation(gates.Gates.CNOT, (3, 1)),
+                      operation.Operation("UNITARY", (1, 3), np.eye(4)[[2, 0, 3, 1]])]
+        expected = state.copy()
+        for op in operations:
+            kernels.applyMatrix(expected, np.asarray(op.matrix(), dtype=complex), list(op.qubits), 5)
+        self.assertTrue(np.allclose(register.Register.fromState(state.copy()).run(operations).state, expected))
+        sweep = batch.BatchRegister.fromState(np.array([state, 1j * state])).run(operations)
+        self.assertTrue(np.allclose(sweep.state, [expected, 1j * expected]))
+        union, permutation = kernels.combinePermutations([0], [1, 0], [1, 0], [0, 1, 3, 2])
+        self.assertEqual(union, [0, 1])
+        self.assertEqual(permutation.tolist(), [2, 1, 0, 3])  # X on qbit 0, then CNOT from qbit 1 onto qbit 0
+        self.assertIsNone(operations[4].permutation())
+        self.assertFalse(register.Register(2).permute([0, 0, 1, 2], 0, 1))
+
+    def test_single_precision(self):
+        operations = [operation.Operation(gates.Gates.HADAMARD, (0,)), operation.Operation("RY", (1,), params=(0.3,)),
+                      operation.Operation(gates.Gates.CNOT, (0, 2)), operation.Operation(gates.Gates.T, (2,)),
+                      operation.Operation(gates.Gates.TOFFOLI, (0, 2, 1))]
+        single = register.Register(3, dtype=np.complex64, renormalise=2).run(operations, fusion=True)
+        exact = register.Register(3).run(operations)
+        self.assertEqual(single.state.dtype, np.complex64)
+        self.assertTrue(np.allclose(single.state, exact.state, atol=1e-6))
+        self.assertAlmostEqual(single.expectation("ZIZ"), exact.expectation("ZIZ"), places=6)
+        self.assertEqual(single.sample(100, seed=1), exact.sample(100, seed=1))
+        sweep = batch.BatchRegister(1, 3, dtype=np.complex64).rotate("RX", 0, np.array([0, np.pi / 2, np.pi]))
+        self.assertEqual(sweep.state.dtype, np.complex64)
+        self.assertTrue(np.allclose(sweep.probabilities()[:, 1], [0, 0.5, 1], atol=1e-6))
+        with self.assertRaises(SystemExit):
+            register.Register(2, dtype=np.float32)
+
 
 class TestRenderer(unittest.TestCase):
 
@@ -1027,6 +1825,170 @@ class TestRenderer(unittest.TestCase):
         renderer_test.dwalls()
 
 
+class TestShardedRegister(unittest.TestCase):
+
+    def setUp(self):
+        self.register = sharded.ShardedRegister(6, workers=4)
+
+    def test_matches_single_process(self):
+        gate = gates.Gates
+        operations = [operation.Operation(gate.HADAMARD, (0,)), operation.Operation(gate.CNOT, (0, 5)),
+                      operation.Operation(gate.T, (5,)), operation.Operation(gate.HADAMARD, (3,)),
+                      operation.Operation(gate.SWAP, (1, 4)), operation.Operation(gate.TOFFOLI, (0, 3, 1)),
+                      operation.Operation(gate.CZ, (1, 0)), operation.Operation(gate.PAULI_Y, (1,))]
+        self.register.run(operations)
+        self.assertEqual(self.register.workers, 4)
+        self.assertTrue(np.allclose(self.register.state, register.Register(6).run(operations).state))
+
+    def test_diagonal_per_shard(self):
+        operations = [operation.Operation(gates.Gates.HADAMARD, (qubit,)) for qubit in range(6)]
+        operations += [operation.Operation(gates.Gates.CZ, (0, 1)), operation.Operation(gates.Gates.T, (0,)),
+                       operation.Operation("RZ", (5,), params=(0.4,)), operation.Operation(gates.Gates.CZ, (1, 4))]
+        self.register.run(operations)
+        self.assertEqual(self.register.run_width, 4)
+        self.assertTrue(np.allclose(self.register.state, register.Register(6).run(operations).state))
+
+    def test_released_without_close(self):
+        with sharded.ShardedRegister(3, workers=2) as scoped:
+            name = scoped.memory.name
+        self.assertRaises(FileNotFoundError, SharedMemory, name=name)
+        scoped.close()  # Closing twice does nothing
+        forgotten = sharded.ShardedRegister(3, workers=2)
+        name, pool = forgotten.memory.name, forgotten.pool
+        del forgotten  # Never closed, the shared memory and workers go with the register
+        self.assertRaises(FileNotFoundError, SharedMemory, name=name)
+        self.assertRaises(ValueError, pool.apply, abs, (-1,))
+
+    def test_spawn_without_forkserver(self):
+        # Windows has no forkserver start method
+        with patch.object(sharded, "get_all_start_methods", return_value=["spawn"]), \
+                patch.object(sharded, "get_context", wraps=sharded.get_context) as context:
+            spawned = sharded.ShardedRegister(3, workers=2)
+        context.assert_called_once_with("spawn")
+        self.assertTrue(np.allclose(spawned.apply(gates.Gates.HADAMARD, 0).state, np.eye(8)[[0, 4]].sum(0) * sqrt(0.5)))
+        spawned.close()
+
+    def test_permutations_combine_inside_shard(self):
+        self.assertTrue(self.register._combinable("permutation", {2, 5}))
+        self.assertFalse(self.register._combinable("permutation", {1, 5}))
+        self.assertTrue(self.register._combinable("diagonal", {1, 5}))
+        operations = [operation.Operation(gates.Gates.HADAMARD, (qubit,)) for qubit in range(6)]
+        operations += [operation.Operation(gates.Gates.CNOT, (0, 3)), operation.Operation(gates.Gates.SWAP, (1, 4)),
+                       operation.Operation(gates.Gates.TOFFOLI, (3, 4, 5))]
+        self.register.run(operations)
+        self.assertTrue(np.allclose(self.register.state, register.Register(6).run(operations).state))
+
+    def tearDown(self):
+        self.register.close()
+
+
+class TestSparseRegister(unittest.TestCase):
+
+    def setUp(self):
+        gate = gates.Gates
+        self.operations = [operation.Operation(gate.PAULI_X, (0,)), operation.Operation(gate.HADAMARD, (1,)),
+                           operation.Operation(gate.CNOT, (1, 2)), operation.Operation(gate.T, (2,)),
+                           operation.Operation(gate.SWAP, (0, 3)), operation.Operation(gate.TOFFOLI, (2, 3, 0)),
+                           operation.Operation(gate.PAULI_Y, (1,)), operation.Operation(gate.CZ, (0, 2))]
+
+    def test_wrong_qubit_count(self):
+        # CNOT on three qbits must not become a Toffoli, nor CNOT on one a bare X
+        sparse_register = sparse.SparseRegister(3)
+        for gate, qubits in ((gates.Gates.CNOT, (0, 1, 2)), (gates.Gates.CNOT, (0,)), (gates.Gates.TOFFOLI, (0, 1)),
+                             (gates.Gates.CZ, (2,)), (np.eye(2), (0, 1))):
+            self.assertFalse(sparse_register.apply(gate, *qubits))
+        self.assertEqual(sparse_register.indices.tolist(), [0])
+
+    def test_matches_dense(self):
+        dense = register.Register(4).run(self.operations)
+        sparse_register = sparse.SparseRegister(4, threshold=1).run(self.operations)
+        self.assertIsNone(sparse_register.dense)
+        self.assertTrue(np.allclose(sparse_register.toDense().state, dense.state))
+
+    def test_expectation(self):
+        state = sparse.SparseRegister(6, threshold=1.0)
+        for qubit in range(4):
+            state.apply(gates.Gates.HADAMARD, qubit)
+        state.cnot(0, 5).apply(gates.Gates.PHASE, 5)
+        dense = state.toDense()
+        for term in ("ZIIIIZ", "XIIIIY", "IXIIII", "YIIIIX"):
+            self.assertAlmostEqual(state.expectation(term), dense.expectation(term))
+
+    def test_switches_to_dense(self):
+        self.operations += [operation.Operation(gates.Gates.HADAMARD, (qubit,)) for qubit in range(4)]
+        sparse_register = sparse.SparseRegister(4, threshold=0.5)
+        sparse_register.run(self.operations)
+        self.assertIsNotNone(sparse_register.dense)
+        self.assertTrue(np.allclose(sparse_register.toDense().state, register.Register(4).run(self.operations).state))
+
+    def test_wide_classical_circuit(self):
+        # 48 qbits would need petabytes as a dense statevector
+        wide = sparse.SparseRegister(48)
+        for qubit in range(0, 48, 2):
+            wide.apply(gates.Gates.PAULI_X, qubit)
+            wide.cnot(qubit, qubit + 1)
+        wide.apply(gates.Gates.HADAMARD, 47)
+        self.assertEqual(len(wide.indices), 2)
+        self.assertEqual(wide.sample(shots=100, seed=1).keys(), {"1" * 47 + "0", "1" * 48})
+
+
+class TestStabilizerRegister(unittest.TestCase):
+
+    def setUp(self):
+        gate = gates.Gates
+        self.operations = [operation.Operation(gate.HADAMARD, (0,)), operation.Operation(gate.CNOT, (0, 2)),
+                           operation.Operation(gate.PHASE, (2,)), operation.Operation(gate.HADAMARD, (3,)),
+                           operation.Operation(gate.CZ, (3, 1)), operation.Operation(gate.PAULI_Y, (0,)),
+                           operation.Operation(gate.SWAP, (1, 2)), operation.Operation(gate.HADAMARD, (1,)),
+                           operation.Operation(gate.PAULI_X, (3,)), operation.Operation(gate.PAULI_Z, (2,))]
+
+    def test_matches_dense(self):
+        tableau = stabilizer.StabilizerRegister(4, 5).run(self.operations)
+        dense = register.Register(4, 5).run(self.operations)
+        for term in ("ZIZI", "XYIZ", "IXXI", "YZIX", "IIIZ", "XIYI"):
+            self.assertAlmostEqual(tableau.expectation(term), dense.expectation(term))
+        probabilities = dense.probabilities()
+        self.assertTrue(all(probabilities[int(key, 2)] > 0 for key in tableau.sample(100, seed=1)))
+        self.assertFalse(tableau.apply(gates.Gates.T, 0))
+
+    def test_measure_collapses(self):
+        tableau = stabilizer.StabilizerRegister(3).apply(gates.Gates.HADAMARD, 0).cnot(0, 1).cnot(1, 2)
+        outcome = tableau.measure(1, np.random.default_rng(0))
+        self.assertEqual(tableau.measure(0), outcome)
+        self.assertEqual(tableau.measure(2), outcome)
+        self.assertAlmostEqual(tableau.expectation("ZII"), 1 - 2 * outcome)
+
+    def test_wide_ghz(self):
+        tableau = stabilizer.StabilizerRegister(1000).apply(gates.Gates.HADAMARD, 0)
+        for qubit in range(999):
+            tableau.cnot(qubit, qubit + 1)
+        self.assertEqual(set(tableau.sample(20, seed=2)), {"0" * 1000, "1" * 1000})
+        self.assertAlmostEqual(tableau.expectation("X" * 1000), 1)
+        self.assertAlmostEqual(tableau.expectation("Z" + "I" * 999), 0)
+
+    def test_dispatch(self):
+        self.assertIsInstance(stabilizer.simulate(4, self.operations), stabilizer.StabilizerRegister)
+        mixed = self.operations + [operation.Operation(gates.Gates.T, (0,))]
+        self.assertFalse(stabilizer.isClifford(mixed))
+        self.assertIsInstance(stabilizer.simulate(4, mixed), register.Register)
+
+    def test_merged_phases(self):
+        # The optimiser merges Z then PHASE into a 3 pi / 2 DIAGONAL, which is S dagger and so still Clifford
+        def ghz(n):
+            operations = [operation.Operation(gates.Gates.HADAMARD, (0,))]
+            operations += [operation.Operation(gates.Gates.CNOT, (qubit, qubit + 1)) for qubit in range(n - 1)]
+            return optimiser.optimise(operations + [operation.Operation(gates.Gates.PAULI_Z, (0,)),
+                                                    operation.Operation(gates.Gates.PHASE, (0,))])[0]
+        self.assertEqual(ghz(40)[-1].gate, "DIAGONAL")
+        self.assertTrue(stabilizer.isClifford(ghz(40)))
+        self.assertFalse(stabilizer.isClifford([operation.Operation("DIAGONAL", (0,), np.diag([1, 1j ** 0.5]),
+                                                                    (np.pi / 4,))]))
+        tableau = stabilizer.StabilizerRegister(3).run(ghz(3))
+        dense = register.Register(3).run(ghz(3))
+        for pauli in ("XXX", "YXX", "XYX", "ZZI", "IZZ"):
+            self.assertAlmostEqual(tableau.expectation(pauli), dense.expectation(pauli))
+
+
 class TestSystem(unittest.TestCase):
 
     def setUp(self):
@@ -1151,6 +2113,10 @@ class TestVector(unittest.TestCase):
         result = self.vector.tensor(other_vector)
         self.assertIsInstance(result, vector.Vector)
         self.assertEqual(len(result.vector), self.size * len(other_vector.vector))
+        first, second = vector.Vector(2), vector.Vector(2)
+        first.setElement(1, 2)
+        second.setElement(0, 3)
+        self.assertEqual(first.tensor(second).vector, [0, 0, 6, 0])
 
     def test_repr(self):
         # Test the __repr__ method of the Vector class
@@ -1158,6 +2124,24 @@ class TestVector(unittest.TestCase):
         self.assertIsInstance(result, str)
         self.assertEqual(result, "(0, 0, 0, 0, 0)")
 
+    def test_unchecked_access(self):
+        # Test the unchecked fast path and the compact slots representation
+        self.vector._set(1, 2.5)
+        self.assertEqual(self.vector._get(1), 2.5)
+        self.assertEqual(self.vector.getElement(1), 2.5)
+        self.assertFalse(hasattr(self.vector, "__dict__"))
+
+    def test_array_mode(self):
+        # Test the numpy complex128 storage mode of the Vector class
+        array_vector = vector.Vector(2, array=True)
+        self.assertEqual(array_vector.vector.dtype, np.complex128)
+        self.assertTrue(array_vector.setElement(0, 3))
+        self.assertTrue(array_vector.setElement(1, 4j))
+        self.assertEqual(array_vector.magnitude(), 5.0)
+        self.assertTrue(np.allclose(array_vector.unit().vector, [0.6, 0.8j]))
+        self.assertTrue(np.allclose(array_vector.scalarMul(2).vector, [6, 8j]))
+        self.assertTrue(np.allclose(array_vector.tensor(array_vector).vector, [9, 12j, 12j, -16]))
+
 
 class TestWall(unittest.TestCase):
 
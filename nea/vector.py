@@ -1,13 +1,19 @@
 from math import sqrt
+from numbers import Number
 from typing import Self
 
+import numpy as np
+
 
 class Vector(object):
+    # Slots remove the per-instance __dict__, Cbit and Qbit still get one as they add their own attributes
+    __slots__ = ("vector", "array")
 
-    def __init__(self, size: int) -> None:
+    def __init__(self, size: int, array: bool = False) -> None:
         """
         Initialises the vector as a zero array of given size
         @param size: The size of the vector
+        @param array: If True the elements are stored in a contiguous complex128 numpy array rather than a list
         @return: None
         @raise: AssertionError
         """
@@ -18,7 +24,11 @@ class Vector(object):
         except AssertionError:
             print("E: Size parameter should be an integer")
             exit(1)
-        self.vector: list = [0] * size
+        self.array = array
+        if array:
+            self.vector: np.ndarray = np.zeros(size, dtype=np.complex128)
+        else:
+            self.vector: list = [0] * size
 
     def getElement(self, index: int) -> float | bool:
         """
@@ -46,7 +56,9 @@ class Vector(object):
             print("Index must be an integer less than or equal to the length of the list")
             return False  # Indicate failed execution
         try:
-            assert type(value) is float or type(value) is int
+            assert type(value) in (int, float, complex) or (isinstance(value, Number) and not isinstance(value, bool))
+            # The exact type check is tried first as the Number ABC check is slow
+            # Complex values are allowed as gates such as Y and P produce complex amplitudes
         except AssertionError:
             print("Value must be numeric")
             return False
@@ -54,6 +66,23 @@ class Vector(object):
         self.vector[index] = value
         return True  # Indicate successful execution
 
+    def _get(self, index: int) -> complex:
+        """
+        Unchecked version of getElement for internal hot loops, the caller guarantees the index is valid
+        @param index: The index of the element being retrieved
+        @return: Element
+        """
+        return self.vector[index]
+
+    def _set(self, index: int, value: complex) -> None:
+        """
+        Unchecked version of setElement for internal hot loops, the caller guarantees the index and value are valid
+        @param index: The index of the element being set
+        @param value: The value to be set
+        @return: None
+        """
+        self.vector[index] = value
+
     def scalarMul(self, num: float) -> Self | bool:
         """
         Performs scalar multiplication on a vector
@@ -61,14 +90,15 @@ class Vector(object):
         @return: multiplied vector if successful, else False
         """
         try:
-            assert (type(num) is float or type(num) is int)
+            assert isinstance(num, Number) and not isinstance(num, bool)
         except AssertionError:
             return False
-        mul_vec = Vector(len(self.vector))
+        mul_vec = Vector(len(self.vector), self.array)
         # Creates a new vector object so can be used without overwriting the underlying vector
-        for count, element in enumerate(self.vector):
-            mul_vec.setElement(int(count), num * element)
-
+        if self.array:
+            mul_vec.vector = self.vector * num
+        else:
+            mul_vec.vector = [num * element for element in self.vector]  # Elements are already known to be valid
         return mul_vec
 
     def __mul__(self, num: float) -> 'Vector':
@@ -103,7 +133,10 @@ class Vector(object):
         except AssertionError:
             print("'n' must be numeric")
             return False
-        self.vector = [n] * size
+        if self.array:
+            self.vector = np.full(size, n, dtype=np.complex128)
+        else:
+            self.vector = [n] * size
         return True
 
     def allZeros(self) -> bool:
@@ -111,6 +144,8 @@ class Vector(object):
         Returns true if every element of the vector is 0
         @return: True if all elements are 0, else False
         """
+        if self.array:
+            return not np.all(self.vector)
         return not (all(self.vector))
 
     def magnitude(self) -> float:
@@ -118,11 +153,9 @@ class Vector(object):
         Returns the size of the vector using standard analytic geometry formula sqrt(a^2 + b^2...)
         @return: The magnitude of the vector
         """
-        total = 0
-        for i in range(0, len(self.vector)):
-            total += (self.vector[i]) ** 2
-            # print(total)
-        return sqrt(total)
+        if self.array:
+            return float(np.linalg.norm(self.vector))
+        return sqrt(sum(abs(element) ** 2 for element in self.vector))  # abs so complex amplitudes contribute |a|^2
 
     def isUnit(self) -> bool:
         """
@@ -137,12 +170,14 @@ class Vector(object):
         @return: The new vector instance
         """
         size = len(self.vector)
-        unit_vec = Vector(size)  # create a new instance to not overwrite the existing case
+        unit_vec = Vector(size, self.array)  # create a new instance to not overwrite the existing case
         mag = self.magnitude()
         if mag == 0:
             return False
-        for count, ele in enumerate(self.vector):
-            unit_vec.setElement(int(count), ele / mag)
+        if self.array:
+            unit_vec.vector = self.vector / mag
+        else:
+            unit_vec.vector = [ele / mag for ele in self.vector]
         return unit_vec
 
     def tensor(self, other: 'Vector') -> Self | bool:
@@ -153,12 +188,11 @@ class Vector(object):
         if not (isinstance(other, object)):
             return False
         new_size = len(self.vector) * len(other.vector)
-        tensor_product = Vector(new_size)
-        i = -1
-        for count, element in enumerate(self.vector):
-            for count2, element2 in enumerate(other.vector):
-                i += 1
-                tensor_product.setElement(int(i), element * element2)
+        tensor_product = Vector(new_size, self.array)
+        if self.array:
+            tensor_product.vector = np.kron(self.vector, np.asarray(other.vector, dtype=np.complex128))
+        else:
+            tensor_product.vector = np.kron(self.vector, other.vector).tolist()
         return tensor_product
 
     def __repr__(self) -> str:
@@ -166,4 +200,6 @@ class Vector(object):
         Returns a human friendly version of the object using more traditional curved brackets
         @return: The representation of the vector
         """
+        if self.array:
+            return "(" + str(self.vector.tolist())[1:-1] + ")"
         return "(" + str(self.vector)[1:-1] + ")"